@@ -0,0 +1,116 @@
+"""
+Stress test for APICache: N threads and N processes hitting the same cache file
+
+    python benchmarks/cache_concurrency.py --workers 1 2 4 8 --batch-size 1 50
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from aiutils.cache import APICache
+
+
+class FakeResponse:
+    def __init__(self, kwargs):
+        self._kwargs = kwargs
+
+    def model_dump(self):
+        return {"choices": [{"message": {"content": "x" * 512}}], **self._kwargs}
+
+
+def fake_api(**kwargs):
+    return FakeResponse(kwargs)
+
+
+def make_cache(path_to_db, batch_size):
+    return APICache(
+        fake_api,
+        path_to_db=path_to_db,
+        batch_size=batch_size,
+        max_batch_delay=0.5,
+    )
+
+
+def run_calls(cache, n_calls, n_keys, seed):
+    rng = random.Random(seed)
+
+    for _ in range(n_calls):
+        cache(prompt=rng.randrange(n_keys))
+
+
+def thread_worker(cache, n_calls, n_keys, seed):
+    run_calls(cache, n_calls, n_keys, seed)
+
+
+def process_worker(path_to_db, batch_size, n_calls, n_keys, seed):
+    cache = make_cache(path_to_db, batch_size)
+    run_calls(cache, n_calls, n_keys, seed)
+    cache.close()
+
+
+def bench(mode, n_workers, batch_size, n_calls, n_keys):
+    with tempfile.TemporaryDirectory() as tmp:
+        path_to_db = str(Path(tmp, "cache.db"))
+        # create the schema up front so workers don't race to migrate
+        make_cache(path_to_db, batch_size).close()
+
+        start = time.perf_counter()
+
+        if mode == "threads":
+            cache = make_cache(path_to_db, batch_size)
+
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = [
+                    executor.submit(thread_worker, cache, n_calls, n_keys, seed)
+                    for seed in range(n_workers)
+                ]
+
+                for future in futures:
+                    future.result()
+
+            cache.close()
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [
+                    executor.submit(
+                        process_worker, path_to_db, batch_size, n_calls, n_keys, seed
+                    )
+                    for seed in range(n_workers)
+                ]
+
+                for future in futures:
+                    future.result()
+
+        elapsed = time.perf_counter() - start
+
+    return n_workers * n_calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 50])
+    parser.add_argument("--calls", type=int, default=2_000, help="Calls per worker")
+    parser.add_argument(
+        "--keys",
+        type=int,
+        default=1_000,
+        help="Number of distinct keys, lower means a higher hit rate",
+    )
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'workers':>8}{'batch':>8}{'calls/s':>12}")
+
+    for mode in ("threads", "processes"):
+        for batch_size in args.batch_size:
+            for n_workers in args.workers:
+                throughput = bench(mode, n_workers, batch_size, args.calls, args.keys)
+                print(f"{mode:<10}{n_workers:>8}{batch_size:>8}{throughput:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Compare the TEXT (JSON) storage format with the compressed binary formats:
+database size and latency of a cache hit (lookup + decode)
+
+    python benchmarks/cache_storage.py --entries 500
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from aiutils import _storage
+from aiutils.cache import APICache
+
+
+def fake_api():
+    pass
+
+
+def embedding_response(rng, n_inputs):
+    return {
+        "object": "list",
+        "data": [
+            {
+                "object": "embedding",
+                "index": i,
+                "embedding": [rng.uniform(-0.1, 0.1) for _ in range(1536)],
+            }
+            for i in range(n_inputs)
+        ],
+        "model": "text-embedding-3-small",
+        "usage": {"prompt_tokens": 8, "total_tokens": 8},
+    }
+
+
+def completion_response(rng):
+    words = ["cache", "sqlite", "token", "model", "prompt", "latency", "hit", "miss"]
+    content = " ".join(rng.choice(words) for _ in range(600))
+
+    return {
+        "id": "chatcmpl-123",
+        "object": "chat.completion",
+        "created": 1706991533,
+        "model": "gpt-4o-mini",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": {"prompt_tokens": 20, "completion_tokens": 600, "total_tokens": 620},
+    }
+
+
+def bench(compression, responses):
+    with tempfile.TemporaryDirectory() as tmp:
+        path_to_db = Path(tmp, "cache.db")
+        cache = APICache(
+            fake_api, path_to_db=path_to_db, compression=compression, batch_size=100
+        )
+
+        for i, response in enumerate(responses):
+            cache.insert(kwargs={"i": i}, response=response)
+
+        cache.flush()
+        cache.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cache.vacuum()
+        size = path_to_db.stat().st_size
+
+        start = time.perf_counter()
+
+        for i in range(len(responses)):
+            cache.lookup(kwargs={"i": i})
+
+        latency = (time.perf_counter() - start) / len(responses)
+        cache.close()
+
+    return size, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workloads = {
+        "embeddings": [embedding_response(rng, 1) for _ in range(args.entries)],
+        "completions": [completion_response(rng) for _ in range(args.entries)],
+    }
+
+    compressions = [None, "none", "zlib"]
+
+    try:
+        _storage._import_zstandard()
+        compressions.append("zstd")
+    except ModuleNotFoundError:
+        print("zstandard is not installed, skipping zstd\n")
+
+    print(f"{'workload':<13}{'format':<8}{'size (MB)':>11}{'hit (ms)':>10}")
+
+    for name, responses in workloads.items():
+        for compression in compressions:
+            size, latency = bench(compression, responses)
+            label = compression or "text"
+            print(f"{name:<13}{label:<8}{size / 1e6:>11.2f}{latency * 1e3:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Pages per second of Document.iter_prompts with different numbers of worker
+processes (the page cache is disabled so every page is processed)
+
+    python benchmarks/document_workers.py path/to/document.pdf --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import time
+
+from aiutils.document import Document
+
+
+def bench(path, n_workers, ordered):
+    document = Document(path, use_cache=False)
+
+    start = time.perf_counter()
+    n_pages = sum(1 for _ in document.iter_prompts(n_workers, ordered=ordered))
+    elapsed = time.perf_counter() - start
+
+    document.close()
+    return n_pages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="PDF to process")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--unordered", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+    print(f"{'workers':>8}{'pages/s':>10}")
+
+    for n_workers in args.workers:
+        throughput = bench(args.path, n_workers, ordered=not args.unordered)
+        print(f"{n_workers:>8}{throughput:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Micro-benchmark: FrozenJSON against the previous implementation (which
+wrapped children on every access, wrapped lists eagerly and deep-copied in
+to_dict) on a large chat completion
+
+    python benchmarks/frozenjson.py --choices 50 --repeat 2000
+"""
+
+import argparse
+import keyword
+import timeit
+import tracemalloc
+from collections.abc import Mapping, MutableSequence
+from copy import deepcopy
+
+from aiutils.frozenjson import FrozenJSON
+
+
+class LegacyFrozenJSON(object):
+    """FrozenJSON before __slots__, memoized children and lazy lists"""
+
+    def __new__(cls, arg):
+        if isinstance(arg, Mapping):
+            return super(LegacyFrozenJSON, cls).__new__(cls)
+
+        elif isinstance(arg, MutableSequence):
+            return [cls(item) for item in arg]
+        else:
+            return arg
+
+    def __init__(self, mapping):
+        self._path_to_file = None
+
+        self._data = {}
+
+        for key, value in mapping.items():
+            if keyword.iskeyword(key):
+                key += "_"
+
+            self._data[key] = value
+
+    def __getattr__(self, name):
+        if hasattr(self._data, name):
+            return getattr(self._data, name)
+        else:
+            return LegacyFrozenJSON(self._data[name])
+
+    def to_dict(self):
+        return deepcopy(self._data)
+
+
+def make_completion(n_choices):
+    return {
+        "id": "chatcmpl-123",
+        "object": "chat.completion",
+        "choices": [
+            {
+                "index": i,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "word " * 200},
+                "logprobs": {
+                    "content": [
+                        {"token": "word", "logprob": -0.1, "top_logprobs": []}
+                        for _ in range(50)
+                    ]
+                },
+            }
+            for i in range(n_choices)
+        ],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 200},
+    }
+
+
+def walk(response):
+    total = 0
+
+    for i in range(len(response.choices)):
+        total += len(response.choices[i].message.content)
+
+    return total
+
+
+def measure(operation, label, function, repeat):
+    seconds = min(timeit.repeat(function, number=repeat, repeat=3))
+
+    tracemalloc.start()
+
+    for _ in range(repeat):
+        function()
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{operation:<10}{label:<28}{seconds / repeat * 1e6:>12.2f}{peak:>14,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--choices", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=2_000)
+    args = parser.parse_args()
+
+    completion = make_completion(args.choices)
+    legacy, current = LegacyFrozenJSON(completion), FrozenJSON(completion)
+
+    print(f"{'operation':<10}{'implementation':<28}{'us/op':>12}{'peak bytes':>14}")
+
+    cases = [
+        ("wrap", "LegacyFrozenJSON", lambda: LegacyFrozenJSON(completion)),
+        ("wrap", "FrozenJSON", lambda: FrozenJSON(completion)),
+        ("walk", "LegacyFrozenJSON", lambda: walk(legacy)),
+        ("walk", "FrozenJSON", lambda: walk(current)),
+        ("walk", "FrozenJSON (first access)", lambda: walk(FrozenJSON(completion))),
+        ("to_dict", "LegacyFrozenJSON", legacy.to_dict),
+        ("to_dict", "FrozenJSON", current.to_dict),
+        ("to_dict", "FrozenJSON (copy=False)", lambda: current.to_dict(copy=False)),
+    ]
+
+    for operation, label, function in cases:
+        measure(operation, label, function, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
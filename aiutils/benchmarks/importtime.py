@@ -0,0 +1,55 @@
+"""
+Import time of aiutils modules, measured in a fresh interpreter with
+python -X importtime (the cumulative time of the module itself)
+
+    python benchmarks/importtime.py aiutils.cache aiutils.text aiutils.document
+"""
+
+import argparse
+import subprocess
+import sys
+
+MODULES = [
+    "aiutils",
+    "aiutils.cache",
+    "aiutils.text",
+    "aiutils.tables",
+    "aiutils.document",
+]
+
+
+def import_time(module):
+    """Return the cumulative import time of module in seconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+    # lines look like: "import time:   self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        _, _, fields = line.partition("import time:")
+        parts = [part.strip() for part in fields.split("|")]
+
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1e6
+
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'module':<20}{'seconds':>10}")
+
+    for module in args.modules:
+        print(f"{module:<20}{import_time(module):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
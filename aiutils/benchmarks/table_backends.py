@@ -0,0 +1,146 @@
+"""
+Accuracy and latency of the table detection backends against the
+full-precision PyTorch models, over a fixture set of PDF pages
+
+    python benchmarks/table_backends.py a.pdf b.pdf --pages 3 --backends quantized onnx
+
+Detections are matched to the "torch" ones with the same label by IoU; recall
+is the fraction of reference detections matched, precision the fraction of
+the backend's detections that match a reference one
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from aiutils import tables
+from aiutils.document import Document
+
+
+def iou(a, b):
+    """IoU between every box in a (n, 4) and every box in b (m, 4)"""
+    a, b = np.asarray(a, dtype=float).reshape(-1, 4), np.asarray(b).reshape(-1, 4)
+    width = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(
+        a[:, None, 0], b[None, :, 0]
+    )
+    height = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(
+        a[:, None, 1], b[None, :, 1]
+    )
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection)
+
+
+def match(reference, predicted, threshold):
+    """Return (matched, n_reference, n_predicted), greedily by label and IoU"""
+    matched = 0
+
+    for label in {o["label"] for o in reference} | {o["label"] for o in predicted}:
+        ref = [o["bbox"] for o in reference if o["label"] == label]
+        pred = [o["bbox"] for o in predicted if o["label"] == label]
+
+        if not ref or not pred:
+            continue
+
+        overlaps = iou(ref, pred)
+
+        while overlaps.size and overlaps.max() >= threshold:
+            i, j = np.unravel_index(overlaps.argmax(), overlaps.shape)
+            overlaps[i, :] = overlaps[:, j] = 0
+            matched += 1
+
+    return matched, len(reference), len(predicted)
+
+
+def load_fixtures(paths, n_pages):
+    pages = []
+
+    for path in paths:
+        document = Document(path, use_cache=False)
+
+        for page_number in range(min(n_pages, document.n_pages)):
+            pages.append(document.get_page_as_image(page_number))
+
+        document.close()
+
+    return pages
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(backend, pages, crops):
+    detector = tables.TableDetector(backend)
+    structure = tables.TableStructureDetector(backend)
+
+    # warm up (e.g., the ONNX export and session creation)
+    detector.detect_batch(pages[:1])
+
+    detected, detection_seconds = timed(detector.detect_batch, pages)
+    structures, structure_seconds = timed(structure.detect_batch, crops)
+
+    return (
+        detected,
+        [cells for _, cells in structures],
+        detection_seconds / len(pages),
+        structure_seconds / max(len(crops), 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="+", help="PDFs to use as fixtures")
+    parser.add_argument("--pages", type=int, default=3, help="Pages per PDF")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["quantized", "onnx"],
+        choices=["quantized", "onnx"],
+    )
+    parser.add_argument("--iou", type=float, default=0.5)
+    args = parser.parse_args()
+
+    pages = load_fixtures(args.paths, args.pages)
+
+    # crop with the reference detections so every backend sees the same tables
+    reference_tables = tables.TableDetector("torch").detect_batch(pages)
+    crops = [
+        crop
+        for page, page_tables in zip(pages, reference_tables)
+        for crop in tables.crop_tables(page, page_tables)
+    ]
+    reference = run("torch", pages, crops)
+
+    print(f"{len(pages)} pages, {len(crops)} tables")
+    print(
+        f"{'backend':<11}{'model':<11}{'s/image':>9}{'speedup':>9}"
+        f"{'precision':>11}{'recall':>8}"
+    )
+
+    for backend in ["torch", *args.backends]:
+        result = reference if backend == "torch" else run(backend, pages, crops)
+
+        for index, model in ((0, "detection"), (1, "structure")):
+            counts = np.array(
+                [
+                    match(ref, pred, args.iou)
+                    for ref, pred in zip(reference[index], result[index])
+                ]
+            ).reshape(-1, 3)
+            matched, n_reference, n_predicted = counts.sum(axis=0)
+            seconds = result[index + 2]
+            speedup = reference[index + 2] / seconds if seconds else float("nan")
+            print(
+                f"{backend:<11}{model:<11}{seconds:>9.3f}{speedup:>9.2f}"
+                f"{matched / max(n_predicted, 1):>11.3f}"
+                f"{matched / max(n_reference, 1):>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Time to turn OCR'ed table rows into a DataFrame: the previous CSV round trip
+through output.csv against table_to_dataframe (the OCR itself is not included)
+
+    python benchmarks/tables_ocr_io.py --rows 10 30 100 --columns 10
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import timeit
+
+import pandas as pd
+
+from aiutils.tables import table_to_dataframe
+
+
+def make_table(n_rows, n_columns):
+    return {str(i): [f"cell {i}-{j}" for j in range(n_columns)] for i in range(n_rows)}
+
+
+def csv_round_trip(data):
+    """What apply_ocr used to do"""
+    with open("output.csv", "w") as result_file:
+        wr = csv.writer(result_file, dialect="excel")
+
+        for row, row_text in data.items():
+            wr.writerow(row_text)
+
+    return pd.read_csv("output.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 30, 100])
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'rows':>6}{'csv (ms)':>12}{'memory (ms)':>14}{'saved (ms)':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+
+        for n_rows in args.rows:
+            data = make_table(n_rows, args.columns)
+            on_disk, in_memory = (
+                min(timeit.repeat(lambda: f(data), number=args.repeat, repeat=3))
+                / args.repeat
+                * 1e3
+                for f in (csv_round_trip, table_to_dataframe)
+            )
+            print(
+                f"{n_rows:>6}{on_disk:>12.3f}{in_memory:>14.3f}"
+                f"{on_disk - in_memory:>12.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
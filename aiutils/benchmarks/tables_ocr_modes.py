@@ -0,0 +1,71 @@
+"""
+Seconds per table of apply_ocr with mode="cell" (one readtext call per cell)
+and mode="table" (one readtext call per table), over the tables of a PDF, and
+how many tables and cells get the same text in both modes
+
+    python benchmarks/tables_ocr_modes.py path/to/document.pdf --pages 0 1 2
+"""
+
+import argparse
+import time
+from itertools import zip_longest
+
+from aiutils import tables
+from aiutils.document import Document
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="PDF with tables")
+    parser.add_argument("--pages", type=int, nargs="+", default=[0])
+    args = parser.parse_args()
+
+    document = Document(args.path, use_cache=False)
+    pages = [document.get_page_as_image(page_number) for page_number in args.pages]
+    detected = tables.TableDetector().detect_batch(pages)
+    cropped = [
+        image
+        for page, page_tables in zip(pages, detected)
+        for image in tables.crop_tables(page, page_tables)
+    ]
+    structures = tables.TableStructureDetector().detect_batch(cropped)
+    coords = [tables.cell_grid(cells) for _, cells in structures]
+    n_cells = sum(grid.cells.shape[0] * grid.cells.shape[1] for grid in coords)
+
+    print(f"{len(cropped)} tables, {n_cells} cells")
+    print(f"{'mode':<8}{'s/table':>10}")
+
+    data = {}
+
+    for mode in ("cell", "table"):
+        start = time.perf_counter()
+        data[mode] = [
+            tables.apply_ocr(table_coords, image, mode=mode).data or {}
+            for table_coords, image in zip(coords, cropped)
+        ]
+        elapsed = time.perf_counter() - start
+        print(f"{mode:<8}{elapsed / max(len(cropped), 1):>10.3f}")
+
+    same_tables = sum(c == t for c, t in zip(data["cell"], data["table"]))
+    cells = [
+        (c, t)
+        for by_cell, by_table in zip(data["cell"], data["table"])
+        for row in by_cell.keys() | by_table.keys()
+        for c, t in zip_longest(by_cell.get(row, []), by_table.get(row, []))
+    ]
+    same_cells = sum(c == t for c, t in cells)
+
+    print(
+        f"same output: {same_tables}/{len(cropped)} tables, "
+        f"{same_cells}/{len(cells)} cells"
+    )
+
+    for i, (by_cell, by_table) in enumerate(zip(data["cell"], data["table"])):
+        if by_cell != by_table:
+            print(f"\ntable {i}\n  cell:  {by_cell}\n  table: {by_table}")
+
+    document.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Post-processing of the table-transformer outputs: the previous Python-loop
+implementations against the vectorized ones, on dense synthetic tables
+
+    python benchmarks/tables_postprocessing.py --rows 100 300 1000 --columns 10
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from aiutils import tables
+
+
+def legacy_get_cell_coordinates_by_row(table_data):
+    rows = [entry for entry in table_data if entry["label"] == "table row"]
+    columns = [entry for entry in table_data if entry["label"] == "table column"]
+
+    rows.sort(key=lambda x: x["bbox"][1])
+    columns.sort(key=lambda x: x["bbox"][0])
+
+    cell_coordinates = []
+
+    for row in rows:
+        row_cells = []
+        for column in columns:
+            cell_bbox = [
+                column["bbox"][0],
+                row["bbox"][1],
+                column["bbox"][2],
+                row["bbox"][3],
+            ]
+            row_cells.append({"column": column["bbox"], "cell": cell_bbox})
+
+        row_cells.sort(key=lambda x: x["column"][0])
+        cell_coordinates.append(
+            {"row": row["bbox"], "cells": row_cells, "cell_count": len(row_cells)}
+        )
+
+    cell_coordinates.sort(key=lambda x: x["row"][1])
+
+    return cell_coordinates
+
+
+def legacy_detections(logits, pred_boxes, img_size, id2label):
+    """outputs_to_objects without torch: per-query Python loop"""
+    width, height = img_size
+    objects = []
+
+    for query_logits, (x_c, y_c, w, h) in zip(logits.tolist(), pred_boxes.tolist()):
+        exp = [np.exp(value - max(query_logits)) for value in query_logits]
+        probabilities = [value / sum(exp) for value in exp]
+        score = max(probabilities)
+        label = probabilities.index(score)
+        class_label = id2label[label]
+
+        if not class_label == "no object":
+            bbox = [
+                (x_c - 0.5 * w) * width,
+                (y_c - 0.5 * h) * height,
+                (x_c + 0.5 * w) * width,
+                (y_c + 0.5 * h) * height,
+            ]
+            objects.append(
+                {
+                    "label": class_label,
+                    "score": float(score),
+                    "bbox": [float(elem) for elem in bbox],
+                }
+            )
+
+    return objects
+
+
+def vectorized_detections(logits, pred_boxes, img_size, id2label):
+    detections = tables.detections_from_arrays(logits, pred_boxes, img_size)
+    return tables.detections_to_objects(detections, id2label)
+
+
+def make_structure(n_rows, n_columns, rng):
+    structure = [
+        {"label": "table row", "bbox": [0, i * 10, n_columns * 10, i * 10 + 10]}
+        for i in range(n_rows)
+    ] + [
+        {"label": "table column", "bbox": [j * 10, 0, j * 10 + 10, n_rows * 10]}
+        for j in range(n_columns)
+    ]
+    rng.shuffle(structure)
+    return structure
+
+
+def make_outputs(n_queries, n_classes, rng):
+    logits = rng.normal(size=(n_queries, n_classes)).astype(np.float32)
+    pred_boxes = rng.uniform(size=(n_queries, 4)).astype(np.float32)
+    id2label = {i: f"class {i}" for i in range(n_classes - 1)}
+    id2label[n_classes - 1] = "no object"
+    return logits, pred_boxes, id2label
+
+
+def per_call_ms(function, repeat):
+    return min(timeit.repeat(function, number=repeat, repeat=3)) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    print(f"{'benchmark':<28}{'legacy (ms)':>14}{'vectorized (ms)':>18}")
+
+    for n_rows in args.rows:
+        structure = make_structure(n_rows, args.columns, rng)
+        legacy = per_call_ms(
+            lambda: legacy_get_cell_coordinates_by_row(structure), args.repeat
+        )
+        vectorized = per_call_ms(
+            lambda: tables.get_cell_coordinates_by_row(structure), args.repeat
+        )
+        grid_only = per_call_ms(lambda: tables.cell_grid(structure), args.repeat)
+        name = f"cells {n_rows}x{args.columns}"
+        print(f"{name:<28}{legacy:>14.3f}{vectorized:>18.3f}")
+        print(f"{name + ' (CellGrid)':<28}{'':>14}{grid_only:>18.3f}")
+
+    for n_queries in (125, 500):
+        logits, pred_boxes, id2label = make_outputs(n_queries, 7, rng)
+        legacy = per_call_ms(
+            lambda: legacy_detections(logits, pred_boxes, (1000, 1000), id2label),
+            args.repeat,
+        )
+        vectorized = per_call_ms(
+            lambda: vectorized_detections(logits, pred_boxes, (1000, 1000), id2label),
+            args.repeat,
+        )
+        name = f"objects {n_queries} queries"
+        print(f"{name:<28}{legacy:>14.3f}{vectorized:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
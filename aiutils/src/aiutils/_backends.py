@@ -0,0 +1,145 @@
+"""
+Runtimes for the table-transformer models used by aiutils.tables. Each
+backend loads a model and returns a callable that takes (pixel_values,
+pixel_mask) tensors and returns (logits, pred_boxes) as NumPy arrays
+
+* "torch": the full-precision PyTorch model, on CUDA if available
+* "quantized": the PyTorch model with its linear layers dynamically quantized
+  to int8, CPU only
+* "onnx": the model exported to ONNX (once, stored under
+  CACHE_PATH.parent / "models") and run with onnxruntime, CPU only. Once
+  exported, the PyTorch weights are no longer loaded
+"""
+
+import os
+import tempfile
+
+from aiutils import CACHE_PATH
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+PATH_TO_MODELS = CACHE_PATH.parent / "models"
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            'backend="onnx" requires onnxruntime: pip install onnxruntime onnx'
+        ) from e
+
+    return onnxruntime
+
+
+class TorchModel:
+    def __init__(self, model, device) -> None:
+        self._model = model
+        self._device = device
+
+    def __call__(self, pixel_values, pixel_mask):
+        import torch
+
+        with torch.no_grad():
+            outputs = self._model(
+                pixel_values.to(self._device),
+                pixel_mask=pixel_mask.to(self._device),
+            )
+
+        return outputs.logits.cpu().numpy(), outputs.pred_boxes.cpu().numpy()
+
+
+class ONNXModel:
+    def __init__(self, path) -> None:
+        onnxruntime = _import_onnxruntime()
+        self._session = onnxruntime.InferenceSession(
+            str(path), providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, pixel_values, pixel_mask):
+        logits, pred_boxes = self._session.run(
+            ["logits", "pred_boxes"],
+            {"pixel_values": pixel_values.numpy(), "pixel_mask": pixel_mask.numpy()},
+        )
+        return logits, pred_boxes
+
+
+def export_onnx(model, path):
+    """Export model to path, with dynamic batch size, height and width"""
+    import torch
+
+    class LogitsAndBoxes(torch.nn.Module):
+        def __init__(self, model) -> None:
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values, pixel_mask):
+            outputs = self.model(pixel_values, pixel_mask=pixel_mask)
+            return outputs.logits, outputs.pred_boxes
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".onnx")
+    os.close(fd)
+
+    try:
+        torch.onnx.export(
+            LogitsAndBoxes(model.eval()),
+            (
+                torch.zeros((1, 3, 800, 800)),
+                torch.ones((1, 800, 800), dtype=torch.long),
+            ),
+            tmp,
+            input_names=["pixel_values", "pixel_mask"],
+            output_names=["logits", "pred_boxes"],
+            dynamic_axes={
+                "pixel_values": {0: "batch", 2: "height", 3: "width"},
+                "pixel_mask": {0: "batch", 1: "height", 2: "width"},
+                "logits": {0: "batch"},
+                "pred_boxes": {0: "batch"},
+            },
+            opset_version=17,
+        )
+        # another process may have exported it meanwhile, both are identical
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load(name, backend="torch", revision=None):
+    """Load a model from the Hugging Face hub, returns (model, id2label)"""
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown backend {backend!r}, expected one of: {', '.join(BACKENDS)}"
+        )
+
+    from transformers import AutoConfig, AutoModelForObjectDetection
+
+    kwargs = {} if revision is None else {"revision": revision}
+
+    if backend == "onnx":
+        path = PATH_TO_MODELS / f"{name.replace('/', '--')}-{revision or 'main'}.onnx"
+
+        # once exported, only the config is needed (for the labels)
+        if path.exists():
+            id2label = AutoConfig.from_pretrained(name, **kwargs).id2label
+        else:
+            model = AutoModelForObjectDetection.from_pretrained(name, **kwargs)
+            id2label = model.config.id2label
+            export_onnx(model, path)
+
+        return ONNXModel(path), id2label
+
+    import torch
+
+    model = AutoModelForObjectDetection.from_pretrained(name, **kwargs)
+    id2label = model.config.id2label
+
+    if backend == "torch":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        return TorchModel(model.to(device), device), id2label
+
+    quantized = torch.ao.quantization.quantize_dynamic(
+        model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return TorchModel(quantized, "cpu"), id2label
@@ -1,14 +1,25 @@
+import inspect
 from threading import Lock
 
 
 # https://refactoring.guru/design-patterns/singleton/python/example
 class SingletonMeta(type):
+    """
+    One instance per class and arguments, e.g., TableDetector() and
+    TableDetector(backend="torch") are the same instance but
+    TableDetector(backend="onnx") is another one
+    """
+
     _instances = {}
     _lock: Lock = Lock()
 
     def __call__(cls, *args, **kwargs):
+        bound = inspect.signature(cls.__init__).bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        key = (cls, tuple(bound.arguments.items())[1:])
+
         with cls._lock:
-            if cls not in cls._instances:
+            if key not in cls._instances:
                 instance = super().__call__(*args, **kwargs)
-                cls._instances[cls] = instance
-        return cls._instances[cls]
+                cls._instances[key] = instance
+        return cls._instances[key]
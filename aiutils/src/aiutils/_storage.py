@@ -0,0 +1,141 @@
+"""
+Compact binary encoding for cached API responses
+
+A response is stored as MAGIC + one byte identifying the compression codec +
+the compressed payload. The payload is a 4-byte length, a JSON header and a
+buffer of little-endian float64 values. Lists of floats (e.g., embeddings) are
+taken out of the JSON document and stored in the buffer; the header records
+where to put them back
+"""
+
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"AIC1"
+
+# lists of floats shorter than this stay in the JSON document
+MIN_FLOAT_ARRAY = 16
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+_CODECS = {"none": 0, "zlib": 1, "zstd": 2}
+_CODEC_NAMES = {v: k for k, v in _CODECS.items()}
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            "zstd compression requires zstandard: pip install zstandard"
+        ) from e
+
+    return zstandard
+
+
+def _compress(data, codec):
+    if codec == "none":
+        return data
+    elif codec == "zlib":
+        return zlib.compress(data)
+    else:
+        return _import_zstandard().ZstdCompressor().compress(data)
+
+
+def _decompress(data, codec):
+    if codec == "none":
+        return data
+    elif codec == "zlib":
+        return zlib.decompress(data)
+    else:
+        return _import_zstandard().ZstdDecompressor().decompress(data)
+
+
+def _is_float_array(value):
+    return (
+        isinstance(value, list)
+        and len(value) >= MIN_FLOAT_ARRAY
+        and all(type(item) is float for item in value)
+    )
+
+
+def _extract_float_arrays(value, path, arrays, floats):
+    """
+    Return a copy of value with float arrays replaced by None, appending
+    (path, length) to arrays and the values to floats
+    """
+    if isinstance(value, dict):
+        return {
+            k: _extract_float_arrays(v, path + [k], arrays, floats)
+            for k, v in value.items()
+        }
+    elif _is_float_array(value):
+        arrays.append([path, len(value)])
+        floats.extend(value)
+        return None
+    elif isinstance(value, list):
+        return [
+            _extract_float_arrays(item, path + [i], arrays, floats)
+            for i, item in enumerate(value)
+        ]
+    else:
+        return value
+
+
+def encode(response, compression="zlib"):
+    """Encode a JSON-serializable response as bytes"""
+    if compression not in _CODECS:
+        raise ValueError(
+            f"Unknown compression {compression!r}, expected one of: "
+            f"{', '.join(_CODECS)}"
+        )
+
+    arrays, floats = [], array("d")
+    document = _extract_float_arrays(response, [], arrays, floats)
+
+    if sys.byteorder != "little":
+        floats.byteswap()
+
+    header = json.dumps({"document": document, "arrays": arrays}).encode("utf-8")
+    payload = _HEADER_LENGTH.pack(len(header)) + header + floats.tobytes()
+
+    return MAGIC + bytes([_CODECS[compression]]) + _compress(payload, compression)
+
+
+def decode(data):
+    """Decode bytes created by encode()"""
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not an encoded response")
+
+    codec = _CODEC_NAMES[data[len(MAGIC)]]
+    payload = memoryview(_decompress(data[len(MAGIC) + 1 :], codec))
+
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload)
+    header_end = _HEADER_LENGTH.size + header_length
+    header = json.loads(bytes(payload[_HEADER_LENGTH.size : header_end]))
+
+    document = header["document"]
+    floats = array("d", bytes(payload[header_end:]))
+    offset = 0
+
+    if sys.byteorder != "little":
+        floats.byteswap()
+
+    for path, length in header["arrays"]:
+        values = floats[offset : offset + length].tolist()
+        offset += length
+
+        if not path:
+            return values
+
+        parent = document
+
+        for part in path[:-1]:
+            parent = parent[part]
+
+        parent[path[-1]] = values
+
+    return document
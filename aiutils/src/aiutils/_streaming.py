@@ -0,0 +1,132 @@
+"""
+Assemble streamed chat completion chunks into a single chat completion, and
+replay a chat completion as a stream of chunks
+"""
+
+# number of characters of content per replayed chunk
+REPLAY_CHUNK_SIZE = 16
+
+
+def _merge_tool_calls(tool_calls, deltas):
+    """Merge tool call deltas, whose arguments arrive in pieces, by index"""
+    for delta in deltas:
+        index = delta.get("index", len(tool_calls))
+
+        while len(tool_calls) <= index:
+            tool_calls.append(
+                {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                }
+            )
+
+        tool_call = tool_calls[index]
+
+        if delta.get("id"):
+            tool_call["id"] = delta["id"]
+
+        if delta.get("type"):
+            tool_call["type"] = delta["type"]
+
+        function = delta.get("function") or {}
+        tool_call["function"]["name"] += function.get("name") or ""
+        tool_call["function"]["arguments"] += function.get("arguments") or ""
+
+
+def assemble(chunks):
+    """Build a chat.completion response from a list of chat.completion.chunk"""
+    if not chunks:
+        raise ValueError("Cannot assemble an empty stream")
+
+    first = chunks[0]
+    choices = {}
+    usage = None
+
+    for chunk in chunks:
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+
+        for choice in chunk.get("choices") or []:
+            assembled = choices.setdefault(
+                choice["index"],
+                {
+                    "index": choice["index"],
+                    "message": {"role": "assistant", "content": None},
+                    "finish_reason": None,
+                    "logprobs": None,
+                },
+            )
+            message = assembled["message"]
+            delta = choice.get("delta") or {}
+
+            if delta.get("role"):
+                message["role"] = delta["role"]
+
+            if delta.get("content") is not None:
+                message["content"] = (message["content"] or "") + delta["content"]
+
+            if delta.get("tool_calls"):
+                _merge_tool_calls(
+                    message.setdefault("tool_calls", []), delta["tool_calls"]
+                )
+
+            if choice.get("finish_reason"):
+                assembled["finish_reason"] = choice["finish_reason"]
+
+    return {
+        "id": first.get("id"),
+        "object": "chat.completion",
+        "created": first.get("created"),
+        "model": first.get("model"),
+        "system_fingerprint": first.get("system_fingerprint"),
+        "choices": [choices[index] for index in sorted(choices)],
+        "usage": usage,
+    }
+
+
+def replay(response, chunk_size=REPLAY_CHUNK_SIZE):
+    """Yield chat.completion.chunk dictionaries that assemble into response"""
+
+    def chunk(choices, usage=None):
+        return {
+            "id": response.get("id"),
+            "object": "chat.completion.chunk",
+            "created": response.get("created"),
+            "model": response.get("model"),
+            "system_fingerprint": response.get("system_fingerprint"),
+            "choices": choices,
+            "usage": usage,
+        }
+
+    def delta(index, finish_reason=None, **values):
+        return {
+            "index": index,
+            "delta": values,
+            "finish_reason": finish_reason,
+            "logprobs": None,
+        }
+
+    for choice in response["choices"]:
+        index = choice["index"]
+        message = choice["message"]
+        content = message.get("content")
+
+        # like the API, the first chunk has the role and an empty content
+        # (or None if the message only has tool calls)
+        first = "" if content is not None else None
+        yield chunk(
+            [delta(index, role=message.get("role", "assistant"), content=first)]
+        )
+
+        if content:
+            for start in range(0, len(content), chunk_size):
+                yield chunk([delta(index, content=content[start : start + chunk_size])])
+
+        for i, tool_call in enumerate(message.get("tool_calls") or []):
+            yield chunk([delta(index, tool_calls=[{"index": i, **tool_call}])])
+
+        yield chunk([delta(index, finish_reason=choice["finish_reason"])])
+
+    if response.get("usage"):
+        yield chunk([], usage=response["usage"])
@@ -1,99 +1,1172 @@
 from pathlib import Path
 import sqlite3
 import json
+import hashlib
 import logging
+import asyncio
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import closing
+from threading import Event, Lock, Thread, local
+import atexit
+import weakref
 
 from aiutils import CACHE_PATH
+from aiutils import _storage, _streaming
 from aiutils.frozenjson import FrozenJSON
+from aiutils.stats import CacheStats
 
 logger = logging.getLogger(__name__)
 
+# bump this when the api_calls schema changes and add a migration to _MIGRATIONS
+SCHEMA_VERSION = 4
+
+# seconds between automatic evictions when a cache has a ttl or max_db_bytes
+EVICTION_INTERVAL = 60
+
+# accessed_at is only refreshed when older than this (in seconds), so hits
+# don't turn into a write every time
+ACCESS_RESOLUTION = 60
+
 
 def qualified_name(obj):
     return obj.__module__ + "." + obj.__qualname__
 
 
+def canonical_kwargs(kwargs: dict) -> str:
+    """Serialize kwargs so logically identical calls produce the same string"""
+    return json.dumps(kwargs, sort_keys=True, separators=(",", ":"))
+
+
+def hash_kwargs(kwargs: dict) -> str:
+    """Return the cache key for the given kwargs"""
+    return _hash(canonical_kwargs(kwargs))
+
+
+def _hash(serialized: str) -> str:
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _schema_version(cursor):
+    (version,) = cursor.execute("PRAGMA user_version").fetchone()
+    return version
+
+
+def _migrate_to_hashed_keys(connection):
+    """
+    Move rows from the original (qualified_name, kwargs, response) table, which
+    had no index and stored non-canonical kwargs, to the hashed-key schema
+    """
+    cursor = connection.cursor()
+    cursor.execute("ALTER TABLE api_calls RENAME TO api_calls_legacy")
+    _create_table(cursor)
+
+    rows = cursor.execute(
+        "SELECT qualified_name, kwargs, response FROM api_calls_legacy"
+    ).fetchall()
+
+    # later rows win when logically identical calls collapse into the same key
+    for name, kwargs, response in rows:
+        serialized = canonical_kwargs(json.loads(kwargs))
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO api_calls
+            (qualified_name, key_hash, kwargs, response)
+            VALUES (?, ?, ?, ?)
+        """,
+            (name, _hash(serialized), serialized, response),
+        )
+
+    cursor.execute("DROP TABLE api_calls_legacy")
+
+
+def _create_table(cursor):
+    # this is the version 1 schema, later changes are applied as migrations
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS api_calls (
+            qualified_name TEXT NOT NULL,
+            key_hash TEXT NOT NULL,
+            kwargs TEXT NOT NULL,
+            response TEXT NOT NULL
+        )
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS api_calls_key
+        ON api_calls (qualified_name, key_hash)
+    """
+    )
+
+
+def _migrate_add_timestamps(connection):
+    """Add the creation and last access times used for expiration and eviction"""
+    cursor = connection.cursor()
+    cursor.execute(
+        "ALTER TABLE api_calls ADD COLUMN created_at REAL NOT NULL DEFAULT 0"
+    )
+    cursor.execute(
+        "ALTER TABLE api_calls ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0"
+    )
+
+    # we don't know when existing entries were created, start counting now
+    now = time.time()
+    cursor.execute(
+        "UPDATE api_calls SET created_at = ?, accessed_at = ?",
+        (now, now),
+    )
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS api_calls_accessed_at ON api_calls (accessed_at)"
+    )
+
+
+def _migrate_add_locks(connection):
+    """Add the table that coordinates in-flight API calls across processes"""
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS api_calls_locks (
+            qualified_name TEXT NOT NULL,
+            key_hash TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            PRIMARY KEY (qualified_name, key_hash)
+        )
+    """
+    )
+
+
+def _migrate_add_latency_and_embeddings(connection):
+    """
+    Add how long the API took to produce each response (to report the time
+    saved by cache hits) and the prompt embeddings used by SemanticAPICache
+    """
+    connection.execute("ALTER TABLE api_calls ADD COLUMN latency REAL")
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS api_calls_embeddings (
+            qualified_name TEXT NOT NULL,
+            key_hash TEXT NOT NULL,
+            context_hash TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            PRIMARY KEY (qualified_name, key_hash)
+        )
+    """
+    )
+    connection.execute(
+        """
+        CREATE INDEX IF NOT EXISTS api_calls_embeddings_context
+        ON api_calls_embeddings (qualified_name, context_hash)
+    """
+    )
+
+
+def _live_size(connection):
+    """Bytes used by the database, excluding pages that a VACUUM would free"""
+    (page_count,) = connection.execute("PRAGMA page_count").fetchone()
+    (freelist_count,) = connection.execute("PRAGMA freelist_count").fetchone()
+    (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+    return (page_count - freelist_count) * page_size
+
+
+def _decode(raw):
+    """Decode a stored response, which is JSON text or _storage bytes"""
+    if isinstance(raw, bytes):
+        return _storage.decode(raw)
+
+    return json.loads(raw)
+
+
+def _flush_at_exit(ref):
+    cache = ref()
+
+    if cache is not None:
+        cache.flush()
+
+
+# maps the version a database is at to the function that upgrades it by one
+_MIGRATIONS = {
+    0: _migrate_to_hashed_keys,
+    1: _migrate_add_timestamps,
+    2: _migrate_add_locks,
+    3: _migrate_add_latency_and_embeddings,
+}
+
+
+class MemoryCache:
+    """
+    A bounded, in-process LRU mapping from cache keys to responses. Bounded by
+    number of entries, by the total size of the serialized responses, or both
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None) -> None:
+        if max_entries is None and max_bytes is None:
+            raise ValueError("Pass max_entries, max_bytes, or both")
+
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def n_bytes(self):
+        return self._n_bytes
+
+    def get(self, key, is_expired=None):
+        """
+        Return the value for key (and mark it as recently used) or None. If
+        passed, is_expired(value) is checked first: expired values are dropped
+        and counted as misses
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and is_expired is not None and is_expired(entry[0]):
+                self._discard(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store value, evicting the least recently used entries if needed"""
+        with self._lock:
+            self._discard(key)
+
+            # an entry that can never fit would evict everything else
+            if self._max_bytes is not None and size > self._max_bytes:
+                return
+
+            self._entries[key] = (value, size)
+            self._n_bytes += size
+
+            while (
+                self._max_entries is not None and len(self._entries) > self._max_entries
+            ) or (self._max_bytes is not None and self._n_bytes > self._max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._n_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._n_bytes -= entry[1]
+
+
+# a stored response: raw is JSON text or _storage bytes, latency is the number
+# of seconds the API took to produce it (None if unknown)
+Entry = namedtuple("Entry", ["raw", "created_at", "latency"])
+
+
+class _Flight:
+    """An in-flight API call that other callers can wait on"""
+
+    def __init__(self) -> None:
+        self._done = Event()
+        self._result = None
+        self._exception = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+
 class APICache:
-    def __init__(self, api_function, path_to_db=None) -> None:
+    """
+    Cache calls to an API function in a SQLite database
+
+    Parameters
+    ----------
+    api_function : callable
+        The function to cache, must return an object with a model_dump() method
+
+    path_to_db : str or pathlib.Path, optional
+        Path to the SQLite database, defaults to aiutils.CACHE_PATH
+
+    max_memory_entries : int, optional
+        If passed, keep up to this many responses in an in-process LRU cache
+        that is checked before the database
+
+    max_memory_bytes : int, optional
+        If passed, keep responses in an in-process LRU cache as long as their
+        serialized size adds up to at most this many bytes
+
+    ttl : float, optional
+        Seconds after which this function's cached responses expire
+
+    max_db_bytes : int, optional
+        If passed, the least recently used entries are evicted (in a background
+        thread, at most every EVICTION_INTERVAL seconds) when the database
+        grows larger than this. Call vacuum() to shrink the file afterwards
+
+    batch_size : int, default=1
+        Number of inserts to group in a single commit. Pending inserts are
+        visible to this object's lookups right away, and to other processes
+        after flush(), which runs when the batch is full, when the oldest
+        pending insert is older than max_batch_delay, and on close()
+
+    max_batch_delay : float, default=1.0
+        Seconds after which an incomplete batch is committed by the next insert
+
+    busy_timeout : float, default=30
+        Seconds to wait for another connection to release the write lock before
+        raising "database is locked"
+
+    single_flight : bool, default=True
+        If True, concurrent calls (from different threads) with the same kwargs
+        make a single API call and share its response (or exception)
+
+    cross_process : bool, default=False
+        If True, also coalesce concurrent calls from different processes by
+        taking a lock row in the database, other processes poll until the
+        response is stored
+
+    lock_timeout : float, default=300
+        Seconds after which a lock row is considered abandoned (e.g., the
+        process holding it died) and can be taken by another process
+
+    compression : {"none", "zlib", "zstd"}, optional
+        If passed, store new responses in a compact binary format instead of
+        JSON text: float arrays (e.g., embeddings) are stored as float64 and
+        the payload is compressed with the given codec ("zstd" requires the
+        zstandard package). Responses in either format are read back
+        transparently, but SQLite's JSON functions only work on JSON text
+
+    token_costs : dict, optional
+        Maps "prompt" and "completion" to the price of a token, used by
+        stats() to estimate the cost saved by cache hits
+
+    Notes
+    -----
+    Each thread gets its own connection and the database runs in WAL mode, so
+    an instance can be shared by threads and the same file by processes
+
+    Calls with stream=True return an iterator of chunks: on a miss, chunks are
+    yielded as the API produces them and the assembled completion is stored
+    once the stream is consumed; on a hit, the stored completion is replayed
+    as chunks. Streaming calls are not coalesced
+
+    Hits, misses and the time saved are counted in stats(), per-call messages
+    are only logged at the DEBUG level
+    """
+
+    def __init__(
+        self,
+        api_function,
+        path_to_db=None,
+        max_memory_entries=None,
+        max_memory_bytes=None,
+        ttl=None,
+        max_db_bytes=None,
+        batch_size=1,
+        max_batch_delay=1.0,
+        busy_timeout=30,
+        single_flight=True,
+        cross_process=False,
+        lock_timeout=300,
+        compression=None,
+        token_costs=None,
+    ) -> None:
         self._path_to_db = path_to_db or CACHE_PATH
-        self._connection = None
+        self._local = local()
+        self._connections = []
+        self._connections_lock = Lock()
+        self._busy_timeout = busy_timeout
+        self._batch_size = batch_size
+        self._max_batch_delay = max_batch_delay
+        self._pending = {}
+        self._pending_since = None
+        self._pending_lock = Lock()
+        self._single_flight = single_flight
+        self._cross_process = cross_process
+        self._lock_timeout = lock_timeout
+        self._compression = compression
+        self._flights = {}
+        self._flights_lock = Lock()
         self._api_function = api_function
         self._qualified_name = qualified_name(api_function)
+        self._stats = CacheStats(self._qualified_name, token_costs=token_costs)
+        self._ttl = ttl
+        self._max_db_bytes = max_db_bytes
+        self._eviction_lock = Lock()
+        self._evicting = False
+        self._last_eviction = time.monotonic()
+
+        if max_memory_entries is None and max_memory_bytes is None:
+            self._memory = None
+        else:
+            self._memory = MemoryCache(
+                max_entries=max_memory_entries, max_bytes=max_memory_bytes
+            )
+
+        self.create_db()
 
-        if not Path(self._path_to_db).exists():
-            self.create_db()
+        if batch_size > 1:
+            # don't lose pending inserts if the interpreter exits before close()
+            atexit.register(_flush_at_exit, weakref.ref(self))
+
+    @property
+    def memory(self):
+        """The in-process LRU cache, None if it's disabled"""
+        return self._memory
+
+    def stats(self):
+        """
+        Return this cache's counters: hits per tier ("memory", "db"), misses,
+        hit rate, bytes stored, seconds of API calls saved by hits, prompt
+        and completion tokens saved (and their estimated cost, if token_costs
+        was passed), and a histogram of lookup latencies. See
+        aiutils.stats.to_prometheus to export them
+        """
+        return self._stats.to_dict()
 
     @property
     def connection(self):
-        if self._connection is None:
-            self._connection = sqlite3.connect(self._path_to_db)
+        """The connection for the current thread"""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
 
-        return self._connection
+            with self._connections_lock:
+                self._connections.append(connection)
+
+        return connection
+
+    def _connect(self):
+        # autocommit mode: reads don't open transactions that would later
+        # need upgrading to a write lock, writes use BEGIN IMMEDIATE instead.
+        # check_same_thread=False only so close() can run on any thread
+        connection = sqlite3.connect(
+            self._path_to_db,
+            timeout=self._busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        # WAL makes commits durable on checkpoint instead of on every commit
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def close(self):
+        """Commit pending inserts and close every thread's connection"""
+        self.flush()
+
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+
+            self._connections.clear()
+
+        self._local = local()
 
     def __del__(self):
-        if self._connection is not None:
-            self._connection.close()
+        try:
+            self.close()
+        except Exception:
+            pass
 
     def create_db(self):
+        """Create the api_calls table or upgrade it to the current schema"""
         Path(self._path_to_db).parent.mkdir(parents=True, exist_ok=True)
         cursor = self.connection.cursor()
 
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS api_calls (
-                qualified_name TEXT,
-                kwargs TEXT,
-                response TEXT
-            )
-        """
-        )
+        # readers don't block writers (and vice versa) in WAL mode, the
+        # setting is stored in the database file
+        cursor.execute("PRAGMA journal_mode = WAL")
+
+        if _schema_version(cursor) == SCHEMA_VERSION:
+            return
+
+        # take the write lock before checking again so only one process
+        # migrates, and so a failed migration leaves the database untouched
+        with self.connection:
+            cursor.execute("BEGIN IMMEDIATE")
+            version = _schema_version(cursor)
 
-        self.connection.commit()
+            exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='api_calls'"
+            ).fetchone()
+
+            # new databases start at version 1 and go through the migrations
+            if not exists:
+                _create_table(cursor)
+                version = 1
+
+            for from_version in range(version, SCHEMA_VERSION):
+                logger.info(
+                    "Migrating cache database %s from schema version %s",
+                    self._path_to_db,
+                    from_version,
+                )
+                _MIGRATIONS[from_version](self.connection)
+
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
     def insert(self, *, kwargs: dict, response: dict):
-        cursor = self.connection.cursor()
+        serialized = canonical_kwargs(kwargs)
+        key = _hash(serialized)
+        raw = self._encode(response)
 
-        cursor.execute(
-            """
-            INSERT INTO api_calls (qualified_name, kwargs, response)
-            VALUES (?, ?, ?)
-        """,
-            (
-                self._qualified_name,
-                json.dumps(kwargs),
-                json.dumps(response),
-            ),
-        )
+        entry = self._insert_raw(serialized=serialized, key=key, raw=raw)
 
-        self.connection.commit()
+        # keep the in-memory copy in sync so it never shadows the new response
+        self._remember(key, response, entry)
 
     def lookup(self, *, kwargs: dict):
+        found = self._lookup_raw(hash_kwargs(kwargs))
+        return None if found is None else _decode(found.raw)
+
+    def _encode(self, response):
+        if self._compression is None:
+            return json.dumps(response)
+
+        return _storage.encode(response, compression=self._compression)
+
+    def evict(self):
+        """
+        Delete this function's expired entries and, if the database is larger
+        than max_db_bytes, the least recently used entries (of any function)
+        until it fits. Returns the number of deleted entries
+        """
+        # use a separate connection so this can run in a background thread
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            deleted = 0
+
+            if self._ttl is not None:
+                deleted += connection.execute(
+                    "DELETE FROM api_calls WHERE qualified_name = ? AND created_at < ?",
+                    (self._qualified_name, time.time() - self._ttl),
+                ).rowcount
+
+            if self._max_db_bytes is not None:
+                deleted += self._evict_least_recently_used(connection)
+
+        if deleted:
+            logger.info("Evicted %s entries from %s", deleted, self._path_to_db)
+
+        return deleted
+
+    def _evict_least_recently_used(self, connection):
+        deleted = 0
+
+        # estimate each row's share of the file from its size, then measure
+        # again: the estimate includes fixed overhead so it errs on the side
+        # of deleting too few rows, not too many
+        while (live_size := _live_size(connection)) > self._max_db_bytes:
+            (total,) = connection.execute(
+                "SELECT SUM(length(kwargs) + length(response)) FROM api_calls"
+            ).fetchone()
+
+            if not total:
+                break
+
+            excess = live_size - self._max_db_bytes
+            scale = live_size / total
+            rows = connection.execute(
+                """
+                SELECT rowid, length(kwargs) + length(response)
+                FROM api_calls ORDER BY accessed_at, rowid
+            """
+            )
+
+            to_delete = []
+
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+
+                to_delete.append((rowid,))
+                excess -= size * scale
+
+            if not to_delete:
+                break
+
+            connection.executemany("DELETE FROM api_calls WHERE rowid = ?", to_delete)
+            deleted += len(to_delete)
+
+        return deleted
+
+    def vacuum(self):
+        """Rebuild the database file to return the space freed by evict()"""
+        with closing(self._connect()) as connection:
+            connection.execute("VACUUM")
+
+    def _maybe_evict(self):
+        if self._ttl is None and self._max_db_bytes is None:
+            return
+
+        now = time.monotonic()
+
+        with self._eviction_lock:
+            if self._evicting or now - self._last_eviction < EVICTION_INTERVAL:
+                return
+
+            self._evicting = True
+            self._last_eviction = now
+
+        def evict():
+            try:
+                self.evict()
+            except sqlite3.Error:
+                logger.exception("Failed to evict entries from %s", self._path_to_db)
+            finally:
+                self._evicting = False
+
+        Thread(target=evict, daemon=True).start()
+
+    def _insert_raw(self, *, serialized, key, raw, latency=None):
+        """Store raw (possibly in the next batch), returns the stored Entry"""
+        entry = Entry(raw=raw, created_at=time.time(), latency=latency)
+        self._stats.record_store(len(raw))
+
+        with self._pending_lock:
+            self._pending[key] = (serialized, entry)
+
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+
+            flush = (
+                len(self._pending) >= self._batch_size
+                or time.monotonic() - self._pending_since >= self._max_batch_delay
+            )
+
+        if flush:
+            self.flush()
+
+        return entry
+
+    def flush(self):
+        """Commit pending inserts in a single transaction"""
+        with self._pending_lock:
+            if not self._pending:
+                return
+
+            pending = self._pending
+            self._pending = {}
+            self._pending_since = None
+
+        connection = self.connection
+
+        # a failed commit must not lose the batch, put it back for the next one
+        try:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    """
+                    INSERT OR REPLACE INTO api_calls
+                    (qualified_name, key_hash, kwargs, response,
+                    created_at, accessed_at, latency)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                    (
+                        (
+                            self._qualified_name,
+                            key,
+                            serialized,
+                            entry.raw,
+                            entry.created_at,
+                            entry.created_at,
+                            entry.latency,
+                        )
+                        for key, (serialized, entry) in pending.items()
+                    ),
+                )
+        except sqlite3.Error:
+            with self._pending_lock:
+                self._pending = {**pending, **self._pending}
+                self._pending_since = self._pending_since or time.monotonic()
+
+            raise
+
+        self._maybe_evict()
+
+    def _lookup_raw(self, key):
+        """Return the stored Entry or None if missing or expired"""
+        pending = self._pending.get(key)
+
+        if pending is not None:
+            return pending[1]
+
         cursor = self.connection.cursor()
 
         cursor.execute(
             """
-            SELECT response FROM api_calls
-            WHERE qualified_name = ? AND kwargs = ?
+            SELECT response, created_at, accessed_at, latency FROM api_calls
+            WHERE qualified_name = ? AND key_hash = ?
         """,
-            (self._qualified_name, json.dumps(kwargs)),
+            (self._qualified_name, key),
         )
 
-        response = cursor.fetchone()
+        row = cursor.fetchone()
+
+        # release the statement's read lock right away
+        cursor.close()
+
+        if row is None:
+            return None
+
+        response, created_at, accessed_at, latency = row
+        now = time.time()
+
+        if self._is_expired(created_at, now):
+            return None
+
+        if now - accessed_at > ACCESS_RESOLUTION:
+            self.connection.execute(
+                """
+                UPDATE api_calls SET accessed_at = ?
+                WHERE qualified_name = ? AND key_hash = ?
+            """,
+                (now, self._qualified_name, key),
+            )
+
+        return Entry(raw=response, created_at=created_at, latency=latency)
 
-        return None if response is None else json.loads(response[0])
+    def _is_expired(self, created_at, now):
+        return self._ttl is not None and now - created_at > self._ttl
 
     def __call__(self, **kwargs):
-        response = self.lookup(kwargs=kwargs)
+        start = time.perf_counter()
+        serialized = canonical_kwargs(kwargs)
+        key = _hash(serialized)
+
+        if kwargs.get("stream"):
+            return self._stream(kwargs=kwargs, serialized=serialized, key=key)
+
+        response = self._lookup_memory(key)
+
+        if response is not None:
+            self._stats.observe_lookup(time.perf_counter() - start)
+            return response
+
+        found = self._lookup_raw(key)
+        self._stats.observe_lookup(time.perf_counter() - start)
+
+        if found is None:
+            self._stats.record_miss()
+            response, entry = self._coalesce(
+                key, lambda: self._fetch(kwargs=kwargs, serialized=serialized, key=key)
+            )
+        else:
+            logger.debug("Cache hit, using cached response.")
+            response, entry = self._decode_hit(found)
+
+        return self._remember(key, response, entry)
+
+    def _decode_hit(self, found):
+        """Decode a response found in the database and count the hit"""
+        response = _decode(found.raw)
+        self._stats.record_hit("db", response, found.latency)
+        return response, found
+
+    def _lookup_memory(self, key):
+        """Return the wrapped response from the in-process cache, if any"""
+        if self._memory is None:
+            return None
+
+        now = time.time()
+        entry = self._memory.get(
+            key, is_expired=lambda entry: self._is_expired(entry[1].created_at, now)
+        )
+
+        # responses in memory are already wrapped, no need to decode them again
+        if entry is not None:
+            logger.debug("Cache hit (memory), using cached response.")
+            self._stats.record_hit("memory", entry[0], entry[1].latency)
+            return entry[0]
+
+        return None
+
+    def _remember(self, key, response, entry):
+        """Wrap response and keep it in the in-process cache, if enabled"""
+        # return FrozenJSON(response) to enable attribute access
+        response = FrozenJSON(response)
+
+        # keep the metadata but not the raw response, it's no longer needed
+        if self._memory is not None:
+            self._memory.put(key, (response, entry._replace(raw=None)), len(entry.raw))
+
+        return response
+
+    def _stream(self, *, kwargs, serialized, key):
+        """
+        Yield the chunks of a streaming (stream=True) call. On a miss, chunks
+        are passed through as they arrive and, once the stream is exhausted,
+        stored as a single assembled response. On a hit, the stored response
+        is replayed as chunks
+        """
+        start = time.perf_counter()
+        response = self._lookup_memory(key)
 
         if response is None:
-            logger.info("Cache miss, calling API.")
+            found = self._lookup_raw(key)
+
+            if found is not None:
+                logger.debug("Cache hit, replaying cached stream.")
+                response = self._remember(key, *self._decode_hit(found))
+
+        self._stats.observe_lookup(time.perf_counter() - start)
+
+        if response is not None:
+            for chunk in _streaming.replay(response.to_dict(copy=False)):
+                yield FrozenJSON(chunk)
+
+            return
+
+        logger.debug("Cache miss, streaming from API.")
+        self._stats.record_miss()
+        chunks = []
+        start = time.perf_counter()
+
+        for chunk in self._api_function(**kwargs):
+            chunk = chunk.model_dump()
+            chunks.append(chunk)
+            yield FrozenJSON(chunk)
+
+        # only complete streams are stored, a consumer that stops early never
+        # gets here
+        self._store_stream(
+            chunks,
+            serialized=serialized,
+            key=key,
+            latency=time.perf_counter() - start,
+        )
+
+    def _store_stream(self, chunks, *, serialized, key, latency):
+        response = _streaming.assemble(chunks)
+        raw = self._encode(response)
+        entry = self._insert_raw(
+            serialized=serialized, key=key, raw=raw, latency=latency
+        )
+        self._remember(key, response, entry)
+
+    def _coalesce(self, key, fetch):
+        """
+        Run fetch() unless another thread is already running it for the same
+        key, in which case wait for that call and share its result
+        """
+        if not self._single_flight:
+            return fetch()
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            logger.debug("Waiting for in-flight call with the same arguments.")
+            return flight.wait()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+
+        return result
+
+    def _fetch(self, *, kwargs, serialized, key):
+        """Call the API and store the response, returns (response, Entry)"""
+        if self._cross_process:
+            found = self._acquire_process_lock(key)
+
+            if found is not None:
+                logger.debug("Cache hit, another process stored the response.")
+                return _decode(found.raw), found
+
+        try:
+            logger.debug("Cache miss, calling API.")
+            start = time.perf_counter()
             response = self._api_function(**kwargs).model_dump()
-            self.insert(
-                kwargs=kwargs,
-                response=response,
+            latency = time.perf_counter() - start
+            raw = self._encode(response)
+            entry = self._insert_raw(
+                serialized=serialized, key=key, raw=raw, latency=latency
+            )
+
+            # processes waiting on the lock only see committed responses
+            if self._cross_process:
+                self.flush()
+        finally:
+            if self._cross_process:
+                self._release_process_lock(key)
+
+        return response, entry
+
+    def _acquire_process_lock(self, key):
+        """
+        Take the lock row for key. If another process holds it, poll until
+        that process stores the response and return its Entry,
+        or until it releases the lock without storing one, and try again
+        """
+        delay = 0.01
+
+        while True:
+            acquired, found = self._try_acquire_process_lock(key)
+
+            if acquired or found is not None:
+                return found
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def _try_acquire_process_lock(self, key):
+        """
+        Try to take the lock row for key once, returns (acquired, found) where
+        found is the stored Entry, if any. If both are truthy,
+        the lock has already been released again
+        """
+        connection = self.connection
+        now = time.time()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                """
+                DELETE FROM api_calls_locks
+                WHERE qualified_name = ? AND key_hash = ? AND acquired_at < ?
+            """,
+                (self._qualified_name, key, now - self._lock_timeout),
             )
+            acquired = connection.execute(
+                """
+                INSERT OR IGNORE INTO api_calls_locks
+                (qualified_name, key_hash, acquired_at)
+                VALUES (?, ?, ?)
+            """,
+                (self._qualified_name, key, now),
+            ).rowcount
+
+        found = self._lookup_raw(key)
+
+        # the previous holder may have stored the response right before we
+        # took the lock
+        if acquired and found is not None:
+            self._release_process_lock(key)
+
+        return bool(acquired), found
+
+    def _release_process_lock(self, key):
+        self.connection.execute(
+            "DELETE FROM api_calls_locks WHERE qualified_name = ? AND key_hash = ?",
+            (self._qualified_name, key),
+        )
+
+
+def _is_cancelling():
+    """Whether the current task was asked to cancel (always False before 3.11)"""
+    cancelling = getattr(asyncio.current_task(), "cancelling", None)
+    return bool(cancelling and cancelling())
+
+
+class AsyncAPICache(APICache):
+    """
+    Like APICache, but wraps a coroutine function (e.g., the methods of
+    openai.AsyncOpenAI) and is awaited. Database reads and writes run in a
+    thread so they don't block the event loop, and concurrent tasks with the
+    same kwargs share a single API call
+
+    Examples
+    --------
+    >>> from openai import AsyncOpenAI
+    >>> client = AsyncOpenAI()
+    >>> completions_create = AsyncAPICache(client.chat.completions.create)
+    >>> response = await completions_create(model="gpt-4o-mini", messages=[...])
+    """
+
+    def __init__(self, api_function, path_to_db=None, **kwargs) -> None:
+        super().__init__(api_function, path_to_db=path_to_db, **kwargs)
+        self._async_flights = {}
+
+    async def __call__(self, **kwargs):
+        start = time.perf_counter()
+        serialized = canonical_kwargs(kwargs)
+        key = _hash(serialized)
+
+        if kwargs.get("stream"):
+            return self._stream_async(kwargs=kwargs, serialized=serialized, key=key)
+
+        response = self._lookup_memory(key)
+
+        if response is not None:
+            self._stats.observe_lookup(time.perf_counter() - start)
+            return response
+
+        found = await asyncio.to_thread(self._lookup_raw, key)
+        self._stats.observe_lookup(time.perf_counter() - start)
+
+        if found is None:
+            self._stats.record_miss()
+
+            def fetch():
+                return self._fetch_async(kwargs=kwargs, serialized=serialized, key=key)
+
+            response, entry = await self._coalesce_async(key, fetch)
         else:
-            logger.info("Cache hit, using cached response.")
+            logger.debug("Cache hit, using cached response.")
+            response, entry = self._decode_hit(found)
 
-        # return FrozenJSON(response) to enable attribute access
-        return FrozenJSON(response)
+        return self._remember(key, response, entry)
+
+    async def _stream_async(self, *, kwargs, serialized, key):
+        """Async counterpart of APICache._stream"""
+        start = time.perf_counter()
+        response = self._lookup_memory(key)
+
+        if response is None:
+            found = await asyncio.to_thread(self._lookup_raw, key)
+
+            if found is not None:
+                logger.debug("Cache hit, replaying cached stream.")
+                response = self._remember(key, *self._decode_hit(found))
+
+        self._stats.observe_lookup(time.perf_counter() - start)
+
+        if response is not None:
+            for chunk in _streaming.replay(response.to_dict(copy=False)):
+                yield FrozenJSON(chunk)
+
+            return
+
+        logger.debug("Cache miss, streaming from API.")
+        self._stats.record_miss()
+        chunks = []
+        start = time.perf_counter()
+
+        async for chunk in await self._api_function(**kwargs):
+            chunk = chunk.model_dump()
+            chunks.append(chunk)
+            yield FrozenJSON(chunk)
+
+        await asyncio.to_thread(
+            self._store_stream,
+            chunks,
+            serialized=serialized,
+            key=key,
+            latency=time.perf_counter() - start,
+        )
+
+    async def _coalesce_async(self, key, fetch):
+        if not self._single_flight:
+            return await fetch()
+
+        # futures belong to a loop, so tasks only wait on calls from their own
+        flight_key = (asyncio.get_running_loop(), key)
+
+        while (flight := self._async_flights.get(flight_key)) is not None:
+            logger.debug("Waiting for in-flight call with the same arguments.")
+
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # if the leader was cancelled (and not this task), try again:
+                # the first follower to get here makes the call
+                if flight.cancelled() and not _is_cancelling():
+                    continue
+
+                raise
+
+        flight = asyncio.get_running_loop().create_future()
+        self._async_flights[flight_key] = flight
+
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # don't warn about an unretrieved exception if nobody was waiting
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            del self._async_flights[flight_key]
+
+        return result
+
+    async def _fetch_async(self, *, kwargs, serialized, key):
+        if self._cross_process:
+            found = await self._acquire_process_lock_async(key)
+
+            if found is not None:
+                logger.debug("Cache hit, another process stored the response.")
+                return _decode(found.raw), found
+
+        try:
+            logger.debug("Cache miss, calling API.")
+            start = time.perf_counter()
+            response = (await self._api_function(**kwargs)).model_dump()
+            latency = time.perf_counter() - start
+            raw = self._encode(response)
+            entry = await asyncio.to_thread(
+                self._insert_raw,
+                serialized=serialized,
+                key=key,
+                raw=raw,
+                latency=latency,
+            )
+
+            if self._cross_process:
+                await asyncio.to_thread(self.flush)
+        finally:
+            if self._cross_process:
+                await asyncio.to_thread(self._release_process_lock, key)
+
+        return response, entry
+
+    async def _acquire_process_lock_async(self, key):
+        delay = 0.01
+
+        while True:
+            acquired, found = await asyncio.to_thread(
+                self._try_acquire_process_lock, key
+            )
+
+            if acquired or found is not None:
+                return found
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
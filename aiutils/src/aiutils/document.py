@@ -1,13 +1,32 @@
-import tiktoken
-import fitz
-from PIL import Image
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
 from jinja2 import Template
 
 import aiutils.text
 from aiutils import tables
+from aiutils.pagecache import PageCache
+
+
+ENCODING_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """Return the tiktoken encoding, loading it on first use"""
+    import tiktoken
 
+    return tiktoken.get_encoding(ENCODING_NAME)
 
-encoding = tiktoken.get_encoding("cl100k_base")
+
+def __getattr__(name):
+    # document.encoding used to be loaded at import time
+    if name == "encoding":
+        return get_encoding()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # gpt-3.5-turbo-0125
@@ -29,55 +48,312 @@ template_page = Template(
 )
 
 
+# the Document used by each worker process in Document.iter_prompts
+_worker_document = None
+
+
+def _init_worker(document, n_threads):
+    global _worker_document
+
+    import torch
+
+    # split the cores between workers instead of every worker using all of them
+    torch.set_num_threads(n_threads)
+    # the document is pickled with its token counts and cache key, so workers
+    # don't hash or read the PDF again
+    _worker_document = document
+
+
+def _render_pages_in_worker(page_numbers):
+    return _worker_document._render_pages(page_numbers)
+
+
 class Document:
-    def __init__(self, path) -> None:
+    """
+    A PDF document
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the PDF
+
+    use_cache : bool, default=True
+        If True, store the text, token counts and detected tables on disk
+        (keyed by the PDF's content) and reuse them the next time the same
+        document is opened
+
+    path_to_cache : str or pathlib.Path, optional
+        Directory for the cache, defaults to aiutils.pagecache.DEFAULT_PATH
+
+    table_backend : {"torch", "quantized", "onnx"}, default="torch"
+        How to run the table detection models, see tables.TableDetector
+
+    cache_images : bool, default=False
+        If True (and use_cache=True), also store the rendered pages. They're
+        large (about 1 MB per page) and only needed to detect tables, which
+        are cached anyway, so it's only worth it to detect tables again (e.g.,
+        with another table_backend)
+    """
+
+    def __init__(
+        self,
+        path,
+        use_cache=True,
+        path_to_cache=None,
+        table_backend="torch",
+        cache_images=False,
+    ) -> None:
         self._path = path
-        self._text_pages = aiutils.text.pdf2text(self._path)
-        self._n_tokens = sum([len(encoding.encode(page)) for page in self._text_pages])
-        self._n_pages = len(self._text_pages)
+        self._table_backend = table_backend
+        self._cache_images = cache_images
+        self._cache = PageCache(path, path_to_cache) if use_cache else None
+        self._fitz_document = None
+
+        cached = None
+
+        if self._cache is not None:
+            cached = self._cache.load_token_counts(ENCODING_NAME)
+
+        if cached is None:
+            self._tokens_per_page = list(self._iter_token_counts())
+
+            if self._cache is not None:
+                self._cache.save_token_counts(self._tokens_per_page, ENCODING_NAME)
+        else:
+            self._tokens_per_page = cached
+
+        self._n_tokens = sum(self._tokens_per_page)
+        self._n_pages = len(self._tokens_per_page)
+
+    def _iter_token_counts(self):
+        """
+        Read the PDF one page at a time and yield each page's token count, the
+        text is stored in the cache (if enabled) and then discarded
+        """
+        encoding = get_encoding()
+
+        for page_number, text in enumerate(aiutils.text.iter_pdf_text(self._path)):
+            if self._cache is not None:
+                self._cache.save_page_text(page_number, text)
+
+            yield len(encoding.encode(text))
+
+    @property
+    def n_pages(self):
+        return self._n_pages
+
+    @property
+    def n_tokens(self):
+        return self._n_tokens
+
+    @property
+    def tokens_per_page(self):
+        """The token count of each page"""
+        return list(self._tokens_per_page)
+
+    def _open(self):
+        import fitz
+
+        # keep the document open, opening it is slow for large files
+        if self._fitz_document is None:
+            self._fitz_document = fitz.open(self._path)
+
+        return self._fitz_document
+
+    def get_page_text(self, page_number):
+        """Return the text of a page"""
+        if self._cache is not None:
+            text = self._cache.load_page_text(page_number)
+
+            if text is not None:
+                return text
+
+        return self._open()[page_number].get_text()
 
     def pages(self):
-        for page in self._text_pages:
-            yield page
+        """
+        Iterate over the text of each page, one page is held in memory at a
+        time
+        """
+        if self._cache is None:
+            yield from aiutils.text.iter_pdf_text(self._path)
+        else:
+            for page_number in range(self._n_pages):
+                yield self.get_page_text(page_number)
 
     def get_page_as_image(self, page_number):
         """Return a page as an image"""
-        doc = fitz.open(self._path)
+        if self._cache is not None and self._cache_images:
+            image = self._cache.load_image(page_number)
+
+            if image is not None:
+                return image
+
+        import fitz
+        from PIL import Image
 
         # render at a higher res using matrix to improve ocr
         # https://github.com/pymupdf/PyMuPDF/issues/322#issuecomment-512561756
-        pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(2, 2))
+        pix = self._open()[page_number].get_pixmap(matrix=fitz.Matrix(2, 2))
+
+        image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
 
-        return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        if self._cache is not None and self._cache_images:
+            self._cache.save_image(page_number, image)
+
+        return image
+
+    def __getstate__(self):
+        # the open PDF can't be pickled, it's opened again when needed
+        state = self.__dict__.copy()
+        state["_fitz_document"] = None
+        return state
+
+    def close(self):
+        """Close the PDF file, if it was opened to read or render pages"""
+        if self._fitz_document is not None:
+            self._fitz_document.close()
+            self._fitz_document = None
 
     def get_tables_in_page(self, page_number):
         """Return a list of tables in the page. Each table is a dictionary"""
-        # TODO: make the detectors a singleton to avoid loading the model every time
-        table_detector = tables.TableDetector()
-        page = self.get_page_as_image(page_number)
-        tables_detected = table_detector.detect(page)
-        cropped = tables.crop_tables(page, tables_detected)
-        detector_structure = tables.TableStructureDetector()
-        tables_detected = [detector_structure.detect(img) for img in cropped]
-        coords = [tables.get_cell_coordinates_by_row(t[1]) for t in tables_detected]
-        out = [tables.apply_ocr(c, img) for c, img in zip(coords, cropped)]
+        return self._get_tables_in_pages([page_number])[0]
+
+    def _get_tables_in_pages(self, page_numbers):
+        """
+        Return the tables of each page, the pages that aren't cached are
+        processed together so the models run on batches
+        """
+        found = {}
+
+        if self._cache is not None:
+            for page_number in page_numbers:
+                cached = self._cache.load_tables(page_number, self._table_backend)
+
+                if cached is not None:
+                    found[page_number] = cached
+
+        missing = [
+            page_number for page_number in page_numbers if page_number not in found
+        ]
+
+        if missing:
+            for page_number, page_tables in zip(
+                missing, self._detect_tables_in_pages(missing)
+            ):
+                found[page_number] = page_tables
+
+                if self._cache is not None:
+                    self._cache.save_tables(
+                        page_number, page_tables, self._table_backend
+                    )
+
+        return [found[page_number] for page_number in page_numbers]
+
+    def _detect_tables_in_pages(self, page_numbers):
+        pages = [self.get_page_as_image(page_number) for page_number in page_numbers]
+        detected = tables.TableDetector(self._table_backend).detect_batch(pages)
+        cropped = [tables.crop_tables(page, d) for page, d in zip(pages, detected)]
+
+        # detect the structure of the tables in all pages at once
+        images = [image for page_tables in cropped for image in page_tables]
+        structures = tables.TableStructureDetector(self._table_backend).detect_batch(
+            images
+        )
+        coords = [tables.cell_grid(s[1]) for s in structures]
+        out = [tables.apply_ocr(c, img) for c, img in zip(coords, images)]
 
         # TODO: we need to export the tables to a format that can be used in the prompt
-        return [table[1] for table in out]
-
-    def iter_tables(self):
-        for i in range(self._n_pages):
-            tables = self.get_tables_in_page(i)
-            yield tables
-
-    def iter_prompts(self):
-        """Iterate over the pages and tables and return a prompt for the document"""
-        for i, text, tables in zip(
-            range(self._n_pages),
-            self.pages(),
-            self.iter_tables(),
-        ):
-            yield template_page.render(text=text, tables=tables, page_number=i)
+        data = [table[1] for table in out]
+
+        # split the tables back by page
+        by_page, start = [], 0
+
+        for page_tables in cropped:
+            by_page.append(data[start : start + len(page_tables)])
+            start += len(page_tables)
+
+        return by_page
+
+    def iter_tables(self, batch_size=4):
+        """Iterate over the tables of each page, processing batch_size pages at once"""
+        for start in range(0, self._n_pages, batch_size):
+            page_numbers = range(start, min(start + batch_size, self._n_pages))
+            yield from self._get_tables_in_pages(list(page_numbers))
+
+    def _render_page(self, page_number, page_tables=None, text=None):
+        if page_tables is None:
+            page_tables = self.get_tables_in_page(page_number)
+
+        if text is None:
+            text = self.get_page_text(page_number)
+
+        return template_page.render(
+            text=text,
+            tables=page_tables,
+            page_number=page_number,
+        )
+
+    def _render_pages(self, page_numbers):
+        """Render the pages, detecting their tables in a single batch"""
+        page_tables = self._get_tables_in_pages(page_numbers)
+        return [
+            self._render_page(page_number, tables_in_page)
+            for page_number, tables_in_page in zip(page_numbers, page_tables)
+        ]
+
+    def iter_prompts(self, n_workers=1, ordered=True, batch_size=4):
+        """
+        Iterate over the pages and tables and return a prompt for the document
+
+        Parameters
+        ----------
+        n_workers : int, default=1
+            Number of processes that render pages and detect tables, each loads
+            its own copy of the models. If 1, pages are processed in this
+            process. If None, use one worker per core
+
+        ordered : bool, default=True
+            If True, yield prompts in page order, otherwise yield them as they
+            are ready (with n_workers > 1)
+
+        batch_size : int, default=4
+            Number of pages whose tables are detected at once, with
+            n_workers > 1 each worker gets batch_size pages at a time
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count()
+
+        if n_workers == 1:
+            pages = zip(self.pages(), self.iter_tables(batch_size))
+
+            for i, (text, page_tables) in enumerate(pages):
+                yield self._render_page(i, page_tables, text)
+
+            return
+
+        # spawn, since forking a process that already loaded torch can deadlock
+        executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self, max(1, os.cpu_count() // n_workers)),
+        )
+
+        try:
+            futures = [
+                executor.submit(
+                    _render_pages_in_worker,
+                    list(range(start, min(start + batch_size, self._n_pages))),
+                )
+                for start in range(0, self._n_pages, batch_size)
+            ]
+
+            for future in futures if ordered else as_completed(futures):
+                yield from future.result()
+        finally:
+            # don't process the remaining pages if the caller stops early
+            executor.shutdown(cancel_futures=True)
 
     def __repr__(self) -> str:
         return (
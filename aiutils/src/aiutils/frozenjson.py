@@ -1,46 +1,79 @@
-from collections.abc import Mapping, MutableSequence
+from collections.abc import Mapping, MutableSequence, Sequence
 import keyword
 from copy import deepcopy
 
+# marks FrozenList items that haven't been wrapped yet
+_MISSING = object()
+
+
+def _wrap(value):
+    if isinstance(value, Mapping):
+        return FrozenJSON(value)
+    elif isinstance(value, MutableSequence):
+        return FrozenList(value)
+    else:
+        return value
+
 
 class FrozenJSON(object):
     """
     A facade for navigating a JSON-like object using attribute notation.
     Based on FrozenJSON from 'Fluent Python'
+
+    The mapping is not copied: children are wrapped on first access and
+    reused afterwards, lists are wrapped in a read-only FrozenList. Keys that
+    are Python keywords are accessed with a trailing underscore (e.g., .class_)
     """
 
+    __slots__ = ("_data", "_children", "_path_to_file")
+
     def __new__(cls, arg):
         if isinstance(arg, Mapping):
             return super(FrozenJSON, cls).__new__(cls)
 
         elif isinstance(arg, MutableSequence):
-            return [cls(item) for item in arg]
+            return FrozenList(arg)
         else:
             return arg
 
     def __init__(self, mapping):
         self._path_to_file = None
+        self._data = mapping
+        self._children = {}
 
-        self._data = {}
+    def __getattr__(self, name):
+        children = self._children
 
-        for key, value in mapping.items():
-            if keyword.iskeyword(key):
-                key += "_"
+        if name in children:
+            return children[name]
 
-            self._data[key] = value
+        # dunder lookups (e.g., from copy or pickle) must not hit the data
+        if name.startswith("__"):
+            raise AttributeError(name)
 
-    def __getattr__(self, name):
-        if hasattr(self._data, name):
-            return getattr(self._data, name)
-        else:
-            return FrozenJSON(self._data[name])
+        data = self._data
+
+        if hasattr(data, name):
+            return getattr(data, name)
+
+        key = name
+
+        if key not in data and key.endswith("_") and keyword.iskeyword(key[:-1]):
+            key = key[:-1]
+
+        value = children[name] = _wrap(data[key])
+        return value
 
     def __dir__(self):
-        return self._data.keys()
+        return [key + "_" if keyword.iskeyword(key) else key for key in self._data]
 
     def __getitem__(self, key):
         value = self._data.get(key)
 
+        if value is None and isinstance(key, str) and key.endswith("_"):
+            if keyword.iskeyword(key[:-1]):
+                value = self._data.get(key[:-1])
+
         if value is None:
             key_ = key if not isinstance(key, str) else "'%s'" % key
             msg = "Key error: {}, available keys are: {}".format(
@@ -61,5 +94,61 @@ class FrozenJSON(object):
     def __repr__(self):
         return "FrozenJSON({})".format(str(self))
 
-    def to_dict(self):
-        return deepcopy(self._data)
+    def __reduce__(self):
+        # copy and pickle the data, not the memoized children
+        return (FrozenJSON, (self._data,))
+
+    def to_dict(self, copy=True):
+        """
+        Return the underlying data. If copy=False, return it without copying,
+        it's shared with this object so it must not be modified
+        """
+        return deepcopy(self._data) if copy else self._data
+
+
+class FrozenList(Sequence):
+    """
+    A read-only view of a list whose items are wrapped (dictionaries as
+    FrozenJSON, lists as FrozenList) on first access
+    """
+
+    __slots__ = ("_data", "_items")
+
+    def __init__(self, data):
+        self._data = data
+        self._items = [_MISSING] * len(data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._data)))]
+
+        item = self._items[index]
+
+        if item is _MISSING:
+            item = self._items[index] = _wrap(self._data[index])
+
+        return item
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, FrozenList):
+            other = other._data
+
+        return self._data == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "FrozenList({})".format(self._data)
+
+    def __reduce__(self):
+        return (FrozenList, (self._data,))
+
+    def to_list(self, copy=True):
+        """
+        Return the underlying list. If copy=False, return it without copying,
+        it's shared with this object so it must not be modified
+        """
+        return deepcopy(self._data) if copy else self._data
@@ -0,0 +1,166 @@
+"""
+On-disk cache of per-page extraction results (text, token counts, rendered
+images and detected tables) for PDF documents, keyed by the hash of the file's
+content so renamed or moved copies of a document share their entry
+
+The layout is:
+
+    {path_to_cache}/v{VERSION}/{sha256 of the PDF}/
+        tokens.json         token count of every page, written once every
+                            page's text is stored
+        text/{page}.txt     text of each page
+        images/{page}.png   rendered pages
+        tables/{backend}/{page}.json
+                            tables detected in each page, per table backend
+                            since their results differ slightly
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from aiutils import CACHE_PATH
+
+# bump this when the format or the extraction pipeline changes, old entries
+# are then ignored
+VERSION = 2
+
+DEFAULT_PATH = CACHE_PATH.parent / "documents"
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the sha256 of a file's content"""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _write_atomic(path, write):
+    """
+    Call write(f) on a temporary file and move it to path, so readers (from
+    any thread or process) never see a partially written file
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _write_json(path, obj):
+    _write_atomic(path, lambda f: f.write(json.dumps(obj).encode("utf-8")))
+
+
+def _read_json(path):
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+
+
+class PageCache:
+    """
+    Cache of a single PDF's extraction results
+
+    Parameters
+    ----------
+    path_to_pdf : str or pathlib.Path
+        The PDF, it's read once to compute its hash
+
+    path_to_cache : str or pathlib.Path, optional
+        Directory to store the cache, defaults to DEFAULT_PATH
+    """
+
+    def __init__(self, path_to_pdf, path_to_cache=None) -> None:
+        self._key = hash_file(path_to_pdf)
+        path_to_cache = Path(path_to_cache or DEFAULT_PATH)
+        self._path = path_to_cache / f"v{VERSION}" / self._key
+
+    @property
+    def key(self):
+        """The sha256 of the PDF"""
+        return self._key
+
+    @property
+    def path(self):
+        """The directory with this document's entries"""
+        return self._path
+
+    def load_token_counts(self, encoding):
+        """
+        Return the token count of every page, or None if missing (or the text
+        is incomplete) or counted with a different encoding
+        """
+        stored = _read_json(self._path / "tokens.json")
+
+        if stored is None or stored["encoding"] != encoding:
+            return None
+
+        return stored["n_tokens"]
+
+    def save_token_counts(self, n_tokens, encoding):
+        """Store the token counts, call it after storing every page's text"""
+        _write_json(
+            self._path / "tokens.json", {"encoding": encoding, "n_tokens": n_tokens}
+        )
+
+    def load_page_text(self, page_number):
+        """Return the text of the page, or None if missing"""
+        try:
+            return (self._path / "text" / f"{page_number}.txt").read_text(
+                encoding="utf-8"
+            )
+        except FileNotFoundError:
+            return None
+
+    def save_page_text(self, page_number, text):
+        _write_atomic(
+            self._path / "text" / f"{page_number}.txt",
+            lambda f: f.write(text.encode("utf-8")),
+        )
+
+    def load_image(self, page_number):
+        """Return the rendered page as a PIL image, or None if missing"""
+        from PIL import Image
+
+        path = self._path / "images" / f"{page_number}.png"
+
+        try:
+            with Image.open(path) as image:
+                image.load()
+                return image
+        except FileNotFoundError:
+            return None
+
+    def save_image(self, page_number, image):
+        _write_atomic(
+            self._path / "images" / f"{page_number}.png",
+            lambda f: image.save(f, format="PNG"),
+        )
+
+    def load_tables(self, page_number, backend="torch"):
+        """
+        Return the tables detected in the page with backend, or None if
+        missing
+        """
+        return _read_json(self._path / "tables" / backend / f"{page_number}.json")
+
+    def save_tables(self, page_number, tables, backend="torch"):
+        _write_json(self._path / "tables" / backend / f"{page_number}.json", tables)
+
+    def clear(self):
+        """Delete this document's entries"""
+        shutil.rmtree(self._path, ignore_errors=True)
@@ -0,0 +1,328 @@
+"""
+Semantic caching: reuse a cached response when a new prompt is similar enough
+(by cosine similarity of their embeddings) to one that was already answered
+"""
+
+import logging
+from collections import deque
+from contextlib import closing
+from threading import Lock
+
+import time
+
+from aiutils.cache import (
+    APICache,
+    _decode,
+    _hash,
+    canonical_kwargs,
+    hash_kwargs,
+)
+
+try:
+    import numpy as np
+except ModuleNotFoundError as e:
+    raise ModuleNotFoundError(
+        "SemanticAPICache requires numpy: pip install numpy"
+    ) from e
+
+logger = logging.getLogger(__name__)
+
+# number of recent best similarities kept to help tune the threshold
+SIMILARITY_HISTORY = 1_000
+
+
+def split_prompt(kwargs):
+    """
+    Split the kwargs of an OpenAI-style call into (prompt, context): prompt is
+    the text that is embedded (the last message's content, or the prompt/input
+    argument), context is everything else, which must match exactly. Returns
+    (None, kwargs) if there's no text prompt
+    """
+    context = dict(kwargs)
+    messages = context.pop("messages", None)
+
+    if messages:
+        *previous, last = messages
+
+        if isinstance(last.get("content"), str):
+            context["messages"] = previous
+            context["role"] = last.get("role")
+            return last["content"], context
+
+        return None, kwargs
+
+    for name in ("prompt", "input"):
+        if isinstance(context.get(name), str):
+            return context.pop(name), context
+
+    return None, kwargs
+
+
+class _Index:
+    """
+    Normalized embeddings (one per row) and the key of each row. Rows are
+    stored in a buffer that doubles when full, so adding n rows copies O(n)
+    data instead of O(n²)
+    """
+
+    def __init__(self, keys, matrix):
+        self.keys = keys
+        self._buffer = np.array(matrix, dtype=np.float32, ndmin=2)
+
+    @property
+    def matrix(self):
+        return self._buffer[: len(self.keys)]
+
+    def add(self, key, embedding):
+        n = len(self.keys)
+
+        if n == len(self._buffer):
+            buffer = np.empty((max(2 * n, 1), len(embedding)), dtype=np.float32)
+            buffer[:n] = self._buffer[:n]
+            self._buffer = buffer
+
+        self._buffer[n] = embedding
+        self.keys.append(key)
+
+    def search(self, embedding):
+        """Return (key, similarity) of the most similar row, or None if empty"""
+        if not self.keys:
+            return None
+
+        similarities = self.matrix @ embedding
+        best = int(np.argmax(similarities))
+        return self.keys[best], float(similarities[best])
+
+
+def _normalize(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+
+    if norm == 0:
+        raise ValueError("Cannot use an all-zeros embedding")
+
+    return embedding / norm
+
+
+class SemanticAPICache(APICache):
+    """
+    An APICache that also returns cached responses for prompts that are
+    semantically similar to a cached one
+
+    Parameters
+    ----------
+    api_function : callable
+        The function to cache, must return an object with a model_dump() method
+
+    embedding_function : callable
+        Takes a string and returns its embedding (a sequence of floats)
+
+    threshold : float, default=0.95
+        Minimum cosine similarity between two prompts to reuse a response
+
+    split_prompt : callable, optional
+        Takes the call's kwargs and returns (prompt, context), only calls with
+        the same context are compared. Defaults to aiutils.semantic.split_prompt
+
+    **kwargs
+        Passed to APICache
+
+    Notes
+    -----
+    Exact matches are looked up first, the prompt is only embedded on a miss.
+    Embeddings are stored in the api_calls_embeddings table and loaded into
+    memory (one matrix per context) on first use, the search is exhaustive.
+    Calls with stream=True only use exact matching
+    """
+
+    def __init__(
+        self,
+        api_function,
+        embedding_function,
+        threshold=0.95,
+        split_prompt=split_prompt,
+        **kwargs,
+    ) -> None:
+        super().__init__(api_function, **kwargs)
+        self._embedding_function = embedding_function
+        self._threshold = threshold
+        self._split_prompt = split_prompt
+        self._indexes = {}
+        self._indexes_lock = Lock()
+        self._similarities_lock = Lock()
+        self._similarities = deque(maxlen=SIMILARITY_HISTORY)
+
+    def __call__(self, **kwargs):
+        if kwargs.get("stream"):
+            return super().__call__(**kwargs)
+
+        start = time.perf_counter()
+        serialized = canonical_kwargs(kwargs)
+        key = _hash(serialized)
+
+        response = self._lookup_memory(key)
+
+        if response is not None:
+            self._stats.observe_lookup(time.perf_counter() - start)
+            return response
+
+        found = self._lookup_raw(key)
+
+        if found is not None:
+            self._stats.observe_lookup(time.perf_counter() - start)
+            logger.debug("Cache hit, using cached response.")
+            return self._remember(key, *self._decode_hit(found))
+
+        prompt, context = self._split_prompt(kwargs)
+
+        if prompt is None:
+            self._stats.observe_lookup(time.perf_counter() - start)
+            self._stats.record_miss()
+            response, entry = self._coalesce(
+                key, lambda: self._fetch(kwargs=kwargs, serialized=serialized, key=key)
+            )
+            return self._remember(key, response, entry)
+
+        # lookup latency includes computing the embedding
+        embedding = _normalize(self._embedding_function(prompt))
+        context_hash = hash_kwargs(context)
+        match = self._search(context_hash, embedding)
+
+        if match is not None:
+            match_key, similarity = match
+
+            with self._similarities_lock:
+                self._similarities.append(similarity)
+
+            # the matched entry may have expired or been evicted
+            found = (
+                self._lookup_raw(match_key) if similarity >= self._threshold else None
+            )
+
+            if found is not None:
+                self._stats.observe_lookup(time.perf_counter() - start)
+                logger.debug(
+                    "Semantic cache hit (similarity=%.3f), using cached response.",
+                    similarity,
+                )
+                response = _decode(found.raw)
+                self._stats.record_hit("semantic", response, found.latency)
+                return self._remember(match_key, response, found)
+
+        self._stats.observe_lookup(time.perf_counter() - start)
+        self._stats.record_miss()
+        response, entry = self._coalesce(
+            key, lambda: self._fetch(kwargs=kwargs, serialized=serialized, key=key)
+        )
+        self._add_embedding(key, context_hash, embedding)
+        return self._remember(key, response, entry)
+
+    def stats(self):
+        """
+        Like APICache.stats(), hits include a "semantic" tier, plus the best
+        similarity found by recent semantic lookups (to tune the threshold)
+        """
+        stats = super().stats()
+        stats["hits"].setdefault("semantic", 0)
+
+        with self._similarities_lock:
+            stats["similarities"] = list(self._similarities)
+
+        return stats
+
+    def _search(self, context_hash, embedding):
+        (count,) = self.connection.execute(
+            """
+            SELECT COUNT(*) FROM api_calls_embeddings
+            WHERE qualified_name = ? AND context_hash = ?
+        """,
+            (self._qualified_name, context_hash),
+        ).fetchone()
+
+        with self._indexes_lock:
+            index = self._indexes.get(context_hash)
+
+            # reload if another process (or instance) added embeddings
+            if index is None or len(index.keys) != count:
+                index = self._load_index(context_hash, len(embedding))
+                self._indexes[context_hash] = index
+
+            return index.search(embedding)
+
+    def _load_index(self, context_hash, dimensions):
+        rows = self.connection.execute(
+            """
+            SELECT key_hash, embedding FROM api_calls_embeddings
+            WHERE qualified_name = ? AND context_hash = ?
+        """,
+            (self._qualified_name, context_hash),
+        ).fetchall()
+
+        keys = [key for key, _ in rows]
+        matrix = np.frombuffer(
+            b"".join(embedding for _, embedding in rows), dtype="<f4"
+        ).reshape(len(rows), dimensions)
+
+        return _Index(keys, matrix)
+
+    def _add_embedding(self, key, context_hash, embedding):
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO api_calls_embeddings
+            (qualified_name, key_hash, context_hash, embedding)
+            VALUES (?, ?, ?, ?)
+        """,
+            (
+                self._qualified_name,
+                key,
+                context_hash,
+                embedding.astype("<f4").tobytes(),
+            ),
+        )
+
+        with self._indexes_lock:
+            index = self._indexes.get(context_hash)
+
+            if index is not None and key not in index.keys:
+                index.add(key, embedding)
+
+    def evict(self):
+        """
+        Evict like APICache.evict() and drop the evicted entries' embeddings.
+        Returns the number of deleted entries
+        """
+        deleted = super().evict()
+
+        # use a separate connection so this can run in a background thread
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            orphans = connection.execute(
+                """
+                SELECT key_hash FROM api_calls_embeddings
+                WHERE qualified_name = ? AND key_hash NOT IN (
+                    SELECT key_hash FROM api_calls WHERE qualified_name = ?
+                )
+            """,
+                (self._qualified_name, self._qualified_name),
+            ).fetchall()
+
+            # rows still pending aren't in api_calls yet, keep their embeddings
+            with self._pending_lock:
+                pending = set(self._pending)
+
+            connection.executemany(
+                """
+                DELETE FROM api_calls_embeddings
+                WHERE qualified_name = ? AND key_hash = ?
+            """,
+                (
+                    (self._qualified_name, key)
+                    for (key,) in orphans
+                    if key not in pending
+                ),
+            )
+
+        with self._indexes_lock:
+            self._indexes.clear()
+
+        return deleted
@@ -0,0 +1,239 @@
+"""
+Counters for APICache: hits (by tier), misses, bytes stored, lookup latency,
+and the API latency and tokens saved by hits
+
+>>> from aiutils.stats import to_prometheus
+>>> cache = APICache(client.chat.completions.create)
+>>> cache.stats()
+>>> print(to_prometheus(cache))
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+# upper bounds (in seconds) of the lookup latency histogram buckets
+LOOKUP_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram:
+    """A Prometheus-style histogram with fixed bucket upper bounds"""
+
+    def __init__(self, buckets=LOOKUP_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # the last count is for observations above every bucket (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return [(upper_bound, count of observations <= upper_bound), ...]"""
+        bounds = [*self.buckets, float("inf")]
+        total = 0
+        cumulative = []
+
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return cumulative
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+class CacheStats:
+    """
+    Thread-safe counters for a cache of the function with the given
+    qualified_name. token_costs maps "prompt" and "completion" to the price
+    of a token, to estimate the cost saved by hits
+    """
+
+    def __init__(self, qualified_name, token_costs=None) -> None:
+        self.qualified_name = qualified_name
+        self._token_costs = token_costs
+        self._lock = Lock()
+        self.hits = {"memory": 0, "db": 0}
+        self.misses = 0
+        self.bytes_stored = 0
+        self.latency_saved = 0.0
+        self.tokens_saved = {"prompt": 0, "completion": 0}
+        self.lookup_seconds = Histogram()
+
+    def record_hit(self, tier, response, latency):
+        """Count a hit served from tier, response is a dict or FrozenJSON"""
+        usage = response.get("usage") if hasattr(response, "get") else None
+
+        with self._lock:
+            self.hits[tier] = self.hits.get(tier, 0) + 1
+            self.latency_saved += latency or 0
+
+            if usage:
+                self.tokens_saved["prompt"] += usage.get("prompt_tokens") or 0
+                self.tokens_saved["completion"] += usage.get("completion_tokens") or 0
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_store(self, n_bytes):
+        with self._lock:
+            self.bytes_stored += n_bytes
+
+    def observe_lookup(self, seconds):
+        with self._lock:
+            self.lookup_seconds.observe(seconds)
+
+    @property
+    def cost_saved(self):
+        """Estimated cost of the tokens saved, None if token_costs is not set"""
+        if self._token_costs is None:
+            return None
+
+        return sum(
+            self.tokens_saved[kind] * self._token_costs.get(kind, 0)
+            for kind in self.tokens_saved
+        )
+
+    def to_dict(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            calls = hits + self.misses
+
+            return {
+                "qualified_name": self.qualified_name,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "hit_rate": hits / calls if calls else 0.0,
+                "bytes_stored": self.bytes_stored,
+                "latency_saved": self.latency_saved,
+                "tokens_saved": dict(self.tokens_saved),
+                "cost_saved": self.cost_saved,
+                "lookup_seconds": {
+                    "buckets": self.lookup_seconds.cumulative(),
+                    "sum": self.lookup_seconds.sum,
+                    "count": self.lookup_seconds.count,
+                },
+            }
+
+    def merge(self, other):
+        """Add other's counters (e.g., from another cache of the same function)"""
+        with self._lock, other._lock:
+            for tier, count in other.hits.items():
+                self.hits[tier] = self.hits.get(tier, 0) + count
+
+            self.misses += other.misses
+            self.bytes_stored += other.bytes_stored
+            self.latency_saved += other.latency_saved
+
+            for kind, count in other.tokens_saved.items():
+                self.tokens_saved[kind] += count
+
+            self.lookup_seconds.merge(other.lookup_seconds)
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def to_prometheus(*caches, prefix="aiutils_cache"):
+    """
+    Return the counters of the given caches (or CacheStats) in the Prometheus
+    text exposition format, labeled by qualified_name. Caches of the same
+    function are added up
+    """
+    merged = {}
+
+    for cache in caches:
+        stats = getattr(cache, "_stats", cache)
+        name = stats.qualified_name
+
+        if name not in merged:
+            merged[name] = CacheStats(name, token_costs=stats._token_costs)
+
+        merged[name].merge(stats)
+
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append(f"# HELP {prefix}_{name} {help}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        for suffix, labels, value in samples:
+            formatted = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{prefix}_{name}{suffix}{{{formatted}}} {value}")
+
+    metric(
+        "hits_total",
+        "counter",
+        "Calls served from the cache",
+        [
+            ("", {"qualified_name": name, "tier": tier}, count)
+            for name, stats in merged.items()
+            for tier, count in stats.hits.items()
+        ],
+    )
+    metric(
+        "misses_total",
+        "counter",
+        "Calls not found in the cache",
+        [("", {"qualified_name": name}, s.misses) for name, s in merged.items()],
+    )
+    metric(
+        "stored_bytes_total",
+        "counter",
+        "Bytes of responses written to the cache",
+        [("", {"qualified_name": name}, s.bytes_stored) for name, s in merged.items()],
+    )
+    metric(
+        "latency_saved_seconds_total",
+        "counter",
+        "Seconds of API calls saved by cache hits",
+        [("", {"qualified_name": name}, s.latency_saved) for name, s in merged.items()],
+    )
+    metric(
+        "tokens_saved_total",
+        "counter",
+        "Tokens saved by cache hits",
+        [
+            ("", {"qualified_name": name, "kind": kind}, count)
+            for name, stats in merged.items()
+            for kind, count in stats.tokens_saved.items()
+        ],
+    )
+
+    costs = [
+        ("", {"qualified_name": name}, s.cost_saved)
+        for name, s in merged.items()
+        if s.cost_saved is not None
+    ]
+
+    if costs:
+        metric(
+            "cost_saved_total", "counter", "Estimated cost saved by cache hits", costs
+        )
+
+    samples = []
+
+    for name, stats in merged.items():
+        histogram = stats.lookup_seconds
+
+        for bound, count in histogram.cumulative():
+            labels = {"qualified_name": name, "le": _format_bound(bound)}
+            samples.append(("_bucket", labels, count))
+
+        samples.append(("_sum", {"qualified_name": name}, histogram.sum))
+        samples.append(("_count", {"qualified_name": name}, histogram.count))
+
+    metric("lookup_seconds", "histogram", "Time spent looking up the cache", samples)
+
+    return "\n".join(lines) + "\n"
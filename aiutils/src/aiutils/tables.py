@@ -1,61 +1,159 @@
 """
 Code adapted from: https://huggingface.co/spaces/nielsr/tatr-demo/blob/main/app.py
+
+torch, transformers, easyocr and the plotting libraries are imported when
+first needed, so importing this module is cheap
 """
 
 import io
-import csv
 from copy import deepcopy
+from threading import Lock
+from typing import TYPE_CHECKING, NamedTuple
 
-import torch
-from torchvision import transforms
-from transformers import AutoModelForObjectDetection
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.patches import Patch
-from PIL import Image, ImageDraw
 import numpy as np
-import pandas as pd
-import easyocr
 
+from aiutils import _backends
 from aiutils._singleton import SingletonMeta
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+_reader = None
+_reader_lock = Lock()
+
+
+def get_reader():
+    """Return the easyocr reader, loading it on first use"""
+    global _reader
+
+    with _reader_lock:
+        if _reader is None:
+            import easyocr
+
+            _reader = easyocr.Reader(["en"])
 
-reader = easyocr.Reader(["en"])
+    return _reader
+
+
+def __getattr__(name):
+    # tables.reader used to be created at import time
+    if name == "reader":
+        return get_reader()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _detection_transform(max_size):
+    from torchvision import transforms
+
+    return transforms.Compose(
+        [
+            MaxResize(max_size),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ]
+    )
 
 
 def box_cxcywh_to_xyxy(x):
+    import torch
+
     x_c, y_c, w, h = x.unbind(-1)
     b = [(x_c - 0.5 * w), (y_c - 0.5 * h), (x_c + 0.5 * w), (y_c + 0.5 * h)]
     return torch.stack(b, dim=1)
 
 
 def rescale_bboxes(out_bbox, size):
+    import torch
+
     width, height = size
     boxes = box_cxcywh_to_xyxy(out_bbox)
     boxes = boxes * torch.tensor([width, height, width, height], dtype=torch.float32)
     return boxes
 
 
-def outputs_to_objects(outputs, img_size, id2label):
-    m = outputs.logits.softmax(-1).max(-1)
-    pred_labels = list(m.indices.detach().cpu().numpy())[0]
-    pred_scores = list(m.values.detach().cpu().numpy())[0]
-    pred_bboxes = outputs["pred_boxes"].detach().cpu()[0]
-    pred_bboxes = [elem.tolist() for elem in rescale_bboxes(pred_bboxes, img_size)]
-
-    objects = []
-    for label, score, bbox in zip(pred_labels, pred_scores, pred_bboxes):
-        class_label = id2label[int(label)]
-        if not class_label == "no object":
-            objects.append(
-                {
-                    "label": class_label,
-                    "score": float(score),
-                    "bbox": [float(elem) for elem in bbox],
-                }
-            )
+class Detections(NamedTuple):
+    """Objects detected in an image: label ids, scores and xyxy boxes"""
+
+    labels: np.ndarray
+    scores: np.ndarray
+    boxes: np.ndarray
+
+
+def detections_from_arrays(logits, pred_boxes, img_size, threshold=0.0):
+    """
+    Post-process the logits (n_queries, n_classes) and normalized cxcywh boxes
+    (n_queries, 4) predicted for one image. The last class is "no object",
+    queries predicting it or scoring below threshold are dropped
+    """
+    # softmax, shifted for numerical stability
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    probabilities = exp / exp.sum(axis=-1, keepdims=True)
+    labels = probabilities.argmax(axis=-1)
+    scores = probabilities.max(axis=-1)
+
+    width, height = img_size
+    center, size = pred_boxes[:, :2], pred_boxes[:, 2:]
+    boxes = np.concatenate([center - 0.5 * size, center + 0.5 * size], axis=1)
+    boxes = boxes * np.array([width, height, width, height], dtype=boxes.dtype)
+
+    keep = (labels != logits.shape[-1] - 1) & (scores >= threshold)
+    return Detections(labels[keep], scores[keep], boxes[keep])
+
+
+def detections_to_objects(detections, id2label):
+    """Convert Detections to a list of {"label", "score", "bbox"} dictionaries"""
+    return [
+        {"label": id2label[label], "score": score, "bbox": bbox}
+        for label, score, bbox in zip(
+            detections.labels.tolist(),
+            detections.scores.tolist(),
+            detections.boxes.tolist(),
+        )
+    ]
 
-    return objects
+
+def outputs_to_objects(outputs, img_size, id2label, index=0):
+    """Return the objects detected in the index-th image of a batch"""
+    detections = detections_from_arrays(
+        outputs.logits[index].detach().cpu().numpy(),
+        outputs["pred_boxes"][index].detach().cpu().numpy(),
+        img_size,
+    )
+    return detections_to_objects(detections, id2label)
+
+
+def images_to_batch(images, transform):
+    """
+    Transform images and stack them into a batch, padding them (at the bottom
+    and right) to the size of the largest one. Returns (pixel_values,
+    pixel_mask), the mask is 1 for pixels of the images and 0 for padding
+    """
+    import torch
+
+    tensors = [transform(image) for image in images]
+    height = max(tensor.shape[1] for tensor in tensors)
+    width = max(tensor.shape[2] for tensor in tensors)
+
+    pixel_values = torch.zeros((len(tensors), 3, height, width))
+    pixel_mask = torch.zeros((len(tensors), height, width), dtype=torch.long)
+
+    for i, tensor in enumerate(tensors):
+        pixel_values[i, :, : tensor.shape[1], : tensor.shape[2]] = tensor
+        pixel_mask[i, : tensor.shape[1], : tensor.shape[2]] = 1
+
+    return pixel_values, pixel_mask
+
+
+def _with_no_object(id2label):
+    # the last class predicted by the model is "no object"
+    return {**id2label, len(id2label): "no object"}
+
+
+def _batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
 
 
 class MaxResize(object):
@@ -73,38 +171,64 @@ class MaxResize(object):
         return resized_image
 
 
-class TableDetector(metaclass=SingletonMeta):
-    def __init__(self):
-        self._device = "cuda" if torch.cuda.is_available() else "cpu"
-
-        self._detection_transform = transforms.Compose(
-            [
-                MaxResize(800),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-            ]
-        )
+def _detect_batch(model, transform, images, batch_size):
+    """Run model on batches of images, returns a list of Detections"""
+    detected = []
 
-        self._model = AutoModelForObjectDetection.from_pretrained(
-            "microsoft/table-transformer-detection", revision="no_timm"
-        ).to(self._device)
+    for batch in _batches(images, batch_size):
+        pixel_values, pixel_mask = images_to_batch(batch, transform)
+        logits, pred_boxes = model(pixel_values, pixel_mask)
 
-    def detect(self, image):
-        """Return a list of detected tables in the image."""
-        pixel_values = self._detection_transform(image).unsqueeze(0).to(self._device)
+        detected.extend(
+            detections_from_arrays(logits[i], pred_boxes[i], image.size)
+            for i, image in enumerate(batch)
+        )
 
-        with torch.no_grad():
-            outputs = self._model(pixel_values)
+    return detected
 
-        id2label = self._model.config.id2label
-        id2label[len(self._model.config.id2label)] = "no object"
-        detected_tables = outputs_to_objects(outputs, image.size, id2label)
 
-        return detected_tables
+class TableDetector(metaclass=SingletonMeta):
+    """
+    Detect tables in an image
+
+    Parameters
+    ----------
+    backend : {"torch", "quantized", "onnx"}, default="torch"
+        How to run the model: full-precision PyTorch (on CUDA if available),
+        PyTorch with int8 dynamic quantization, or onnxruntime. The last two
+        are faster on CPU, see aiutils._backends
+    """
+
+    def __init__(self, backend="torch"):
+        self._detection_transform = _detection_transform(800)
+        self._model, id2label = _backends.load(
+            "microsoft/table-transformer-detection",
+            backend=backend,
+            revision="no_timm",
+        )
+        self._id2label = _with_no_object(id2label)
+
+    def detect(self, image):
+        """Return a list of detected tables in the image."""
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images, batch_size=8):
+        """
+        Return a list with the detected tables of each image, running the model
+        on up to batch_size images at once
+        """
+        return [
+            detections_to_objects(detections, self._id2label)
+            for detections in _detect_batch(
+                self._model, self._detection_transform, images, batch_size
+            )
+        ]
 
 
 def fig2img(fig):
     """Convert a Matplotlib figure to a PIL Image and return it"""
+    from PIL import Image
+
     buf = io.BytesIO()
     fig.savefig(buf)
     buf.seek(0)
@@ -113,6 +237,10 @@ def fig2img(fig):
 
 
 def visualize_detected_tables(img, det_tables):
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    from matplotlib.patches import Patch
+
     plt.imshow(img, interpolation="lanczos")
 
     fig = plt.gcf()
@@ -209,109 +337,283 @@ def crop_tables(image, tables):
 
 
 class TableStructureDetector(metaclass=SingletonMeta):
-    """Detect the structure of a table in an image (rows and columns)"""
-
-    def __init__(self):
-        self._device = "cuda" if torch.cuda.is_available() else "cpu"
-
-        self._structure_model = AutoModelForObjectDetection.from_pretrained(
-            "microsoft/table-transformer-structure-recognition-v1.1-all"
-        ).to(self._device)
-
-        self._structure_transform = transforms.Compose(
-            [
-                MaxResize(1000),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-            ]
+    """
+    Detect the structure of a table in an image (rows and columns), backend
+    is the same as in TableDetector
+    """
+
+    def __init__(self, backend="torch"):
+        self._structure_model, id2label = _backends.load(
+            "microsoft/table-transformer-structure-recognition-v1.1-all",
+            backend=backend,
         )
+        self._id2label = _with_no_object(id2label)
+        self._structure_transform = _detection_transform(1000)
 
     def detect(self, image_table):
         """Detect the structure of a single table"""
-        pixel_values = (
-            self._structure_transform(image_table).unsqueeze(0).to(self._device)
+        return self.detect_batch([image_table])[0]
+
+    def detect_batch(self, image_tables, batch_size=8):
+        """
+        Detect the structure of many tables, running the model on up to
+        batch_size tables at once. Returns a list of (image_table, cells)
+        """
+        detected = _detect_batch(
+            self._structure_model, self._structure_transform, image_tables, batch_size
         )
+        tables = []
 
-        with torch.no_grad():
-            outputs = self._structure_model(pixel_values)
+        for image_table, detections in zip(image_tables, detected):
+            # postprocess to get individual elements
+            cells = detections_to_objects(detections, self._id2label)
+            tables.append((_draw_cells(image_table, cells), cells))
 
-        # postprocess to get individual elements
-        id2label = self._structure_model.config.id2label
-        id2label[len(self._structure_model.config.id2label)] = "no object"
-        cells = outputs_to_objects(outputs, image_table.size, id2label)
+        return tables
 
-        # visualize cells on cropped table
-        image_table = deepcopy(image_table)
 
-        draw = ImageDraw.Draw(image_table)
+def _draw_cells(image_table, cells):
+    """Return a copy of the table with the cells drawn on it"""
+    from PIL import ImageDraw
 
-        for cell in cells:
-            draw.rectangle(cell["bbox"], outline="red")
+    image_table = deepcopy(image_table)
 
-        return image_table, cells
+    draw = ImageDraw.Draw(image_table)
 
+    for cell in cells:
+        draw.rectangle(cell["bbox"], outline="red")
+
+    return image_table
+
+
+class CellGrid(NamedTuple):
+    """
+    The cells of a table: rows (n_rows, 4) sorted top to bottom, columns
+    (n_columns, 4) sorted left to right, and cells (n_rows, n_columns, 4),
+    all xyxy boxes
+    """
+
+    rows: np.ndarray
+    columns: np.ndarray
+    cells: np.ndarray
 
-def get_cell_coordinates_by_row(table_data):
-    # Extract rows and columns
-    rows = [entry for entry in table_data if entry["label"] == "table row"]
-    columns = [entry for entry in table_data if entry["label"] == "table column"]
+
+def _boxes_with_label(table_data, label):
+    boxes = [entry["bbox"] for entry in table_data if entry["label"] == label]
+    return np.array(boxes, dtype=float).reshape(-1, 4)
+
+
+def cell_grid(table_data):
+    """
+    Build the CellGrid of a table from the output of TableStructureDetector:
+    each cell spans its column horizontally and its row vertically
+    """
+    rows = _boxes_with_label(table_data, "table row")
+    columns = _boxes_with_label(table_data, "table column")
 
     # Sort rows and columns by their Y and X coordinates, respectively
-    rows.sort(key=lambda x: x["bbox"][1])
-    columns.sort(key=lambda x: x["bbox"][0])
-
-    # Function to find cell coordinates
-    def find_cell_coordinates(row, column):
-        cell_bbox = [
-            column["bbox"][0],
-            row["bbox"][1],
-            column["bbox"][2],
-            row["bbox"][3],
-        ]
-        return cell_bbox
+    rows = rows[np.argsort(rows[:, 1], kind="stable")]
+    columns = columns[np.argsort(columns[:, 0], kind="stable")]
 
-    # Generate cell coordinates and count cells in each row
-    cell_coordinates = []
+    cells = np.empty((len(rows), len(columns), 4))
+    cells[:, :, [0, 2]] = columns[np.newaxis, :, [0, 2]]
+    cells[:, :, [1, 3]] = rows[:, np.newaxis, [1, 3]]
 
-    for row in rows:
-        row_cells = []
-        for column in columns:
-            cell_bbox = find_cell_coordinates(row, column)
-            row_cells.append({"column": column["bbox"], "cell": cell_bbox})
+    return CellGrid(rows, columns, cells)
 
-        # Sort cells in the row by X coordinate
-        row_cells.sort(key=lambda x: x["column"][0])
 
-        # Append row information to cell_coordinates
-        cell_coordinates.append(
-            {"row": row["bbox"], "cells": row_cells, "cell_count": len(row_cells)}
+def get_cell_coordinates_by_row(table_data):
+    """
+    Return the cells of a table by row (top to bottom), each row is a
+    dictionary with its "row" box, its "cells" (left to right, each with its
+    "column" and "cell" boxes) and "cell_count"
+    """
+    grid = cell_grid(table_data)
+    columns = grid.columns.tolist()
+
+    return [
+        {
+            "row": row,
+            "cells": [
+                {"column": column, "cell": cell}
+                for column, cell in zip(columns, row_cells)
+            ],
+            "cell_count": len(columns),
+        }
+        for row, row_cells in zip(grid.rows.tolist(), grid.cells.tolist())
+    ]
+
+
+class OCRResult(NamedTuple):
+    """
+    The text of a table: df uses the first row as the header, data maps the
+    row number (as a string) to the text of its cells. Both are None if no
+    text was found
+    """
+
+    df: "pd.DataFrame"
+    data: dict
+
+
+def table_to_dataframe(data):
+    """
+    Build a DataFrame from the rows returned by apply_ocr (row number -> list
+    of cell texts), using the first row as the header. Returns None if there
+    are no cells
+    """
+    rows = list(data.values())
+
+    if not rows or not rows[0]:
+        return None
+
+    import pandas as pd
+
+    return pd.DataFrame(rows[1:], columns=rows[0])
+
+
+def _overlap(boxes, cells):
+    """
+    Return a (n_boxes, n_cells) array with the fraction of each box's area
+    covered by each cell
+    """
+    # intersection areas through broadcasting
+    width = np.minimum(boxes[:, None, 2], cells[None, :, 2]) - np.maximum(
+        boxes[:, None, 0], cells[None, :, 0]
+    )
+    height = np.minimum(boxes[:, None, 3], cells[None, :, 3]) - np.maximum(
+        boxes[:, None, 1], cells[None, :, 1]
+    )
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area, 1e-9)[:, None]
+
+
+def _split_into_words(box, text):
+    """
+    Split a piece of text into words, estimating the box of each one by
+    assuming every character in box has the same width
+    """
+    x0, y0, x1, y1 = box
+    char_width = (x1 - x0) / max(len(text), 1)
+    words, boxes, start = [], [], 0
+
+    for word in text.split():
+        start = text.index(word, start)
+        words.append(word)
+        boxes.append(
+            [x0 + start * char_width, y0, x0 + (start + len(word)) * char_width, y1]
         )
+        start += len(word)
+
+    return words, boxes
+
 
-    # Sort rows from top to bottom
-    cell_coordinates.sort(key=lambda x: x["row"][1])
+def assign_text_to_cells(results, cell_boxes, min_overlap=0.5):
+    """
+    Return the text of each cell given the output of reader.readtext on the
+    whole table: each piece of text goes to the cell that covers the largest
+    fraction of its box. Pieces without a cell covering at least min_overlap
+    (e.g., the detector merged words from neighboring cells) are split into
+    words, and each word goes to the cell it overlaps the most. Pieces in the
+    same cell are joined in reading order, text outside every cell is dropped
+    """
+    texts = [[] for _ in cell_boxes]
 
-    return cell_coordinates
+    if not results or not texts:
+        return ["" for _ in texts]
 
+    # readtext returns four corners, use their bounding box
+    corners = np.array([np.asarray(result[0], dtype=float) for result in results])
+    boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    cells = np.asarray(cell_boxes, dtype=float)
+    overlap = _overlap(boxes, cells)
 
-def apply_ocr(cell_coordinates, cropped_table):
-    # let's OCR row by row
-    data = dict()
-    max_num_columns = 0
-    for idx, row in enumerate(cell_coordinates):
+    for box, result, box_overlap in zip(boxes, results, overlap):
+        cell = box_overlap.argmax()
+
+        if box_overlap[cell] >= min_overlap:
+            texts[cell].append(result[1])
+            continue
+
+        words, word_boxes = _split_into_words(box, result[1])
+
+        if not words:
+            continue
+
+        word_overlap = _overlap(np.asarray(word_boxes), cells)
+
+        for word, best, overlaps in zip(
+            words, word_overlap.argmax(axis=1), word_overlap
+        ):
+            if overlaps[best] > 0:
+                texts[best].append(word)
+
+    return [" ".join(text) for text in texts]
+
+
+def _cell_boxes_by_row(cell_coordinates):
+    """Return the cell boxes of each row, from a CellGrid or the dictionaries"""
+    if isinstance(cell_coordinates, CellGrid):
+        return cell_coordinates.cells.tolist()
+
+    return [[cell["cell"] for cell in row["cells"]] for row in cell_coordinates]
+
+
+def _ocr_by_cell(cell_boxes, cropped_table):
+    """Run OCR on each cell, returns the text of every row's cells"""
+    rows = []
+
+    for row_boxes in cell_boxes:
         row_text = []
-        for cell in row["cells"]:
+
+        for box in row_boxes:
             # crop cell out of image
-            cell_image = np.array(cropped_table.crop(cell["cell"]))
+            cell_image = np.array(cropped_table.crop(box))
             # apply OCR
-            result = reader.readtext(np.array(cell_image))
-            if len(result) > 0:
-                text = " ".join([x[1] for x in result])
-                row_text.append(text)
+            result = get_reader().readtext(cell_image)
+            row_text.append(" ".join([x[1] for x in result]))
+
+        rows.append(row_text)
+
+    return rows
+
+
+def _ocr_by_table(cell_boxes, cropped_table):
+    """Run OCR once on the table, returns the text of every row's cells"""
+    results = get_reader().readtext(np.array(cropped_table))
+    flat = [box for row_boxes in cell_boxes for box in row_boxes]
+    texts = iter(assign_text_to_cells(results, flat))
+
+    return [[next(texts) for _ in row_boxes] for row_boxes in cell_boxes]
+
 
-        if len(row_text) > max_num_columns:
-            max_num_columns = len(row_text)
+_OCR_MODES = {"cell": _ocr_by_cell, "table": _ocr_by_table}
 
-        data[str(idx)] = row_text
+
+def apply_ocr(cell_coordinates, cropped_table, mode="cell"):
+    """
+    OCR every cell of a table, returns an OCRResult. cell_coordinates is a
+    CellGrid or the output of get_cell_coordinates_by_row. Everything happens
+    in memory, so it can be called concurrently from many threads or processes
+
+    mode="cell" runs text detection on each cell, mode="table" runs it once
+    on the whole table and assigns the text to cells by overlap (see
+    assign_text_to_cells), it's faster but may not match mode="cell" when
+    text is close to the cell borders, see benchmarks/tables_ocr_modes.py
+    """
+    if mode not in _OCR_MODES:
+        raise ValueError(
+            f"Unknown mode {mode!r}, expected one of: {', '.join(_OCR_MODES)}"
+        )
+
+    # cells without text are skipped, so rows only have the cells with text
+    data = {
+        str(idx): [text for text in row_text if text]
+        for idx, row_text in enumerate(
+            _OCR_MODES[mode](_cell_boxes_by_row(cell_coordinates), cropped_table)
+        )
+    }
+    max_num_columns = max((len(row_text) for row_text in data.values()), default=0)
 
     # pad rows which don't have max_num_columns elements
     # to make sure all rows have the same number of columns
@@ -320,19 +622,10 @@ def apply_ocr(cell_coordinates, cropped_table):
             row_data = row_data + ["" for _ in range(max_num_columns - len(row_data))]
         data[str(idx)] = row_data
 
-    # write to csv
-    with open("output.csv", "w") as result_file:
-        wr = csv.writer(result_file, dialect="excel")
-
-        for row, row_text in data.items():
-            wr.writerow(row_text)
+    df = table_to_dataframe(data)
 
-    # return as Pandas dataframe
-    # TODO: write to memory instead of disk
-    try:
-        df = pd.read_csv("output.csv")
-    # TODO: this hapens in some pages, but we need a better way to handle this
-    except Exception as e:
-        return None, None
+    # no text found (e.g., a false positive from the table detector)
+    if df is None:
+        return OCRResult(None, None)
 
-    return df, data
+    return OCRResult(df, data)
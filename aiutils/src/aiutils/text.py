@@ -1,14 +1,23 @@
-from PIL import Image
-import pytesseract
-import fitz
-
-
 def image2text(path_to_image):
     """Extracts text from a single image"""
+    from PIL import Image
+    import pytesseract
+
     return pytesseract.image_to_string(Image.open(path_to_image))
 
 
+def iter_pdf_text(path_to_pdf):
+    """
+    Yield the text of each page of a PDF file as it's read, the file is
+    closed when the generator is exhausted or closed
+    """
+    import fitz
+
+    with fitz.open(path_to_pdf) as doc:
+        for page in doc:
+            yield page.get_text()
+
+
 def pdf2text(path_to_pdf):
     """Extracts text from a single PDF file"""
-    doc = fitz.open(path_to_pdf)
-    return [page.get_text() for page in doc]
+    return list(iter_pdf_text(path_to_pdf))
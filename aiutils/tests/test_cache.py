@@ -1,5 +1,9 @@
+import asyncio
 import json
 import sqlite3
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from pydantic import BaseModel
 import pytest
@@ -68,7 +72,11 @@ def test_create_db():
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = cursor.fetchall()
-    assert tables == [("api_calls",)]
+    assert tables == [
+        ("api_calls",),
+        ("api_calls_locks",),
+        ("api_calls_embeddings",),
+    ]
 
 
 def test_insert(sample_messages, sample_response):
@@ -86,18 +94,92 @@ def test_insert(sample_messages, sample_response):
 
     conn = sqlite3.connect("api_calls.db")
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM api_calls")
+    cursor.execute("SELECT qualified_name, key_hash, kwargs, response FROM api_calls")
     rows = cursor.fetchall()
 
     assert rows == [
         (
             "test_cache.dummy_api_function",
-            json.dumps(kwargs),
+            cache.hash_kwargs(kwargs),
+            cache.canonical_kwargs(kwargs),
             json.dumps(sample_response),
         )
     ]
 
 
+def test_insert_replaces_existing_entry(sample_messages):
+    c = cache.APICache(api_function=dummy_api_function, path_to_db="api_calls.db")
+    kwargs = dict(model="gpt-4-0125-preview", messages=sample_messages)
+
+    c.insert(kwargs=kwargs, response={"key": "first"})
+    c.insert(kwargs=kwargs, response={"key": "second"})
+
+    conn = sqlite3.connect("api_calls.db")
+    rows = conn.execute("SELECT response FROM api_calls").fetchall()
+
+    assert rows == [('{"key": "second"}',)]
+
+
+def test_creates_unique_index():
+    cache.APICache(api_function=dummy_api_function, path_to_db="api_calls.db")
+    conn = sqlite3.connect("api_calls.db")
+
+    (sql,) = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND name='api_calls_key'"
+    ).fetchone()
+
+    assert "UNIQUE" in sql
+    assert "(qualified_name, key_hash)" in sql
+
+
+def test_hash_kwargs_ignores_key_order():
+    assert cache.hash_kwargs({"model": "gpt-4", "n": 1}) == cache.hash_kwargs(
+        {"n": 1, "model": "gpt-4"}
+    )
+
+
+def test_lookup_ignores_key_order(sample_cache, sample_messages, sample_response):
+    response = sample_cache.lookup(
+        kwargs=dict(messages=sample_messages, model="gpt-4-0125-preview")
+    )
+
+    assert response == sample_response
+
+
+def test_migrates_legacy_table(sample_messages, sample_response):
+    conn = sqlite3.connect("api_calls.db")
+    conn.execute(
+        """
+        CREATE TABLE api_calls (
+            qualified_name TEXT,
+            kwargs TEXT,
+            response TEXT
+        )
+    """
+    )
+    conn.execute(
+        "INSERT INTO api_calls VALUES (?, ?, ?)",
+        (
+            "test_cache.dummy_api_function",
+            json.dumps(dict(model="gpt-4-0125-preview", messages=sample_messages)),
+            json.dumps(sample_response),
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+    c = cache.APICache(api_function=dummy_api_function, path_to_db="api_calls.db")
+
+    response = c.lookup(
+        kwargs=dict(messages=sample_messages, model="gpt-4-0125-preview")
+    )
+
+    assert response == sample_response
+    assert c.connection.execute("PRAGMA user_version").fetchone() == (
+        cache.SCHEMA_VERSION,
+    )
+
+
 def test_lookup_exists(sample_cache, sample_messages, sample_response):
     response = sample_cache.lookup(
         kwargs=dict(model="gpt-4-0125-preview", messages=sample_messages)
@@ -199,3 +281,742 @@ def test_doesnt_use_cache_if_different_api_function():
 
     assert first_cache(a=1, b=2).to_dict() == {"key": "first api"}
     assert second_cache(a=1, b=2).to_dict() == {"key": "second api"}
+
+
+def test_memory_cache_evicts_least_recently_used():
+    memory = cache.MemoryCache(max_entries=2)
+
+    memory.put("a", 1, size=1)
+    memory.put("b", 2, size=1)
+    assert memory.get("a") == 1
+    memory.put("c", 3, size=1)
+
+    assert "a" in memory
+    assert "b" not in memory
+    assert "c" in memory
+
+
+def test_memory_cache_bounded_by_bytes():
+    memory = cache.MemoryCache(max_bytes=10)
+
+    memory.put("a", 1, size=6)
+    memory.put("b", 2, size=6)
+    memory.put("too-big", 3, size=11)
+
+    assert list(memory._entries) == ["b"]
+    assert memory.n_bytes == 6
+
+
+def test_memory_cache_counts_hits_and_misses():
+    memory = cache.MemoryCache(max_entries=1)
+    memory.put("a", 1, size=1)
+
+    memory.get("a")
+    memory.get("a")
+    memory.get("b")
+
+    assert (memory.hits, memory.misses) == (2, 1)
+
+
+def test_memory_cache_counts_expired_entries_as_misses():
+    memory = cache.MemoryCache(max_entries=2)
+    memory.put("a", 1, size=1)
+    memory.put("b", 2, size=1)
+
+    assert memory.get("a", is_expired=lambda value: value == 1) is None
+    assert memory.get("b", is_expired=lambda value: value == 1) == 2
+
+    assert (memory.hits, memory.misses) == (1, 1)
+    assert "a" not in memory
+
+
+def test_expired_memory_entries_are_not_hits(monkeypatch):
+    responses = iter(["first", "second"])
+
+    def api_function(**kwargs):
+        return SampleResponseModel(key=next(responses))
+
+    my_cache = cache.APICache(
+        api_function=api_function,
+        path_to_db="api_calls.db",
+        ttl=60,
+        max_memory_entries=10,
+    )
+
+    assert my_cache(a=1).to_dict() == {"key": "first"}
+
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 120)
+
+    assert my_cache(a=1).to_dict() == {"key": "second"}
+    assert (my_cache.memory.hits, my_cache.memory.misses) == (0, 2)
+    assert my_cache.stats()["hits"]["memory"] == 0
+
+
+def test_memory_cache_requires_a_bound():
+    with pytest.raises(ValueError):
+        cache.MemoryCache()
+
+
+def test_call_uses_memory_cache(monkeypatch):
+    calls = []
+
+    def api_function(**kwargs):
+        calls.append(kwargs)
+        return SampleResponseModel(key="from the API")
+
+    my_cache = cache.APICache(
+        api_function=api_function, path_to_db="api_calls.db", max_memory_entries=10
+    )
+
+    first = my_cache(a=1)
+
+    # a hot key must not touch the database nor decode the stored response
+    def fail(*args, **kwargs):
+        raise AssertionError("Should not touch the database")
+
+    monkeypatch.setattr(my_cache, "_lookup_raw", fail)
+    second = my_cache(a=1)
+
+    assert len(calls) == 1
+    assert second is first
+    assert (my_cache.memory.hits, my_cache.memory.misses) == (1, 1)
+
+
+def test_insert_updates_memory_cache():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        max_memory_entries=10,
+    )
+
+    my_cache.insert(kwargs={"a": 1}, response={"key": "first"})
+    my_cache.insert(kwargs={"a": 1}, response={"key": "second"})
+
+    assert my_cache(a=1).to_dict() == {"key": "second"}
+
+
+def _age_entries(seconds, path="api_calls.db"):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "UPDATE api_calls SET created_at = created_at - ?, "
+        "accessed_at = accessed_at - ?",
+        (seconds, seconds),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_lookup_ignores_expired_entries():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", ttl=60
+    )
+    my_cache.insert(kwargs={"a": 1}, response={"key": "value"})
+
+    assert my_cache.lookup(kwargs={"a": 1}) == {"key": "value"}
+
+    _age_entries(120)
+
+    assert my_cache.lookup(kwargs={"a": 1}) is None
+
+
+def test_call_refreshes_expired_entries():
+    responses = iter(["first", "second"])
+
+    def api_function(**kwargs):
+        return SampleResponseModel(key=next(responses))
+
+    my_cache = cache.APICache(
+        api_function=api_function,
+        path_to_db="api_calls.db",
+        ttl=60,
+        max_memory_entries=10,
+    )
+
+    assert my_cache(a=1).to_dict() == {"key": "first"}
+
+    _age_entries(120)
+    my_cache.memory.clear()
+
+    assert my_cache(a=1).to_dict() == {"key": "second"}
+
+
+def test_lookup_refreshes_accessed_at():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db"
+    )
+    my_cache.insert(kwargs={"a": 1}, response={"key": "value"})
+    _age_entries(cache.ACCESS_RESOLUTION * 2)
+
+    my_cache.lookup(kwargs={"a": 1})
+
+    ((created_at, accessed_at),) = my_cache.connection.execute(
+        "SELECT created_at, accessed_at FROM api_calls"
+    ).fetchall()
+    assert accessed_at > created_at
+    assert accessed_at == pytest.approx(time.time(), abs=5)
+
+
+def test_evict_deletes_expired_entries_of_the_same_function():
+    def other_api_function():
+        pass
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", ttl=60
+    )
+    other_cache = cache.APICache(
+        api_function=other_api_function, path_to_db="api_calls.db"
+    )
+    my_cache.insert(kwargs={"a": 1}, response={"key": "value"})
+    other_cache.insert(kwargs={"a": 1}, response={"key": "value"})
+    _age_entries(120)
+
+    assert my_cache.evict() == 1
+    assert other_cache.lookup(kwargs={"a": 1}) == {"key": "value"}
+
+
+def test_evict_deletes_least_recently_used_entries_when_over_size():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        max_db_bytes=64 * 1024,
+    )
+
+    for i in range(50):
+        my_cache.insert(kwargs={"i": i}, response={"data": "x" * 4096})
+
+    _age_entries(cache.ACCESS_RESOLUTION * 2)
+    my_cache.lookup(kwargs={"i": 0})
+
+    assert my_cache.evict() > 0
+    my_cache.vacuum()
+
+    assert my_cache.lookup(kwargs={"i": 0}) is not None
+    assert my_cache.lookup(kwargs={"i": 1}) is None
+    assert my_cache.lookup(kwargs={"i": 49}) is not None
+    assert cache._live_size(my_cache.connection) <= 64 * 1024
+
+
+def test_migrates_from_hashed_keys_schema():
+    conn = sqlite3.connect("api_calls.db")
+    cache._create_table(conn.cursor())
+    conn.execute(
+        "INSERT INTO api_calls VALUES (?, ?, ?, ?)",
+        ("test_cache.dummy_api_function", cache.hash_kwargs({"a": 1}), "{}", "{}"),
+    )
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db", ttl=60
+    )
+
+    assert my_cache.lookup(kwargs={"a": 1}) == {}
+
+
+def _count_rows(path="api_calls.db"):
+    conn = sqlite3.connect(path)
+    (count,) = conn.execute("SELECT COUNT(*) FROM api_calls").fetchone()
+    conn.close()
+    return count
+
+
+def test_uses_wal_mode():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db"
+    )
+
+    assert my_cache.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_can_be_shared_across_threads():
+    def api_function(i):
+        return SampleResponseModel(key=str(i))
+
+    my_cache = cache.APICache(api_function=api_function, path_to_db="api_calls.db")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: my_cache(i=i % 10), range(100)))
+
+    assert [r.to_dict() for r in results] == [{"key": str(i % 10)} for i in range(100)]
+    assert _count_rows() == 10
+    assert len(my_cache._connections) > 1
+
+
+def test_batches_inserts():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        batch_size=3,
+        max_batch_delay=float("inf"),
+    )
+
+    my_cache.insert(kwargs={"i": 1}, response={"key": "value"})
+    my_cache.insert(kwargs={"i": 2}, response={"key": "value"})
+
+    # pending inserts are visible to this cache but haven't been committed
+    assert my_cache.lookup(kwargs={"i": 1}) == {"key": "value"}
+    assert _count_rows() == 0
+
+    my_cache.insert(kwargs={"i": 3}, response={"key": "value"})
+
+    assert _count_rows() == 3
+
+
+def test_flushes_batch_after_max_delay():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        batch_size=100,
+        max_batch_delay=0,
+    )
+
+    my_cache.insert(kwargs={"i": 1}, response={"key": "value"})
+
+    assert _count_rows() == 1
+
+
+def test_close_flushes_pending_inserts():
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        batch_size=100,
+        max_batch_delay=float("inf"),
+    )
+    my_cache.insert(kwargs={"i": 1}, response={"key": "value"})
+
+    my_cache.close()
+
+    assert _count_rows() == 1
+
+
+def _slow_api_function(calls, delay=0.2):
+    lock = threading.Lock()
+
+    def api_function(**kwargs):
+        with lock:
+            calls.append(kwargs)
+
+        time.sleep(delay)
+        return SampleResponseModel(key="from the API")
+
+    return api_function
+
+
+def test_coalesces_concurrent_calls_with_the_same_kwargs():
+    calls = []
+    my_cache = cache.APICache(
+        api_function=_slow_api_function(calls), path_to_db="api_calls.db"
+    )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: my_cache(a=1), range(8)))
+
+    assert calls == [{"a": 1}]
+    assert all(r.to_dict() == {"key": "from the API"} for r in results)
+
+
+def test_does_not_coalesce_calls_with_different_kwargs():
+    calls = []
+    my_cache = cache.APICache(
+        api_function=_slow_api_function(calls), path_to_db="api_calls.db"
+    )
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda i: my_cache(a=i), range(4)))
+
+    assert sorted(call["a"] for call in calls) == [0, 1, 2, 3]
+
+
+def test_coalesced_calls_share_the_exception():
+    calls = []
+    barrier = threading.Barrier(4, timeout=5)
+
+    def api_function(**kwargs):
+        calls.append(kwargs)
+        time.sleep(0.2)
+        raise RuntimeError("API is down")
+
+    my_cache = cache.APICache(api_function=api_function, path_to_db="api_calls.db")
+
+    def call(_):
+        barrier.wait()
+
+        with pytest.raises(RuntimeError, match="API is down"):
+            my_cache(a=1)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(call, range(4)))
+
+    assert len(calls) == 1
+    assert my_cache._flights == {}
+
+
+def test_single_flight_can_be_disabled():
+    calls = []
+    barrier = threading.Barrier(4, timeout=5)
+    my_cache = cache.APICache(
+        api_function=_slow_api_function(calls),
+        path_to_db="api_calls.db",
+        single_flight=False,
+    )
+
+    def call(_):
+        barrier.wait()
+        return my_cache(a=1)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(call, range(4)))
+
+    assert len(calls) == 4
+
+
+def test_coalesces_calls_across_cache_instances_with_a_lock_row():
+    calls = []
+    api_function = _slow_api_function(calls)
+
+    # separate instances don't share in-process state, like separate processes
+    caches = [
+        cache.APICache(
+            api_function=api_function, path_to_db="api_calls.db", cross_process=True
+        )
+        for _ in range(4)
+    ]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda c: c(a=1), caches))
+
+    assert calls == [{"a": 1}]
+    assert all(r.to_dict() == {"key": "from the API"} for r in results)
+
+    conn = sqlite3.connect("api_calls.db")
+    assert conn.execute("SELECT COUNT(*) FROM api_calls_locks").fetchone() == (0,)
+
+
+def test_takes_over_abandoned_lock_rows():
+    calls = []
+    my_cache = cache.APICache(
+        api_function=_slow_api_function(calls, delay=0),
+        path_to_db="api_calls.db",
+        cross_process=True,
+        lock_timeout=60,
+    )
+
+    conn = sqlite3.connect("api_calls.db")
+    conn.execute(
+        "INSERT INTO api_calls_locks VALUES (?, ?, ?)",
+        (my_cache._qualified_name, cache.hash_kwargs({"a": 1}), time.time() - 120),
+    )
+    conn.commit()
+
+    assert my_cache(a=1).to_dict() == {"key": "from the API"}
+    assert len(calls) == 1
+
+
+class AsyncClient:
+    def __init__(self, delay=0.1) -> None:
+        self.calls = []
+        self._delay = delay
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        await asyncio.sleep(self._delay)
+        return SampleResponseModel(key=f"from the API: {kwargs['a']}")
+
+
+def test_async_cache_calls_api_and_uses_cache():
+    client = AsyncClient()
+    my_cache = cache.AsyncAPICache(
+        api_function=client.create, path_to_db="api_calls.db"
+    )
+
+    async def main():
+        first = await my_cache(a=1)
+        second = await my_cache(a=1)
+        return first, second
+
+    first, second = asyncio.run(main())
+
+    assert first.to_dict() == second.to_dict() == {"key": "from the API: 1"}
+    assert client.calls == [{"a": 1}]
+
+
+def test_async_cache_coalesces_concurrent_tasks():
+    client = AsyncClient()
+    my_cache = cache.AsyncAPICache(
+        api_function=client.create, path_to_db="api_calls.db"
+    )
+
+    async def main():
+        return await asyncio.gather(*[my_cache(a=i % 2) for i in range(10)])
+
+    results = asyncio.run(main())
+
+    assert sorted(call["a"] for call in client.calls) == [0, 1]
+    assert [r.key for r in results] == [f"from the API: {i % 2}" for i in range(10)]
+
+
+def test_async_cache_shares_exceptions():
+    calls = []
+
+    async def api_function(**kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(0.1)
+        raise RuntimeError("API is down")
+
+    my_cache = cache.AsyncAPICache(api_function=api_function, path_to_db="api_calls.db")
+
+    async def main():
+        return await asyncio.gather(
+            *[my_cache(a=1) for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_async_cache_followers_retry_when_the_leader_is_cancelled():
+    client = AsyncClient()
+    my_cache = cache.AsyncAPICache(
+        api_function=client.create, path_to_db="api_calls.db"
+    )
+
+    async def main():
+        leader = asyncio.create_task(my_cache(a=1))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(my_cache(a=1)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        results = await asyncio.gather(*followers)
+        return leader, results
+
+    leader, results = asyncio.run(main())
+
+    assert leader.cancelled()
+    assert [r.key for r in results] == ["from the API: 1"] * 3
+    # the cancelled call and a single retry by one of the followers
+    assert client.calls == [{"a": 1}, {"a": 1}]
+
+
+def test_async_cache_cancelling_a_follower_does_not_cancel_the_call():
+    client = AsyncClient()
+    my_cache = cache.AsyncAPICache(
+        api_function=client.create, path_to_db="api_calls.db"
+    )
+
+    async def main():
+        leader = asyncio.create_task(my_cache(a=1))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(my_cache(a=1))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+
+        result = await leader
+        return follower, result
+
+    follower, result = asyncio.run(main())
+
+    assert follower.cancelled()
+    assert result.key == "from the API: 1"
+    assert client.calls == [{"a": 1}]
+
+
+def test_async_cache_does_not_block_the_event_loop(monkeypatch):
+    client = AsyncClient(delay=0)
+    my_cache = cache.AsyncAPICache(
+        api_function=client.create, path_to_db="api_calls.db"
+    )
+    lookup_raw = my_cache._lookup_raw
+    loop_threads = set()
+
+    def lookup_raw_in_thread(key):
+        loop_threads.add(threading.get_ident())
+        return lookup_raw(key)
+
+    monkeypatch.setattr(my_cache, "_lookup_raw", lookup_raw_in_thread)
+
+    async def main():
+        await my_cache(a=1)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+
+    assert loop_threads and loop_thread not in loop_threads
+
+
+def test_async_cache_coalesces_across_instances_with_a_lock_row():
+    client = AsyncClient()
+    caches = [
+        cache.AsyncAPICache(
+            api_function=client.create, path_to_db="api_calls.db", cross_process=True
+        )
+        for _ in range(3)
+    ]
+
+    async def main():
+        return await asyncio.gather(*[c(a=1) for c in caches])
+
+    results = asyncio.run(main())
+
+    assert client.calls == [{"a": 1}]
+    assert all(r.key == "from the API: 1" for r in results)
+
+
+def test_stores_compressed_responses(sample_response):
+    my_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        compression="zlib",
+    )
+
+    my_cache.insert(kwargs={"a": 1}, response=sample_response)
+
+    conn = sqlite3.connect("api_calls.db")
+    ((stored,),) = conn.execute("SELECT response FROM api_calls").fetchall()
+
+    assert isinstance(stored, bytes)
+    assert my_cache.lookup(kwargs={"a": 1}) == sample_response
+    assert my_cache(a=1).to_dict() == sample_response
+
+
+def test_reads_text_and_compressed_responses(sample_response):
+    text_cache = cache.APICache(
+        api_function=dummy_api_function, path_to_db="api_calls.db"
+    )
+    text_cache.insert(kwargs={"a": 1}, response=sample_response)
+
+    compressed_cache = cache.APICache(
+        api_function=dummy_api_function,
+        path_to_db="api_calls.db",
+        compression="zlib",
+    )
+    compressed_cache.insert(kwargs={"a": 2}, response={"key": "value"})
+
+    assert compressed_cache.lookup(kwargs={"a": 1}) == sample_response
+    assert text_cache.lookup(kwargs={"a": 2}) == {"key": "value"}
+
+
+class Chunk:
+    def __init__(self, data) -> None:
+        self._data = data
+
+    def model_dump(self):
+        return self._data
+
+
+def make_stream_chunks(text):
+    def chunk(delta, finish_reason=None):
+        return {
+            "id": "chatcmpl-123",
+            "object": "chat.completion.chunk",
+            "created": 1706991533,
+            "model": "gpt-4o-mini",
+            "system_fingerprint": None,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": delta,
+                    "finish_reason": finish_reason,
+                    "logprobs": None,
+                }
+            ],
+            "usage": None,
+        }
+
+    return (
+        [chunk({"role": "assistant", "content": ""})]
+        + [chunk({"content": word}) for word in text.split(" ")]
+        + [chunk({}, finish_reason="stop")]
+    )
+
+
+def _content(chunks):
+    return "".join(c.choices[0].delta.get("content") or "" for c in chunks)
+
+
+def test_caches_streaming_calls():
+    calls = []
+
+    def api_function(**kwargs):
+        calls.append(kwargs)
+        return (Chunk(c) for c in make_stream_chunks("Hello there"))
+
+    my_cache = cache.APICache(api_function=api_function, path_to_db="api_calls.db")
+
+    first = list(my_cache(a=1, stream=True))
+    second = list(my_cache(a=1, stream=True))
+
+    assert _content(first) == _content(second) == "Hellothere"
+    assert len(calls) == 1
+    assert my_cache.lookup(kwargs={"a": 1, "stream": True})["choices"][0][
+        "message"
+    ] == {"role": "assistant", "content": "Hellothere"}
+
+
+def test_streaming_calls_pass_chunks_through_before_the_stream_ends():
+    def api_function(**kwargs):
+        yield Chunk(make_stream_chunks("a")[0])
+        raise RuntimeError("connection dropped")
+
+    my_cache = cache.APICache(api_function=api_function, path_to_db="api_calls.db")
+    stream = my_cache(a=1, stream=True)
+
+    assert next(stream).object == "chat.completion.chunk"
+
+    with pytest.raises(RuntimeError, match="connection dropped"):
+        next(stream)
+
+    # incomplete streams are not cached
+    assert my_cache.lookup(kwargs={"a": 1, "stream": True}) is None
+
+
+def test_streaming_calls_replay_from_memory(monkeypatch):
+    def api_function(**kwargs):
+        return (Chunk(c) for c in make_stream_chunks("Hello there"))
+
+    my_cache = cache.APICache(
+        api_function=api_function, path_to_db="api_calls.db", max_memory_entries=10
+    )
+    list(my_cache(a=1, stream=True))
+
+    monkeypatch.setattr(my_cache, "_lookup_raw", None)
+
+    assert _content(my_cache(a=1, stream=True)) == "Hellothere"
+
+
+def test_async_cache_caches_streaming_calls():
+    calls = []
+
+    class AsyncStream:
+        def __init__(self, chunks) -> None:
+            self._chunks = iter(chunks)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return Chunk(next(self._chunks))
+            except StopIteration:
+                raise StopAsyncIteration
+
+    async def api_function(**kwargs):
+        calls.append(kwargs)
+        return AsyncStream(make_stream_chunks("Hello there"))
+
+    my_cache = cache.AsyncAPICache(api_function=api_function, path_to_db="api_calls.db")
+
+    async def consume():
+        return [chunk async for chunk in await my_cache(a=1, stream=True)]
+
+    async def main():
+        return await consume(), await consume()
+
+    first, second = asyncio.run(main())
+
+    assert _content(first) == _content(second) == "Hellothere"
+    assert len(calls) == 1
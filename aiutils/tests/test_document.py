@@ -0,0 +1,127 @@
+import pickle
+
+import pytest
+
+pytest.importorskip("jinja2")
+pytest.importorskip("torch")
+
+from aiutils import document as document_module  # noqa: E402
+from aiutils.document import Document, ENCODING_NAME  # noqa: E402
+from aiutils.pagecache import PageCache  # noqa: E402
+
+
+class DocumentWithFakeTables(Document):
+    """Detects one table per page without running the models"""
+
+    def _detect_tables_in_pages(self, page_numbers):
+        return [[{"0": [f"table in page {n}"]}] for n in page_numbers]
+
+
+@pytest.fixture
+def document():
+    # store the text and token counts so the PDF is never opened
+    pdf = "document.pdf"
+    with open(pdf, "wb") as f:
+        f.write(b"%PDF-1.4 not really a PDF")
+
+    def make(path_to_cache, n_pages=10, cls=DocumentWithFakeTables):
+        cache = PageCache(pdf, path_to_cache)
+
+        for page_number in range(n_pages):
+            cache.save_page_text(page_number, f"text in page {page_number}")
+
+        cache.save_token_counts([4] * n_pages, ENCODING_NAME)
+        return cls(pdf, path_to_cache=path_to_cache)
+
+    return make
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_iter_prompts_in_parallel_matches_serial(document, ordered):
+    serial = list(document("serial").iter_prompts(batch_size=3))
+    parallel = list(
+        document("parallel").iter_prompts(n_workers=2, ordered=ordered, batch_size=3)
+    )
+
+    assert len(serial) == 10
+    assert "table in page 9" in serial[9]
+
+    if ordered:
+        assert parallel == serial
+    else:
+        assert sorted(parallel) == sorted(serial)
+
+
+def test_document_is_pickled_without_the_open_pdf(document):
+    doc = document("cache")
+    doc._fitz_document = object()
+
+    copy = pickle.loads(pickle.dumps(doc))
+
+    assert copy._fitz_document is None
+    assert copy.tokens_per_page == doc.tokens_per_page
+    assert copy._cache.key == doc._cache.key
+
+
+def test_detect_tables_splits_them_back_by_page(document, monkeypatch):
+    # pages 0, 1 and 2 have two, zero and one tables
+    n_tables = {0: 2, 1: 0, 2: 1}
+    structure_batches = []
+
+    class TableDetector:
+        def __init__(self, backend):
+            pass
+
+        def detect_batch(self, pages):
+            return [[{"bbox": i} for i in range(n_tables[page])] for page in pages]
+
+    class TableStructureDetector:
+        def __init__(self, backend):
+            pass
+
+        def detect_batch(self, images):
+            structure_batches.append(list(images))
+            return [(image, image) for image in images]
+
+    tables = document_module.tables
+    monkeypatch.setattr(tables, "TableDetector", TableDetector)
+    monkeypatch.setattr(tables, "TableStructureDetector", TableStructureDetector)
+    monkeypatch.setattr(
+        tables, "crop_tables", lambda page, d: [(page, t["bbox"]) for t in d]
+    )
+    monkeypatch.setattr(tables, "cell_grid", lambda cells: cells)
+    monkeypatch.setattr(
+        tables, "apply_ocr", lambda coords, image: (None, {"table": image})
+    )
+
+    doc = document("cache", cls=Document)
+    monkeypatch.setattr(doc, "get_page_as_image", lambda page_number: page_number)
+
+    assert doc._detect_tables_in_pages([0, 1, 2]) == [
+        [{"table": (0, 0)}, {"table": (0, 1)}],
+        [],
+        [{"table": (2, 0)}],
+    ]
+    # the structure of every table is detected in a single batch
+    assert structure_batches == [[(0, 0), (0, 1), (2, 0)]]
+
+
+@pytest.mark.parametrize("cache_images", [False, True])
+def test_rendered_pages_are_only_cached_if_asked(cache_images):
+    fitz = pytest.importorskip("fitz")
+    pytest.importorskip("PIL")
+
+    pdf = fitz.open()
+    pdf.new_page().insert_text((72, 72), "hello")
+    pdf.save("document.pdf")
+
+    cache = PageCache("document.pdf", "cache")
+    cache.save_page_text(0, "hello")
+    cache.save_token_counts([1], ENCODING_NAME)
+
+    doc = Document("document.pdf", path_to_cache="cache", cache_images=cache_images)
+    image = doc.get_page_as_image(0)
+    doc.close()
+
+    assert image.size[0] > 0
+    assert (cache.load_image(0) is not None) is cache_images
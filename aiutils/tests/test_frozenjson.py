@@ -0,0 +1,113 @@
+import copy
+import pickle
+
+import pytest
+
+from aiutils.frozenjson import FrozenJSON, FrozenList
+
+
+@pytest.fixture
+def data():
+    return {
+        "choices": [{"message": {"content": "hello", "tool_calls": None}}],
+        "class": "keyword",
+        "usage": {"total_tokens": 3},
+        "embedding": [[0.1, 0.2], [0.3, 0.4]],
+    }
+
+
+def test_attribute_access(data):
+    frozen = FrozenJSON(data)
+
+    assert frozen.choices[0].message.content == "hello"
+    assert frozen.usage.total_tokens == 3
+    assert frozen.embedding[1][0] == 0.3
+
+
+def test_keyword_keys_are_accessed_with_a_trailing_underscore(data):
+    frozen = FrozenJSON(data)
+
+    assert frozen.class_ == "keyword"
+    assert frozen["class"] == "keyword"
+    assert frozen["class_"] == "keyword"
+    assert "class_" in dir(frozen)
+
+
+def test_children_are_memoized(data):
+    frozen = FrozenJSON(data)
+
+    assert frozen.usage is frozen.usage
+    assert frozen.choices is frozen.choices
+    assert frozen.choices[0] is frozen.choices[0]
+
+
+def test_does_not_copy_the_data(data):
+    frozen = FrozenJSON(data)
+
+    assert frozen.to_dict(copy=False) is data
+    assert frozen.usage.to_dict(copy=False) is data["usage"]
+    assert frozen.choices.to_list(copy=False) is data["choices"]
+
+
+def test_to_dict_copies_by_default(data):
+    frozen = FrozenJSON(data)
+    copied = frozen.to_dict()
+
+    assert copied == data
+    assert copied is not data
+    assert copied["usage"] is not data["usage"]
+
+
+def test_lists_are_wrapped_lazily_in_a_read_only_view(data):
+    choices = FrozenJSON(data).choices
+
+    assert isinstance(choices, FrozenList)
+    assert choices._items == [choices._items[0]]
+    assert len(choices) == 1
+    assert choices == data["choices"]
+    assert [c.message.content for c in choices] == ["hello"]
+    assert choices[:1][0] is choices[0]
+
+    with pytest.raises(TypeError):
+        choices[0] = {}
+
+
+def test_wrapping_a_list_returns_a_view():
+    frozen = FrozenJSON([{"a": 1}, 2])
+
+    assert isinstance(frozen, FrozenList)
+    assert frozen[0].a == 1
+    assert frozen[1] == 2
+
+
+def test_wrapping_a_scalar_returns_it():
+    assert FrozenJSON(1) == 1
+
+
+def test_exposes_mapping_methods(data):
+    frozen = FrozenJSON(data)
+
+    assert list(frozen.keys()) == list(data)
+    assert frozen.get("missing") is None
+
+
+def test_missing_key(data):
+    frozen = FrozenJSON(data)
+
+    with pytest.raises(KeyError):
+        frozen.missing
+
+    with pytest.raises(KeyError):
+        frozen["missing"]
+
+
+def test_can_be_copied(data):
+    frozen = FrozenJSON(data)
+
+    assert copy.deepcopy(frozen).to_dict() == data
+
+
+def test_can_be_pickled(data):
+    frozen = pickle.loads(pickle.dumps(FrozenJSON(data)))
+
+    assert frozen.choices[0].message.content == "hello"
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+import pytest
+
+from aiutils.pagecache import PageCache, hash_file
+
+
+@pytest.fixture
+def pdf():
+    path = Path("document.pdf")
+    path.write_bytes(b"%PDF-1.4 not really a pdf")
+    return path
+
+
+def test_key_is_the_hash_of_the_content(pdf):
+    copy = Path("copy.pdf")
+    copy.write_bytes(pdf.read_bytes())
+
+    assert PageCache(pdf, "cache").key == hash_file(pdf)
+    assert PageCache(copy, "cache").key == PageCache(pdf, "cache").key
+
+
+def test_stores_text_and_token_counts(pdf):
+    cache = PageCache(pdf, "cache")
+    cache.save_page_text(0, "one")
+    cache.save_page_text(1, "dos, ñ")
+    cache.save_token_counts([1, 3], "cl100k_base")
+
+    cache = PageCache(pdf, "cache")
+
+    assert cache.load_page_text(0) == "one"
+    assert cache.load_page_text(1) == "dos, ñ"
+    assert cache.load_token_counts("cl100k_base") == [1, 3]
+
+
+def test_ignores_token_counts_from_another_encoding(pdf):
+    cache = PageCache(pdf, "cache")
+    cache.save_token_counts([1], "cl100k_base")
+
+    assert cache.load_token_counts("o200k_base") is None
+
+
+def test_missing_entries(pdf):
+    cache = PageCache(pdf, "cache")
+
+    assert cache.load_token_counts("cl100k_base") is None
+    assert cache.load_page_text(0) is None
+    assert cache.load_tables(0) is None
+
+
+def test_stores_tables(pdf):
+    tables = [{"0": ["a", "b"], "1": ["1", "2"]}, None]
+    PageCache(pdf, "cache").save_tables(3, tables)
+
+    assert PageCache(pdf, "cache").load_tables(3) == tables
+    assert PageCache(pdf, "cache").load_tables(2) is None
+
+
+def test_changing_the_file_invalidates_the_cache(pdf):
+    PageCache(pdf, "cache").save_tables(0, [])
+    pdf.write_bytes(b"%PDF-1.4 another document")
+
+    assert PageCache(pdf, "cache").load_tables(0) is None
+
+
+def test_does_not_leave_temporary_files(pdf):
+    cache = PageCache(pdf, "cache")
+    cache.save_tables(0, [])
+
+    assert [p.name for p in (cache.path / "tables" / "torch").iterdir()] == ["0.json"]
+
+
+def test_tables_are_stored_per_backend(pdf):
+    cache = PageCache(pdf, "cache")
+    cache.save_tables(0, [{"0": ["torch"]}])
+    cache.save_tables(0, [{"0": ["onnx"]}], backend="onnx")
+
+    assert cache.load_tables(0) == [{"0": ["torch"]}]
+    assert cache.load_tables(0, "onnx") == [{"0": ["onnx"]}]
+    assert cache.load_tables(0, "quantized") is None
+
+
+def test_stores_images(pdf):
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("RGB", (4, 2), color=(255, 0, 0))
+
+    PageCache(pdf, "cache").save_image(0, image)
+    loaded = PageCache(pdf, "cache").load_image(0)
+
+    assert loaded.size == (4, 2)
+    assert loaded.getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_clear(pdf):
+    cache = PageCache(pdf, "cache")
+    cache.save_tables(0, [])
+    cache.clear()
+
+    assert not cache.path.exists()
@@ -0,0 +1,182 @@
+import sqlite3
+from threading import Thread
+
+import numpy as np
+from pydantic import BaseModel
+import pytest
+
+from aiutils.semantic import SemanticAPICache, _Index, split_prompt
+
+
+class Response(BaseModel):
+    content: str
+
+
+def make_api_function(calls):
+    def api_function(**kwargs):
+        calls.append(kwargs)
+        return Response(content=f"answer to: {kwargs['messages'][-1]['content']}")
+
+    return api_function
+
+
+def embedding_function(text):
+    # bag of words over a tiny vocabulary, so rewordings are similar
+    words = text.lower().replace("?", "").split()
+    vocabulary = ["capital", "france", "germany", "what", "is", "the", "of"]
+    return [float(words.count(word)) + 0.01 for word in vocabulary]
+
+
+def messages(content):
+    return [
+        {"role": "system", "content": "You're a helpful assistant"},
+        {"role": "user", "content": content},
+    ]
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def semantic_cache(calls):
+    return SemanticAPICache(
+        make_api_function(calls),
+        embedding_function=embedding_function,
+        threshold=0.95,
+        path_to_db="api_calls.db",
+    )
+
+
+def test_split_prompt_uses_last_message():
+    prompt, context = split_prompt({"model": "gpt-4", "messages": messages("hi")})
+
+    assert prompt == "hi"
+    assert context == {
+        "model": "gpt-4",
+        "messages": messages("hi")[:1],
+        "role": "user",
+    }
+
+
+@pytest.mark.parametrize("name", ["prompt", "input"])
+def test_split_prompt_uses_prompt_or_input(name):
+    assert split_prompt({"model": "m", name: "hi"}) == ("hi", {"model": "m"})
+
+
+def test_split_prompt_without_text():
+    assert split_prompt({"model": "m"}) == (None, {"model": "m"})
+
+
+def test_returns_cached_response_for_similar_prompt(semantic_cache, calls):
+    first = semantic_cache(
+        model="gpt-4", messages=messages("What is the capital of France?")
+    )
+    second = semantic_cache(
+        model="gpt-4", messages=messages("what   is the capital of france")
+    )
+
+    assert len(calls) == 1
+    assert second.to_dict() == first.to_dict()
+
+    stats = semantic_cache.stats()
+    assert stats["hits"] == {"memory": 0, "db": 0, "semantic": 1}
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["latency_saved"] > 0
+
+
+def test_calls_api_for_different_prompt(semantic_cache, calls):
+    semantic_cache(model="gpt-4", messages=messages("What is the capital of France?"))
+    response = semantic_cache(
+        model="gpt-4", messages=messages("What is the capital of Germany?")
+    )
+
+    assert len(calls) == 2
+    assert response.content == "answer to: What is the capital of Germany?"
+    assert semantic_cache.stats()["similarities"][-1] < 0.95
+
+
+def test_only_compares_prompts_with_the_same_context(semantic_cache, calls):
+    semantic_cache(model="gpt-4", messages=messages("What is the capital of France?"))
+    semantic_cache(model="gpt-3.5", messages=messages("What is the capital of France?"))
+
+    assert len(calls) == 2
+
+
+def test_counts_exact_hits(semantic_cache, calls):
+    semantic_cache(model="gpt-4", messages=messages("What is the capital of France?"))
+    semantic_cache(model="gpt-4", messages=messages("What is the capital of France?"))
+
+    assert len(calls) == 1
+    assert semantic_cache.stats()["hits"]["db"] == 1
+
+
+def test_uses_embeddings_stored_by_another_instance(calls):
+    def make_cache():
+        return SemanticAPICache(
+            make_api_function(calls),
+            embedding_function=embedding_function,
+            path_to_db="api_calls.db",
+        )
+
+    make_cache()(model="gpt-4", messages=messages("What is the capital of France?"))
+    make_cache()(model="gpt-4", messages=messages("what is the capital of france"))
+
+    assert len(calls) == 1
+
+
+def test_evict_drops_embeddings_of_evicted_entries(semantic_cache, calls):
+    semantic_cache(model="gpt-4", messages=messages("What is the capital of France?"))
+
+    conn = sqlite3.connect("api_calls.db")
+    conn.execute("DELETE FROM api_calls")
+    conn.commit()
+
+    semantic_cache.evict()
+
+    assert conn.execute("SELECT COUNT(*) FROM api_calls_embeddings").fetchone() == (0,)
+
+    semantic_cache(model="gpt-4", messages=messages("what is the capital of france"))
+    assert len(calls) == 2
+
+
+def test_evict_returns_deleted_count(calls):
+    cache = SemanticAPICache(
+        make_api_function(calls),
+        embedding_function=embedding_function,
+        path_to_db="api_calls.db",
+        ttl=60,
+    )
+    cache(model="gpt-4", messages=messages("What is the capital of France?"))
+
+    conn = sqlite3.connect("api_calls.db")
+    conn.execute("UPDATE api_calls SET created_at = 0")
+    conn.commit()
+
+    assert cache.evict() == 1
+    assert conn.execute("SELECT COUNT(*) FROM api_calls_embeddings").fetchone() == (0,)
+
+
+def test_evict_from_another_thread_does_not_leak_connections(semantic_cache):
+    semantic_cache(model="gpt-4", messages=messages("What is the capital of France?"))
+    n_connections = len(semantic_cache._connections)
+
+    thread = Thread(target=semantic_cache.evict)
+    thread.start()
+    thread.join()
+
+    assert len(semantic_cache._connections) == n_connections
+
+
+def test_index_grows_without_losing_rows():
+    index = _Index([], np.empty((0, 3), dtype=np.float32))
+    rows = np.eye(3, dtype=np.float32)[[0, 1, 2, 0, 1]]
+
+    for i, row in enumerate(rows):
+        index.add(f"key-{i}", row)
+
+    assert index.keys == [f"key-{i}" for i in range(5)]
+    np.testing.assert_array_equal(index.matrix, rows)
+    assert index.search(np.array([0, 0, 1], dtype=np.float32)) == ("key-2", 1.0)
@@ -0,0 +1,26 @@
+from aiutils._singleton import SingletonMeta
+
+
+class Model(metaclass=SingletonMeta):
+    def __init__(self, backend="torch"):
+        self.backend = backend
+
+
+class Other(metaclass=SingletonMeta):
+    def __init__(self):
+        pass
+
+
+def test_same_arguments_return_the_same_instance():
+    assert Model() is Model(backend="torch")
+    assert Model("torch") is Model()
+
+
+def test_different_arguments_return_different_instances():
+    assert Model(backend="onnx") is not Model()
+    assert Model(backend="onnx").backend == "onnx"
+
+
+def test_one_instance_per_class():
+    assert Other() is Other()
+    assert Other() is not Model()
@@ -0,0 +1,90 @@
+from pydantic import BaseModel
+
+from aiutils.cache import APICache
+from aiutils.stats import CacheStats, Histogram, to_prometheus
+
+
+class Usage(BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class Response(BaseModel):
+    content: str
+    usage: Usage
+
+
+def api_function(**kwargs):
+    return Response(content="hello", usage=Usage(prompt_tokens=10, completion_tokens=5))
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(1, 2))
+
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [(1, 2), (2, 3), (float("inf"), 4)]
+    assert histogram.sum == 6
+    assert histogram.count == 4
+
+
+def test_stats_counts_hits_misses_and_savings():
+    cache = APICache(
+        api_function,
+        path_to_db="api_calls.db",
+        max_memory_entries=10,
+        token_costs={"prompt": 0.01, "completion": 0.02},
+    )
+
+    cache(a=1)
+    cache(a=1)
+    cache.memory.clear()
+    cache(a=1)
+
+    stats = cache.stats()
+
+    assert stats["qualified_name"] == "test_stats.api_function"
+    assert stats["hits"] == {"memory": 1, "db": 1}
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 2 / 3
+    assert stats["bytes_stored"] > 0
+    assert stats["latency_saved"] > 0
+    assert stats["tokens_saved"] == {"prompt": 20, "completion": 10}
+    assert stats["cost_saved"] == 0.4
+    assert stats["lookup_seconds"]["count"] == 3
+
+
+def test_cost_saved_is_none_without_token_costs():
+    cache = APICache(api_function, path_to_db="api_calls.db")
+    cache(a=1)
+
+    assert cache.stats()["cost_saved"] is None
+
+
+def test_to_prometheus_adds_up_caches_of_the_same_function():
+    first = APICache(api_function, path_to_db="api_calls.db")
+    second = APICache(api_function, path_to_db="api_calls.db")
+
+    first(a=1)
+    second(a=1)
+
+    text = to_prometheus(first, second)
+    labels = 'qualified_name="test_stats.api_function"'
+
+    assert f'aiutils_cache_hits_total{{{labels},tier="db"}} 1' in text
+    assert f"aiutils_cache_misses_total{{{labels}}} 1" in text
+    assert f'aiutils_cache_lookup_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"aiutils_cache_lookup_seconds_count{{{labels}}} 2" in text
+    assert "# TYPE aiutils_cache_lookup_seconds histogram" in text
+    assert "cost_saved" not in text
+
+
+def test_to_prometheus_accepts_cache_stats():
+    stats = CacheStats("module.function", token_costs={"prompt": 1})
+    stats.record_miss()
+
+    text = to_prometheus(stats)
+
+    assert 'aiutils_cache_misses_total{qualified_name="module.function"} 1' in text
+    assert 'aiutils_cache_cost_saved_total{qualified_name="module.function"} 0' in text
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from aiutils import _storage
+
+
+@pytest.fixture
+def embedding_response():
+    return {
+        "data": [
+            {"embedding": [i / 7 for i in range(1536)], "index": 0},
+            {"embedding": [-i / 3 for i in range(1536)], "index": 1},
+        ],
+        "model": "text-embedding-3-small",
+        "usage": {"prompt_tokens": 4, "total_tokens": 4},
+    }
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+def test_roundtrip(embedding_response, compression):
+    encoded = _storage.encode(embedding_response, compression=compression)
+
+    assert encoded.startswith(_storage.MAGIC)
+    assert _storage.decode(encoded) == embedding_response
+
+
+def test_roundtrip_zstd(embedding_response):
+    pytest.importorskip("zstandard")
+
+    encoded = _storage.encode(embedding_response, compression="zstd")
+
+    assert _storage.decode(encoded) == embedding_response
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        {"short": [0.1, 0.2], "ints": list(range(100))},
+        {"mixed": [0.1] * 20 + [1], "bools": [True] * 20},
+        {"nested": [[0.5] * 20, {"values": [0.25] * 20}]},
+        [0.1] * 20,
+        {},
+    ],
+    ids=["short-and-ints", "mixed-and-bools", "nested", "top-level", "empty"],
+)
+def test_roundtrip_keeps_types(response):
+    decoded = _storage.decode(_storage.encode(response))
+
+    assert decoded == response
+    assert [type(v) for v in _flatten(decoded)] == [type(v) for v in _flatten(response)]
+
+
+def _flatten(value):
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from _flatten(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _flatten(v)
+    else:
+        yield value
+
+
+def test_float_arrays_are_stored_in_binary(embedding_response):
+    text_size = len(json.dumps(embedding_response))
+    encoded = _storage.encode(embedding_response, compression="none")
+
+    # 8 bytes per float instead of ~20 characters
+    assert len(encoded) < text_size / 2
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError, match="Unknown compression"):
+        _storage.encode({}, compression="lz4")
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(ValueError, match="Not an encoded response"):
+        _storage.decode(b"{}")
@@ -0,0 +1,139 @@
+import pytest
+
+from aiutils import _streaming
+
+
+def make_chunk(choices, usage=None):
+    return {
+        "id": "chatcmpl-123",
+        "object": "chat.completion.chunk",
+        "created": 1706991533,
+        "model": "gpt-4o-mini",
+        "system_fingerprint": "fp_123",
+        "choices": choices,
+        "usage": usage,
+    }
+
+
+def make_delta(index=0, finish_reason=None, **delta):
+    return {
+        "index": index,
+        "delta": delta,
+        "finish_reason": finish_reason,
+        "logprobs": None,
+    }
+
+
+@pytest.fixture
+def chunks():
+    return [
+        make_chunk([make_delta(role="assistant", content="")]),
+        make_chunk([make_delta(content="Hello! ")]),
+        make_chunk([make_delta(content="How can I help?")]),
+        make_chunk([make_delta(finish_reason="stop")]),
+        make_chunk(
+            [], usage={"prompt_tokens": 5, "completion_tokens": 6, "total_tokens": 11}
+        ),
+    ]
+
+
+def test_assemble(chunks):
+    assert _streaming.assemble(chunks) == {
+        "id": "chatcmpl-123",
+        "object": "chat.completion",
+        "created": 1706991533,
+        "model": "gpt-4o-mini",
+        "system_fingerprint": "fp_123",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "Hello! How can I help?"},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }
+        ],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 6, "total_tokens": 11},
+    }
+
+
+def test_assemble_multiple_choices():
+    chunks = [
+        make_chunk([make_delta(0, content="a"), make_delta(1, content="b")]),
+        make_chunk([make_delta(1, content="b", finish_reason="stop")]),
+        make_chunk([make_delta(0, content="a", finish_reason="length")]),
+    ]
+
+    choices = _streaming.assemble(chunks)["choices"]
+
+    assert [c["message"]["content"] for c in choices] == ["aa", "bb"]
+    assert [c["finish_reason"] for c in choices] == ["length", "stop"]
+
+
+def test_assemble_tool_calls():
+    chunks = [
+        make_chunk(
+            [
+                make_delta(
+                    tool_calls=[
+                        {
+                            "index": 0,
+                            "id": "call_1",
+                            "type": "function",
+                            "function": {"name": "get_weather", "arguments": ""},
+                        }
+                    ]
+                )
+            ]
+        ),
+        make_chunk(
+            [make_delta(tool_calls=[{"index": 0, "function": {"arguments": '{"ci'}}])]
+        ),
+        make_chunk(
+            [
+                make_delta(
+                    tool_calls=[{"index": 0, "function": {"arguments": 'ty": 1}'}}]
+                )
+            ]
+        ),
+        make_chunk([make_delta(finish_reason="tool_calls")]),
+    ]
+
+    response = _streaming.assemble(chunks)
+    message = response["choices"][0]["message"]
+
+    assert _streaming.assemble(list(_streaming.replay(response))) == response
+    assert message["content"] is None
+    assert message["tool_calls"] == [
+        {
+            "id": "call_1",
+            "type": "function",
+            "function": {"name": "get_weather", "arguments": '{"city": 1}'},
+        }
+    ]
+
+
+def test_assemble_empty_stream():
+    with pytest.raises(ValueError, match="empty stream"):
+        _streaming.assemble([])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 100])
+def test_replay_assembles_into_the_same_response(chunks, chunk_size):
+    response = _streaming.assemble(chunks)
+
+    replayed = list(_streaming.replay(response, chunk_size=chunk_size))
+
+    assert all(c["object"] == "chat.completion.chunk" for c in replayed)
+    assert _streaming.assemble(replayed) == response
+
+
+def test_replay_splits_content(chunks):
+    response = _streaming.assemble(chunks)
+
+    contents = [
+        c["choices"][0]["delta"].get("content")
+        for c in _streaming.replay(response, chunk_size=8)
+        if c["choices"]
+    ]
+
+    assert contents == ["", "Hello! H", "ow can I", " help?", None]
@@ -0,0 +1,325 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from aiutils import tables
+from aiutils._singleton import SingletonMeta
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = (
+        "import sys, aiutils.tables; "
+        "print(sorted({'torch', 'transformers', 'easyocr', 'matplotlib', 'pandas'}"
+        " & set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.strip() == "[]"
+
+
+def test_assign_text_to_cells():
+    cells = [[0, 0, 10, 10], [10, 0, 20, 10], [0, 10, 10, 20]]
+    results = [
+        ([[1, 1], [5, 1], [5, 4], [1, 4]], "first", 0.9),
+        ([[11, 1], [19, 1], [19, 4], [11, 4]], "second", 0.9),
+        ([[6, 1], [9, 1], [9, 4], [6, 4]], "word", 0.9),
+        # mostly in the second cell
+        ([[8, 5], [18, 5], [18, 8], [8, 8]], "wide", 0.9),
+        # outside every cell
+        ([[50, 50], [60, 50], [60, 60], [50, 60]], "outside", 0.9),
+    ]
+
+    assert tables.assign_text_to_cells(results, cells) == [
+        "first word",
+        "second wide",
+        "",
+    ]
+
+
+def test_assign_text_to_cells_without_text():
+    assert tables.assign_text_to_cells([], [[0, 0, 1, 1]]) == [""]
+
+
+def test_assign_text_to_cells_splits_text_spanning_cells():
+    cells = [[0, 0, 10, 10], [10, 0, 20, 10], [20, 0, 30, 10]]
+    # the detector merged the words of three cells into a single box
+    results = [([[0, 1], [30, 1], [30, 9], [0, 9]], "2019 2020 2021", 0.9)]
+
+    assert tables.assign_text_to_cells(results, cells) == ["2019", "2020", "2021"]
+
+
+def corners(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+class FakeTable:
+    """
+    A region of a table image, np.array(...) returns its box so FakeReader
+    knows which words it contains
+    """
+
+    def __init__(self, box):
+        self.box = box
+
+    def crop(self, box):
+        x0, y0 = self.box[:2]
+        return FakeTable([x0 + box[0], y0 + box[1], x0 + box[2], y0 + box[3]])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array([self.box], dtype=float)
+
+
+class FakeReader:
+    """Returns the words (box, text) whose center is in the image's region"""
+
+    def __init__(self, words):
+        self.words = words
+
+    def readtext(self, image):
+        x0, y0, x1, y1 = image[0]
+        results = []
+
+        for (left, top, right, bottom), text in self.words:
+            center_x, center_y = (left + right) / 2, (top + bottom) / 2
+
+            if x0 <= center_x < x1 and y0 <= center_y < y1:
+                box = corners(left - x0, top - y0, right - x0, bottom - y0)
+                results.append((box, text, 0.9))
+
+        return results
+
+
+# three columns and two rows
+STRUCTURE = [
+    {"label": "table column", "bbox": [0, 0, 10, 20]},
+    {"label": "table column", "bbox": [10, 0, 20, 20]},
+    {"label": "table column", "bbox": [20, 0, 30, 20]},
+    {"label": "table row", "bbox": [0, 0, 30, 10]},
+    {"label": "table row", "bbox": [0, 10, 30, 20]},
+]
+
+WORDS = [
+    ([1, 11, 9, 19], "a"),
+    ([11, 11, 19, 19], "b"),
+    ([21, 11, 29, 19], "c"),
+]
+
+
+def test_apply_ocr_with_text_spanning_cells(monkeypatch):
+    pytest.importorskip("pandas")
+
+    reader = FakeReader([([0, 1, 30, 9], "2019 2020 2021")] + WORDS)
+    monkeypatch.setattr(tables, "get_reader", lambda: reader)
+
+    result = tables.apply_ocr(
+        tables.cell_grid(STRUCTURE), FakeTable([0, 0, 30, 20]), mode="table"
+    )
+
+    assert result.data == {"0": ["2019", "2020", "2021"], "1": ["a", "b", "c"]}
+    assert list(result.df.columns) == ["2019", "2020", "2021"]
+
+
+def test_apply_ocr_table_mode_matches_cell_mode(monkeypatch):
+    pytest.importorskip("pandas")
+
+    header = [([1, 1, 9, 9], "x"), ([11, 1, 19, 9], "y"), ([21, 1, 29, 9], "z")]
+    monkeypatch.setattr(tables, "get_reader", lambda: FakeReader(header + WORDS))
+    grid = tables.cell_grid(STRUCTURE)
+
+    by_cell = tables.apply_ocr(grid, FakeTable([0, 0, 30, 20]))
+    by_table = tables.apply_ocr(grid, FakeTable([0, 0, 30, 20]), mode="table")
+
+    assert by_cell.data == by_table.data == {"0": ["x", "y", "z"], "1": ["a", "b", "c"]}
+
+
+def test_get_cell_coordinates_by_row():
+    structure = [
+        {"label": "table column", "bbox": [10, 0, 20, 30]},
+        {"label": "table row", "bbox": [0, 10, 20, 20]},
+        {"label": "table column", "bbox": [0, 0, 10, 30]},
+        {"label": "table row", "bbox": [0, 0, 20, 10]},
+        {"label": "table", "bbox": [0, 0, 20, 30]},
+    ]
+
+    rows = tables.get_cell_coordinates_by_row(structure)
+
+    assert [row["row"] for row in rows] == [[0, 0, 20, 10], [0, 10, 20, 20]]
+    assert [row["cell_count"] for row in rows] == [2, 2]
+    assert [cell["cell"] for cell in rows[1]["cells"]] == [
+        [0, 10, 10, 20],
+        [10, 10, 20, 20],
+    ]
+
+
+def test_table_to_dataframe():
+    pytest.importorskip("pandas")
+
+    df = tables.table_to_dataframe({"0": ["a", "b"], "1": ["1", "2"]})
+
+    assert list(df.columns) == ["a", "b"]
+    assert df.values.tolist() == [["1", "2"]]
+
+
+@pytest.mark.parametrize("data", [{}, {"0": [], "1": []}])
+def test_table_to_dataframe_without_cells(data):
+    assert tables.table_to_dataframe(data) is None
+
+
+def test_unknown_ocr_mode():
+    with pytest.raises(ValueError, match="Unknown mode"):
+        tables.apply_ocr([], None, mode="page")
+
+
+def test_detections_from_arrays():
+    # three queries, classes: table, table rotated, no object
+    logits = np.array(
+        [[5.0, 0.0, 0.0], [0.0, 0.0, 5.0], [0.0, 1.0, 0.0]], dtype=np.float32
+    )
+    pred_boxes = np.array(
+        [[0.5, 0.5, 0.5, 0.5], [0.1, 0.1, 0.1, 0.1], [0.25, 0.5, 0.5, 1.0]],
+        dtype=np.float32,
+    )
+
+    detections = tables.detections_from_arrays(logits, pred_boxes, (200, 100))
+
+    assert detections.labels.tolist() == [0, 1]
+    np.testing.assert_allclose(
+        detections.boxes, [[50, 25, 150, 75], [0, 0, 100, 100]], rtol=1e-6
+    )
+    assert detections.scores[0] > 0.9
+
+    objects = tables.detections_to_objects(
+        detections, {0: "table", 1: "table rotated", 2: "no object"}
+    )
+
+    assert [o["label"] for o in objects] == ["table", "table rotated"]
+    assert objects[0]["bbox"] == pytest.approx([50, 25, 150, 75])
+    assert isinstance(objects[0]["score"], float)
+
+
+def test_detections_from_arrays_threshold():
+    logits = np.array([[5.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float32)
+    pred_boxes = np.full((2, 4), 0.5, dtype=np.float32)
+
+    detections = tables.detections_from_arrays(
+        logits, pred_boxes, (10, 10), threshold=0.9
+    )
+
+    assert detections.labels.tolist() == [0]
+
+
+def test_cell_grid():
+    structure = [
+        {"label": "table column", "bbox": [10, 0, 20, 30]},
+        {"label": "table row", "bbox": [0, 10, 20, 20]},
+        {"label": "table column", "bbox": [0, 0, 10, 30]},
+    ]
+
+    grid = tables.cell_grid(structure)
+
+    assert grid.cells.shape == (1, 2, 4)
+    assert grid.cells.tolist() == [[[0, 10, 10, 20], [10, 10, 20, 20]]]
+
+
+def test_cell_grid_without_rows():
+    grid = tables.cell_grid([{"label": "table column", "bbox": [0, 0, 10, 30]}])
+
+    assert grid.cells.shape == (0, 1, 4)
+    assert tables.get_cell_coordinates_by_row([]) == []
+
+
+class FakeImage:
+    """Stands in for a PIL image: transformed into a tensor of its size"""
+
+    def __init__(self, width, height, value=1.0):
+        self.size = (width, height)
+        self.value = value
+
+
+def to_tensor(image):
+    import torch
+
+    width, height = image.size
+    return torch.full((3, height, width), image.value)
+
+
+def test_images_to_batch_pads_to_the_largest_image():
+    pytest.importorskip("torch")
+
+    images = [FakeImage(5, 2, value=1.0), FakeImage(3, 4, value=2.0)]
+
+    pixel_values, pixel_mask = tables.images_to_batch(images, to_tensor)
+
+    assert tuple(pixel_values.shape) == (2, 3, 4, 5)
+    assert tuple(pixel_mask.shape) == (2, 4, 5)
+
+    # the first image fills the top two rows, the second the left three columns
+    assert pixel_mask[0].tolist() == [[1] * 5, [1] * 5, [0] * 5, [0] * 5]
+    assert pixel_mask[1].tolist() == [[1, 1, 1, 0, 0]] * 4
+
+    assert (pixel_values[0, :, :2, :] == 1.0).all()
+    assert (pixel_values[0, :, 2:, :] == 0).all()
+    assert (pixel_values[1, :, :, :3] == 2.0).all()
+    assert (pixel_values[1, :, :, 3:] == 0).all()
+
+
+def test_detect_batch_splits_images_in_batches():
+    pytest.importorskip("torch")
+
+    batch_sizes = []
+
+    def model(pixel_values, pixel_mask):
+        n = pixel_values.shape[0]
+        batch_sizes.append(n)
+        # one query per image: a table covering the whole image
+        logits = np.tile(np.array([[5.0, 0.0]], dtype=np.float32), (n, 1, 1))
+        pred_boxes = np.tile(
+            np.array([[0.5, 0.5, 1.0, 1.0]], dtype=np.float32), (n, 1, 1)
+        )
+        return logits, pred_boxes
+
+    images = [FakeImage(10 * (i + 1), 20) for i in range(5)]
+
+    detected = tables._detect_batch(model, to_tensor, images, batch_size=2)
+
+    assert batch_sizes == [2, 2, 1]
+    # each image gets its own detections, scaled to its size
+    assert [d.boxes.tolist() for d in detected] == [
+        [[0, 0, 10 * (i + 1), 20]] for i in range(5)
+    ]
+
+
+def test_table_detector_detect_batch(monkeypatch):
+    pytest.importorskip("torch")
+
+    def model(pixel_values, pixel_mask):
+        n = pixel_values.shape[0]
+        logits = np.tile(np.array([[5.0, 0.0]], dtype=np.float32), (n, 1, 1))
+        pred_boxes = np.tile(
+            np.array([[0.5, 0.5, 1.0, 1.0]], dtype=np.float32), (n, 1, 1)
+        )
+        return logits, pred_boxes
+
+    monkeypatch.setattr(tables, "_detection_transform", lambda max_size: to_tensor)
+    monkeypatch.setattr(
+        tables._backends, "load", lambda *args, **kwargs: (model, {0: "table"})
+    )
+
+    # detectors are singletons, don't keep this one for other tests
+    monkeypatch.setattr(SingletonMeta, "_instances", {})
+
+    detector = tables.TableDetector()
+    detected = detector.detect_batch(
+        [FakeImage(10, 20), FakeImage(30, 40), FakeImage(50, 60)], batch_size=2
+    )
+
+    assert [[t["label"] for t in page] for page in detected] == [["table"]] * 3
+    assert [page[0]["bbox"] for page in detected] == [
+        pytest.approx([0, 0, 10, 20]),
+        pytest.approx([0, 0, 30, 40]),
+        pytest.approx([0, 0, 50, 60]),
+    ]
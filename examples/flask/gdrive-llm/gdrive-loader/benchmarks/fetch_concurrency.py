@@ -0,0 +1,119 @@
+"""
+Documents per second downloaded by fetch_documents at different concurrency
+levels, against a local mock of the Docs API that takes --latency seconds per
+request and returns 429 when more than --capacity requests are in flight
+
+    cd gdrive-loader
+    python benchmarks/fetch_concurrency.py --documents 200 --workers 1 4 8 16 32
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+
+from gdrive_loader.fetch import AdaptiveLimiter, fetch_documents
+
+
+def make_handler(latency, capacity):
+    lock = threading.Lock()
+    in_flight = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        # the headers and body are separate writes, avoid delayed ACK stalls
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            nonlocal in_flight
+
+            with lock:
+                in_flight += 1
+                throttled = in_flight > capacity
+
+            try:
+                time.sleep(latency)
+
+                if throttled:
+                    self.send_response(429)
+                    body = {"error": {"code": 429, "message": "Rate limit exceeded"}}
+                else:
+                    self.send_response(200)
+                    document_id = self.path.split("?")[0].rsplit("/", 1)[-1]
+                    body = {"documentId": document_id, "body": {"content": []}}
+
+                payload = json.dumps(body).encode("utf-8")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            finally:
+                with lock:
+                    in_flight -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--capacity", type=int, default=8)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), make_handler(args.latency, args.capacity)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def build_service():
+        return build(
+            "docs",
+            "v1",
+            credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": endpoint},
+        )
+
+    document_ids = [str(i) for i in range(args.documents)]
+
+    print(
+        f"{'workers':>7} {'docs/s':>8} {'requests':>8} {'throttled':>9} "
+        f"{'final limit':>11}"
+    )
+
+    for max_workers in args.workers:
+        limiter = AdaptiveLimiter(max_workers)
+        stats = {}
+
+        start = time.perf_counter()
+        documents = list(
+            fetch_documents(
+                build_service,
+                document_ids,
+                limiter=limiter,
+                max_workers=max_workers,
+                stats=stats,
+            )
+        )
+        elapsed = time.perf_counter() - start
+
+        assert [d["documentId"] for d in documents] == document_ids
+        print(
+            f"{max_workers:>7} {len(documents) / elapsed:>8.1f} "
+            f"{stats['requests']:>8} {stats.get('throttled', 0):>9} "
+            f"{limiter.limit:>11}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Recall and latency of Document.find_similar with the documents_vec index
+versus the exact scan (exact=True), for different corpus sizes. Embeddings are
+random unit vectors, spread evenly across users (requires numpy)
+
+    cd gdrive-loader
+    python benchmarks/vector_index.py --documents 10000 100000 1000000
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import sqlite_vec
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+
+from gdrive_loader.models import Base, Document, User
+
+DIMENSIONS = 1536
+
+
+def create_engine_with_vec(path):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def load_sqlite_extension(dbapi_connection, connection_record):
+        dbapi_connection.enable_load_extension(True)
+        sqlite_vec.load(dbapi_connection)
+        dbapi_connection.enable_load_extension(False)
+
+    return engine
+
+
+def random_embeddings(rng, n):
+    embeddings = rng.standard_normal((n, DIMENSIONS), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def populate(engine, rng, n_documents, n_users, content_chars, chunk_size=10_000):
+    content = "x" * content_chars
+
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {"id": i, "email": f"user{i}@example.com", "token_info": "{}"}
+                for i in range(n_users)
+            ],
+        )
+
+        # the raw blobs pass the CHECK constraint, FloatArray isn't needed
+        for start in range(0, n_documents, chunk_size):
+            n = min(chunk_size, n_documents - start)
+            embeddings = random_embeddings(rng, n)
+            connection.exec_driver_sql(
+                "INSERT INTO documents (id, name, content, embedding, "
+                "google_drive_id, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (i, f"doc {i}", content, embedding.tobytes(), str(i), i % n_users)
+                    for i, embedding in zip(range(start, start + n), embeddings)
+                ],
+            )
+
+
+def bench(engine, queries, n_users, k, exact):
+    latencies, results = [], []
+
+    with Session(engine) as session:
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            documents = Document.find_similar(
+                session, query.tolist(), user_id=i % n_users, limit=k, exact=exact
+            )
+            latencies.append(time.perf_counter() - start)
+            results.append([document.id for document, _ in documents])
+            session.expunge_all()
+
+    return latencies, results
+
+
+def recall(results, expected, k):
+    return statistics.mean(
+        len(set(found) & set(truth)) / k for found, truth in zip(results, expected)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--documents", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument(
+        "--content-chars",
+        type=int,
+        default=2_000,
+        help="Size of each document's content, the exact scan reads it too",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    queries = random_embeddings(rng, args.queries)
+
+    print(
+        f"{'documents':>10} {'method':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"recall@{args.k}"
+    )
+
+    for n_documents in args.documents:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine_with_vec(Path(tmp, "documents.db"))
+            Base.metadata.create_all(engine)
+            populate(engine, rng, n_documents, args.users, args.content_chars)
+
+            # the exact scan is the ground truth
+            exact_latencies, expected = bench(
+                engine, queries, args.users, args.k, exact=True
+            )
+            index_latencies, results = bench(
+                engine, queries, args.users, args.k, exact=False
+            )
+            engine.dispose()
+
+        for method, latencies, found in [
+            ("exact", exact_latencies, expected),
+            ("index", index_latencies, results),
+        ]:
+            p50 = statistics.median(latencies) * 1000
+            p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+            print(
+                f"{n_documents:>10,} {method:>6} {p50:>9.2f} {p95:>9.2f} "
+                f"{recall(found, expected, args.k):.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
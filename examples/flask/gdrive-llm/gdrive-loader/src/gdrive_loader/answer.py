@@ -1,6 +1,6 @@
 from openai import OpenAI
-from gdrive_loader.models import Document, User
-from sqlalchemy.orm import Session
+from gdrive_loader.models import Chunk, User
+from sqlalchemy.orm import Session, joinedload
 from gdrive_loader.db import engine
 from gdrive_loader.load import compute_embedding
 
@@ -9,12 +9,16 @@ def answer_query(query: str, email: str) -> str:
     embedding = compute_embedding(query, return_single=True)
     with Session(engine) as db_session:
         user = db_session.query(User).filter_by(email=email).first()
-        similar_docs = Document.find_similar(
+        # search the chunks, whole documents may not fit in the context
+        similar_chunks = Chunk.find_similar(
             db_session,
             embedding=embedding,
             user_id=user.id,
             limit=5,
+            # to_markdown uses the document's name, don't load them one by one
+            options=[joinedload(Chunk.document)],
         )
+        context = "\n\n".join([chunk.to_markdown() for chunk, _ in similar_chunks])
 
     client = OpenAI()
     response = client.chat.completions.create(
@@ -26,7 +30,7 @@ def answer_query(query: str, email: str) -> str:
             },
             {
                 "role": "user",
-                "content": "\n\n".join([doc.to_markdown() for doc in similar_docs]),
+                "content": context,
             },
             {
                 "role": "user",
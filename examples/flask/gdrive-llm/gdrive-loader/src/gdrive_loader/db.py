@@ -1,10 +1,17 @@
 from sqlalchemy import create_engine, event
 from gdrive_loader import SETTINGS
-from gdrive_loader.models import Base
+from gdrive_loader.models import Base, create_vector_index
 import sqlite_vec  # Import your SQLite extension module
 
 engine = create_engine(SETTINGS.DB_URI)
 
+# columns added after the tables were first created, create_all doesn't add
+# them to existing tables
+ADDED_COLUMNS = {
+    "users": {"drive_page_token": "VARCHAR(255)"},
+    "documents": {"modified_time": "VARCHAR(64)", "content_hash": "VARCHAR(64)"},
+}
+
 
 @event.listens_for(engine, "connect")
 def load_sqlite_extension(dbapi_connection, connection_record):
@@ -18,6 +25,24 @@ def load_sqlite_extension(dbapi_connection, connection_record):
     dbapi_connection.enable_load_extension(False)
 
 
+def add_missing_columns(connection):
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {
+            row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")
+        }
+
+        for name, type_ in columns.items():
+            if name not in existing:
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {table} ADD COLUMN {name} {type_}"
+                )
+
+
 if __name__ == "__main__":
     print("Creating tables...")
     Base.metadata.create_all(engine)
+
+    # create_all skips existing tables, so upgrade older databases
+    with engine.begin() as connection:
+        add_missing_columns(connection)
+        create_vector_index(connection)
@@ -0,0 +1,145 @@
+"""
+Concurrent download of Google Docs. Requests run in a thread pool (each thread
+with its own service object, they aren't thread-safe), limited per user by an
+AdaptiveLimiter that backs off when the API returns 429 or 5xx responses
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """
+    Limit the number of concurrent requests with additive increase,
+    multiplicative decrease (AIMD): the limit halves when a request is
+    throttled and grows by one after a full window of successful requests,
+    up to max_concurrency
+    """
+
+    def __init__(self, max_concurrency) -> None:
+        self._max_concurrency = max_concurrency
+        self._limit = float(max_concurrency)
+        self._active = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= int(self._limit):
+                self._condition.wait()
+
+            self._active += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self._active -= 1
+
+            if throttled:
+                self._limit = max(1.0, self._limit / 2)
+            else:
+                self._limit = min(
+                    self._max_concurrency, self._limit + 1 / int(self._limit)
+                )
+
+            self._condition.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(key, max_concurrency):
+    """
+    Return the limiter for key (e.g., the user's email), shared by every sync
+    in this process so concurrent syncs for the same user share its limit
+    """
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter(max_concurrency)
+
+        return _limiters[key]
+
+
+def _backoff(attempt, retry_after=None, base=0.5, cap=30.0):
+    if retry_after is not None:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def fetch_documents(
+    build_service, document_ids, limiter, max_workers=8, max_retries=5, stats=None
+):
+    """
+    Download documents concurrently, yields them in the same order as
+    document_ids
+
+    Parameters
+    ----------
+    build_service : callable
+        Returns a new Docs API service, it's called once per thread
+
+    document_ids : list of str
+        The documents to download
+
+    limiter : AdaptiveLimiter
+        Limits the requests in flight, see get_limiter
+
+    max_workers : int, default=8
+        Number of threads, the limiter may allow fewer concurrent requests
+
+    max_retries : int, default=5
+        Retries for 429 and 5xx responses, other errors are raised
+
+    stats : dict, optional
+        If passed, the number of "requests" and "throttled" responses are
+        added to it
+    """
+    local = threading.local()
+    stats_lock = threading.Lock()
+
+    def count(key):
+        if stats is not None:
+            with stats_lock:
+                stats[key] = stats.get(key, 0) + 1
+
+    def fetch(document_id):
+        # .documents() builds the resource's methods (and their docstrings)
+        # on every call, so keep it too
+        if not hasattr(local, "documents"):
+            local.documents = build_service().documents()
+
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            count("requests")
+
+            try:
+                document = local.documents.get(documentId=document_id).execute()
+            except HttpError as e:
+                retry = e.resp.status in RETRY_STATUSES
+                limiter.release(throttled=retry)
+
+                if not retry or attempt == max_retries:
+                    raise
+
+                count("throttled")
+                time.sleep(_backoff(attempt, e.resp.get("retry-after")))
+            else:
+                limiter.release()
+                return document
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(fetch, document_ids)
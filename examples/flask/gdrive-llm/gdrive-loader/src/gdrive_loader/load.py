@@ -1,9 +1,12 @@
-from gdrive_loader.models import User, Document
+from gdrive_loader.models import User, Document, Chunk
 from gdrive_loader.credentials import get_valid_credentials
 from googleapiclient.discovery import build
 import argparse
+import hashlib
 from sqlalchemy.orm import Session
 from gdrive_loader.db import engine
+from gdrive_loader.fetch import fetch_documents, get_limiter
+from gdrive_loader.chunking import chunk_text, embed_texts, mean_embedding
 from openai import OpenAI
 
 
@@ -59,24 +62,23 @@ def convert_doc_to_markdown(document):
     return markdown
 
 
-def load_documents_from_user(email, dry_run=False, limit=None):
-    with Session(engine) as db_session:
-        user = db_session.query(User).filter_by(email=email).first()
+# maximum concurrent document downloads per user
+MAX_WORKERS = 8
 
-        if not user:
-            raise ValueError(f"User {email} not found")
+DOCS_MIME_TYPE = "application/vnd.google-apps.document"
 
-        credentials = get_valid_credentials(user, db_session)
+FILE_FIELDS = "id, name, mimeType, modifiedTime, trashed"
+
+
+def hash_content(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-    # Use the credentials to access Google Drive
-    drive_service = build("drive", "v3", credentials=credentials)
-    docs_service = build("docs", "v1", credentials=credentials)
 
-    # Query for Google Docs files only
-    query = "mimeType = 'application/vnd.google-apps.document' and trashed=false"
+def list_documents(drive_service, limit=None):
+    """List the user's Google Docs"""
+    query = f"mimeType = '{DOCS_MIME_TYPE}' and trashed=false"
     page_token = None
     docs = []
-    docs_processed = 0
 
     while True:
         # Get next page of results
@@ -85,7 +87,7 @@ def load_documents_from_user(email, dry_run=False, limit=None):
             .list(
                 q=query,
                 pageSize=100,
-                fields="nextPageToken, files(id, name)",
+                fields=f"nextPageToken, files({FILE_FIELDS})",
                 pageToken=page_token,
             )
             .execute()
@@ -96,38 +98,212 @@ def load_documents_from_user(email, dry_run=False, limit=None):
 
         # Check if we've reached the limit
         if limit and len(docs) >= limit:
-            docs = docs[:limit]
-            break
+            return docs[:limit]
 
         # Get the next page token
         page_token = results.get("nextPageToken")
         if not page_token:
-            break
+            return docs
+
+
+def list_changes(drive_service, page_token):
+    """
+    Return the Google Docs changed since page_token, the ids of the files
+    removed (or trashed) since then, and the page token for the next sync
+    """
+    changed, removed = {}, set()
+
+    while True:
+        results = (
+            drive_service.changes()
+            .list(
+                pageToken=page_token,
+                pageSize=100,
+                fields=(
+                    "nextPageToken, newStartPageToken, "
+                    f"changes(fileId, removed, file({FILE_FIELDS}))"
+                ),
+            )
+            .execute()
+        )
+
+        # a file can change more than once, keep its latest state
+        for change in results.get("changes", []):
+            file = change.get("file")
+
+            if change.get("removed") or file is None or file.get("trashed"):
+                changed.pop(change["fileId"], None)
+                removed.add(change["fileId"])
+            elif file["mimeType"] == DOCS_MIME_TYPE:
+                removed.discard(file["id"])
+                changed[file["id"]] = file
+
+        if "newStartPageToken" in results:
+            return list(changed.values()), removed, results["newStartPageToken"]
+
+        page_token = results["nextPageToken"]
+
+
+def set_chunks(document, chunks, embeddings):
+    """Replace the document's chunks, its embedding is the chunks' average"""
+    document.chunks = [
+        Chunk(
+            user_id=document.user_id,
+            position=position,
+            content=content,
+            embedding=embedding,
+        )
+        for position, (content, embedding) in enumerate(zip(chunks, embeddings))
+    ]
+    document.embedding = mean_embedding(embeddings) if embeddings else None
+
+
+def load_unchunked(user_id):
+    """
+    Return (google_drive_id, content) of the user's documents without chunks,
+    e.g., the ones stored before documents were split into chunks
+    """
+    with Session(engine) as db_session:
+        return (
+            db_session.query(Document.google_drive_id, Document.content)
+            .filter(
+                Document.user_id == user_id,
+                Document.content.is_not(None),
+                Document.content != "",
+                ~Document.chunks.any(),
+            )
+            .all()
+        )
 
-    if not docs:
-        print("No Google Docs found.")
-        return
 
-    # First get all document contents and convert to markdown
+def load_documents_from_user(
+    email, dry_run=False, limit=None, full=False, max_workers=MAX_WORKERS
+):
+    """
+    Sync the user's Google Docs. The first run (or full=True) lists every
+    document (up to limit), later runs only look at the files changed since the
+    previous one (via the Drive changes API). Documents are downloaded only if
+    their modifiedTime changed (max_workers at a time, fewer if the API
+    throttles), and embedded only if their content did. Documents without
+    chunks (e.g., stored before documents were split into chunks) are chunked
+    and embedded from their stored content
+    """
+    with Session(engine) as db_session:
+        user = db_session.query(User).filter_by(email=email).first()
+
+        if not user:
+            raise ValueError(f"User {email} not found")
+
+        credentials = get_valid_credentials(user, db_session)
+        user_id, page_token = user.id, user.drive_page_token
+
+    # Use the credentials to access Google Drive
+    drive_service = build("drive", "v3", credentials=credentials)
+
+    if page_token and not full:
+        docs, removed, new_page_token = list_changes(drive_service, page_token)
+    else:
+        # get the token before listing, so changes made meanwhile aren't missed
+        new_page_token = (
+            drive_service.changes().getStartPageToken().execute()["startPageToken"]
+        )
+        docs, removed = list_documents(drive_service, limit=limit), set()
+
+    with Session(engine) as db_session:
+        stored = {
+            row.google_drive_id: row
+            for row in db_session.query(
+                Document.google_drive_id,
+                Document.modified_time,
+                Document.content_hash,
+                Document.chunks.any().label("has_chunks"),
+            ).filter_by(user_id=user_id)
+        }
+
+    modified = [
+        doc
+        for doc in docs
+        if doc["id"] not in stored
+        or stored[doc["id"]].modified_time != doc["modifiedTime"]
+    ]
+    removed = [drive_id for drive_id in removed if drive_id in stored]
+
+    print(
+        f"{len(docs)} documents listed, {len(modified)} modified, "
+        f"{len(removed)} removed"
+    )
+
+    # First get the modified documents and convert them to markdown
     markdown_docs = []
-    for doc in docs:
+    documents = fetch_documents(
+        # service objects aren't thread-safe, each thread builds its own
+        lambda: build("docs", "v1", credentials=credentials),
+        [doc["id"] for doc in modified],
+        limiter=get_limiter(email, max_workers),
+        max_workers=max_workers,
+    )
+    for doc, document in zip(modified, documents):
         print(f"Converting {doc['name']}...")
-        document = docs_service.documents().get(documentId=doc["id"]).execute()
-        # limiting to 2000 characters to prevent going over the max context of the model
-        markdown_content = convert_doc_to_markdown(document)[:2_000]
-        markdown_docs.append((doc["id"], doc["name"], markdown_content))
+        markdown_content = convert_doc_to_markdown(document)
+        markdown_docs.append(
+            (
+                doc["id"],
+                doc["name"],
+                doc["modifiedTime"],
+                markdown_content,
+                hash_content(markdown_content),
+            )
+        )
+
+    # a new modifiedTime doesn't mean the text changed (e.g., a comment), but
+    # documents stored before they were split into chunks need them anyway
+    to_embed = [
+        md
+        for md in markdown_docs
+        if md[0] not in stored
+        or stored[md[0]].content_hash != md[4]
+        or not stored[md[0]].has_chunks
+    ]
+
+    # the unmodified documents without chunks are chunked from their content
+    downloaded = {md[0] for md in markdown_docs}
+    unchunked = {
+        drive_id: content
+        for drive_id, content in load_unchunked(user_id)
+        if drive_id not in downloaded and drive_id not in removed
+    }
 
     if dry_run:
-        for _, name, _ in markdown_docs:
+        for _, name, _, _, _ in to_embed:
             print(f"Would process document: {name}")
+        for drive_id in unchunked:
+            print(f"Would chunk document: {drive_id}")
+        for drive_id in removed:
+            print(f"Would remove document: {drive_id}")
         return
 
-    # Compute embeddings in batch
-    embeddings = compute_embedding([md[2] for md in markdown_docs], return_single=False)
+    # Split the documents into chunks and embed all of them in batches
+    chunks = {md[0]: chunk_text(md[3]) for md in to_embed}
+    chunks.update(
+        (drive_id, chunk_text(content)) for drive_id, content in unchunked.items()
+    )
+    texts = [text for doc_chunks in chunks.values() for text in doc_chunks]
+    print(f"Embedding {len(texts)} chunks...")
+    all_embeddings = embed_texts(texts, compute_embedding)
+
+    embeddings, start = {}, 0
+    for drive_id, doc_chunks in chunks.items():
+        embeddings[drive_id] = all_embeddings[start : start + len(doc_chunks)]
+        start += len(doc_chunks)
 
     # Store everything in database
     with Session(engine) as db_session:
-        for (drive_id, name, content), embedding in zip(markdown_docs, embeddings):
+        if removed:
+            db_session.query(Document).filter(
+                Document.user_id == user_id, Document.google_drive_id.in_(removed)
+            ).delete()
+
+        for drive_id, name, modified_time, content, content_hash in markdown_docs:
             # Check if document already exists
             existing_doc = (
                 db_session.query(Document).filter_by(google_drive_id=drive_id).first()
@@ -136,22 +312,37 @@ def load_documents_from_user(email, dry_run=False, limit=None):
             if existing_doc:
                 # Update existing document
                 existing_doc.name = name
-                existing_doc.content = content
-                existing_doc.embedding = embedding
-                print(f"Updated document: {name}")
+                existing_doc.modified_time = modified_time
+
+                if drive_id in embeddings:
+                    existing_doc.content = content
+                    existing_doc.content_hash = content_hash
+                    set_chunks(existing_doc, chunks[drive_id], embeddings[drive_id])
+                    print(f"Updated document: {name}")
 
             else:
                 # Create new document
                 db_doc = Document(
                     name=name,
                     content=content,
-                    embedding=embedding,
                     google_drive_id=drive_id,
-                    user_id=user.id,
+                    user_id=user_id,
+                    modified_time=modified_time,
+                    content_hash=content_hash,
                 )
+                set_chunks(db_doc, chunks[drive_id], embeddings[drive_id])
                 db_session.add(db_doc)
                 print(f"Saved new document: {name}")
 
+        for existing_doc in db_session.query(Document).filter(
+            Document.user_id == user_id, Document.google_drive_id.in_(unchunked)
+        ):
+            drive_id = existing_doc.google_drive_id
+            set_chunks(existing_doc, chunks[drive_id], embeddings[drive_id])
+            print(f"Chunked document: {existing_doc.name}")
+
+        # only move the token forward once the changes are stored
+        db_session.get(User, user_id).drive_page_token = new_page_token
         db_session.commit()
 
 
@@ -164,8 +355,25 @@ if __name__ == "__main__":
     parser.add_argument(
         "--limit",
         type=int,
-        help="Maximum number of documents to process",
+        help="Maximum number of documents to list in a full sync",
         default=20,
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Maximum number of documents to download concurrently",
+        default=MAX_WORKERS,
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="List every document instead of the changes since the last sync",
+    )
     args = parser.parse_args()
-    load_documents_from_user(args.email, dry_run=args.dry_run, limit=args.limit)
+    load_documents_from_user(
+        args.email,
+        dry_run=args.dry_run,
+        limit=args.limit,
+        full=args.full,
+        max_workers=args.workers,
+    )
@@ -6,11 +6,23 @@ from sqlalchemy import (
     Text,
     func,
     CheckConstraint,
+    Float,
+    select,
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.types import TypeDecorator, BLOB
 from sqlite_vec import serialize_float32
-from sqlalchemy import text, ForeignKey
+from sqlalchemy import ForeignKey, event, column, table as sql_table
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.visitors import replacement_traverse
+import logging
+
+# vec0 returns at most this many neighbors per query
+MAX_KNN = 4096
+
+logger = logging.getLogger(__name__)
 
 
 class Base(DeclarativeBase):
@@ -23,6 +35,8 @@ class User(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     email: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
     token_info: Mapped[str] = mapped_column(Text, nullable=False)
+    # Drive changes page token, where the next incremental sync starts
+    drive_page_token: Mapped[str] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, default=func.now(), onupdate=func.now()
@@ -48,7 +62,81 @@ class FloatArray(TypeDecorator):
         return value
 
 
-class Document(Base):
+class SimilaritySearchMixin:
+    """
+    Adds find_similar to models with id, user_id and embedding columns, whose
+    embeddings are indexed in {__tablename__}_vec (see create_vector_index)
+    """
+
+    @classmethod
+    def find_similar(
+        cls,
+        session,
+        embedding,
+        user_id,
+        limit: int = None,
+        exact: bool = False,
+        filters=(),
+        options=(),
+    ):
+        """
+        Return (row, distance) pairs for the user's rows closest to embedding
+        (L2 distance), in a single query. filters are extra WHERE clauses,
+        e.g., Document.google_drive_id.in_(ids), and options are loader
+        options, e.g., joinedload(Chunk.document) to load each chunk's
+        document in the same query
+
+        Uses the {__tablename__}_vec index unless exact=True, there is no limit (or
+        it's above MAX_KNN) or the index hasn't been created, in which case
+        every row is scanned. Filters comparing a column stored in the index
+        (see VECTOR_INDEXES) with a value (==, !=, <, <=, >, >= or in_) are
+        applied by the KNN query, any other filter makes it scan every row
+        (and log a warning), since a KNN query returns the top limit before
+        filtering
+        """
+        embedding = serialize_float32(embedding)
+        index = _vector_index_table(cls.__table__)
+        index_filters = [_filter_on_index(f, cls.__table__, index) for f in filters]
+        use_index = not exact and limit and limit <= MAX_KNN
+
+        if use_index and any(f is None for f in index_filters):
+            logger.warning(
+                "Scanning every row of %s, only comparisons of %s with a value "
+                "can use the vector index",
+                cls.__tablename__,
+                ", ".join(VECTOR_INDEXES[cls.__tablename__]) or "no columns",
+            )
+            use_index = False
+
+        if use_index and has_vector_index(session.connection(), cls.__tablename__):
+            knn = (
+                select(index.c.rowid.label("id"), index.c.distance)
+                .where(
+                    index.c.embedding.op("MATCH")(embedding),
+                    index.c.k == limit,
+                    index.c.user_id == user_id,
+                    *index_filters,
+                )
+                .subquery("knn")
+            )
+            query = (
+                select(cls, knn.c.distance)
+                .join(knn, cls.id == knn.c.id)
+                .order_by(knn.c.distance)
+            )
+        else:
+            distance = func.vec_distance_L2(cls.embedding, embedding).label("distance")
+            query = (
+                select(cls, distance)
+                .where(cls.user_id == user_id, cls.embedding.is_not(None), *filters)
+                .order_by(distance)
+                .limit(limit)
+            )
+
+        return list(session.execute(query.options(*options)).tuples())
+
+
+class Document(SimilaritySearchMixin, Base):
     __tablename__ = "documents"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -64,6 +152,16 @@ class Document(Base):
     user_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("users.id"), nullable=False
     )
+    # the file's modifiedTime in Drive and the sha256 of the markdown the
+    # embedding was computed from, to skip unchanged documents when syncing
+    modified_time: Mapped[str] = mapped_column(String(64), nullable=True)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+
+    chunks: Mapped[list["Chunk"]] = relationship(
+        back_populates="document",
+        cascade="all, delete-orphan",
+        order_by="Chunk.position",
+    )
 
     __table_args__ = (
         CheckConstraint(
@@ -72,33 +170,214 @@ class Document(Base):
         ),
     )
 
-    @classmethod
-    def find_similar(cls, session, embedding, user_id, limit: int = None):
-        query = text(
-            """
-            SELECT id, vec_distance_L2(embedding, :embedding) as distance
-            FROM documents
-            WHERE user_id = :user_id
-            ORDER BY distance
-            """
-            + (f"LIMIT {limit}" if limit else "")
-        )
+    def to_markdown(self):
+        return f"""
+# {self.name}
 
-        result = session.execute(
-            query, {"embedding": serialize_float32(embedding), "user_id": user_id}
-        )
+{self.content}
+"""
+
+
+class Chunk(SimilaritySearchMixin, Base):
+    """A fragment of a document, with its own embedding"""
+
+    __tablename__ = "chunks"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    document_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("documents.id"), nullable=False, index=True
+    )
+    # the document's user, so the index can be partitioned by it
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id"), nullable=False
+    )
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    embedding: Mapped[bytes] = mapped_column(FloatArray, nullable=True)
 
-        # Fetch the actual Document objects and pair them with their distances
-        documents_with_distances = []
-        for row in result:
-            document = session.get(cls, row.id)
-            documents_with_distances.append(document)
+    document: Mapped["Document"] = relationship(back_populates="chunks")
 
-        return documents_with_distances
+    __table_args__ = (
+        CheckConstraint(
+            "embedding IS NULL OR (typeof(embedding) = 'blob' "
+            "AND vec_length(embedding) = 1536)",
+            name="check_chunk_embedding_type_and_length",
+        ),
+    )
 
     def to_markdown(self):
         return f"""
-# {self.name}
+# {self.document.name} (part {self.position + 1})
 
 {self.content}
 """
+
+
+# {table}_vec is a sqlite-vec index of a table's embeddings, partitioned by
+# user so a query only scans the user's vectors. Triggers keep it in sync with
+# the table, including bulk and raw SQL updates that skip the ORM. It also
+# stores the columns listed here (as vec0 metadata columns, with their vec0
+# type), so find_similar can filter by them within the KNN query. They must be
+# NOT NULL, vec0 can't store NULL metadata
+VECTOR_INDEXES = {
+    "documents": {"google_drive_id": "text"},
+    "chunks": {"document_id": "integer"},
+}
+
+# comparisons that vec0 applies to metadata columns
+METADATA_OPERATORS = {
+    operators.eq,
+    operators.ne,
+    operators.lt,
+    operators.le,
+    operators.gt,
+    operators.ge,
+    operators.in_op,
+}
+
+
+def _vector_index_table(table):
+    """The {table}_vec index as a table construct, to build KNN queries"""
+    return sql_table(
+        f"{table.name}_vec",
+        column("rowid", Integer),
+        column("user_id", Integer),
+        column("embedding"),
+        column("k", Integer),
+        column("distance", Float),
+        *(column(name, table.c[name].type) for name in VECTOR_INDEXES[table.name]),
+    )
+
+
+def _filter_on_index(condition, table, index):
+    """
+    Return condition on the index's metadata columns, or None if the index
+    can't apply it (e.g., it uses other columns or operators)
+    """
+    if not (
+        isinstance(condition, BinaryExpression)
+        and condition.operator in METADATA_OPERATORS
+        and isinstance(condition.left, Column)
+        and condition.left.table is table
+        and condition.left.name in VECTOR_INDEXES[table.name]
+        and isinstance(condition.right, BindParameter)
+    ):
+        return None
+
+    return replacement_traverse(
+        condition,
+        {},
+        lambda element: (index.c[element.name] if element is condition.left else None),
+    )
+
+
+def _vector_index_ddl(table):
+    metadata = VECTOR_INDEXES[table]
+    columns = ", ".join(["user_id", "embedding", *metadata])
+    values = ", ".join(f"NEW.{name}" for name in ["user_id", "embedding", *metadata])
+    definitions = "".join(
+        f",\n            {name} {type_}" for name, type_ in metadata.items()
+    )
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table}_vec USING vec0(
+            user_id integer partition key,
+            embedding float[1536]{definitions}
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_vec_insert
+        AFTER INSERT ON {table}
+        WHEN NEW.embedding IS NOT NULL
+        BEGIN
+            INSERT INTO {table}_vec(rowid, {columns})
+            VALUES (NEW.id, {values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_vec_update
+        AFTER UPDATE OF {columns} ON {table}
+        BEGIN
+            DELETE FROM {table}_vec WHERE rowid = OLD.id;
+            INSERT INTO {table}_vec(rowid, {columns})
+            SELECT NEW.id, {values}
+            WHERE NEW.embedding IS NOT NULL;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_vec_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            DELETE FROM {table}_vec WHERE rowid = OLD.id;
+        END
+        """,
+    ]
+
+
+def _drop_outdated_vector_index(connection, table):
+    """
+    Drop {table}_vec and its triggers if it lacks any of the columns in
+    VECTOR_INDEXES (e.g., it was created before they were added)
+    """
+    indexed = {
+        row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table}_vec)")
+    }
+
+    if not indexed or set(VECTOR_INDEXES[table]) <= indexed:
+        return
+
+    for trigger in ("insert", "update", "delete"):
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {table}_vec_{trigger}")
+
+    connection.exec_driver_sql(f"DROP TABLE {table}_vec")
+
+
+# bulk deletes of documents skip the ORM cascade
+CHUNKS_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS documents_chunks_delete
+AFTER DELETE ON documents
+BEGIN
+    DELETE FROM chunks WHERE document_id = OLD.id;
+END
+"""
+
+
+def has_vector_index(connection, table="documents"):
+    return (
+        connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (f"{table}_vec",),
+        ).first()
+        is not None
+    )
+
+
+def create_vector_index(connection):
+    """
+    Create the vector indexes and their triggers (if missing, or rebuild them
+    if they lack columns) and add the rows that aren't indexed yet, so it can
+    run on an existing database
+    """
+    connection.exec_driver_sql(CHUNKS_DELETE_TRIGGER)
+
+    for table, metadata in VECTOR_INDEXES.items():
+        _drop_outdated_vector_index(connection, table)
+
+        for statement in _vector_index_ddl(table):
+            connection.exec_driver_sql(statement)
+
+        columns = ", ".join(["user_id", "embedding", *metadata])
+        connection.exec_driver_sql(
+            f"""
+            INSERT INTO {table}_vec(rowid, {columns})
+            SELECT id, {columns}
+            FROM {table}
+            WHERE embedding IS NOT NULL
+            AND id NOT IN (SELECT rowid FROM {table}_vec)
+            """
+        )
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_vector_index(target, connection, **kwargs):
+    create_vector_index(connection)
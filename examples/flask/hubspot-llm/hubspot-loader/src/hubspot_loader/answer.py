@@ -33,7 +33,7 @@ def answer_query(query: str) -> str:
         },
         {
             "role": "user",
-            "content": "\n\n".join([doc.to_markdown() for doc in similar_docs]),
+            "content": "\n\n".join([doc.to_markdown() for doc, _ in similar_docs]),
         },
         {
             "role": "user",
@@ -6,13 +6,25 @@ from sqlalchemy import (
     Text,
     func,
     CheckConstraint,
+    Float,
+    select,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.types import TypeDecorator, BLOB
 from sqlite_vec import serialize_float32
-from sqlalchemy import text
+from sqlalchemy import event, column, table as sql_table
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.visitors import replacement_traverse
+import logging
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# vec0 returns at most this many neighbors per query
+MAX_KNN = 4096
+
+logger = logging.getLogger(__name__)
+
 
 class Base(DeclarativeBase):
     pass
@@ -78,25 +90,64 @@ class Document(Base):
     )
 
     @classmethod
-    def find_similar(cls, session, embedding, limit: int = None):
-        query = text(
-            """
-            SELECT id, vec_distance_L2(embedding, :embedding) as distance
-            FROM documents
-            ORDER BY distance
-            """
-            + (f"LIMIT {limit}" if limit else "")
-        )
-
-        result = session.execute(query, {"embedding": serialize_float32(embedding)})
-
-        # Fetch the actual Document objects and pair them with their distances
-        documents_with_distances = []
-        for row in result:
-            document = session.get(cls, row.id)
-            documents_with_distances.append(document)
-
-        return documents_with_distances
+    def find_similar(
+        cls,
+        session,
+        embedding,
+        limit: int = None,
+        exact: bool = False,
+        filters=(),
+    ):
+        """
+        Return (document, distance) pairs for the documents closest to
+        embedding (L2 distance), in a single query. filters are extra WHERE
+        clauses, e.g., Document.hubspot_ticket_id.in_(ticket_ids)
+
+        Uses the documents_vec index unless exact=True, there is no limit (or
+        it's above MAX_KNN) or the index hasn't been created, in which case
+        every row is scanned. Filters comparing a column stored in the index
+        (see VECTOR_INDEX_COLUMNS) with a value (==, !=, <, <=, >, >= or in_)
+        are applied by the KNN query, any other filter makes it scan every row
+        (and log a warning), since a KNN query returns the top limit before
+        filtering
+        """
+        embedding = serialize_float32(embedding)
+        index_filters = [_filter_on_index(f) for f in filters]
+        use_index = not exact and limit and limit <= MAX_KNN
+
+        if use_index and any(f is None for f in index_filters):
+            logger.warning(
+                "Scanning every row of documents, only comparisons of %s with a "
+                "value can use the vector index",
+                ", ".join(VECTOR_INDEX_COLUMNS),
+            )
+            use_index = False
+
+        if use_index and has_vector_index(session.connection()):
+            knn = (
+                select(DOCUMENTS_VEC.c.rowid.label("id"), DOCUMENTS_VEC.c.distance)
+                .where(
+                    DOCUMENTS_VEC.c.embedding.op("MATCH")(embedding),
+                    DOCUMENTS_VEC.c.k == limit,
+                    *index_filters,
+                )
+                .subquery("knn")
+            )
+            query = (
+                select(cls, knn.c.distance)
+                .join(knn, cls.id == knn.c.id)
+                .order_by(knn.c.distance)
+            )
+        else:
+            distance = func.vec_distance_L2(cls.embedding, embedding).label("distance")
+            query = (
+                select(cls, distance)
+                .where(cls.embedding.is_not(None), *filters)
+                .order_by(distance)
+                .limit(limit)
+            )
+
+        return list(session.execute(query).tuples())
 
     def to_markdown(self):
         return f"""
@@ -104,3 +155,151 @@ class Document(Base):
 
 {self.content}
 """
+
+
+# documents_vec is a sqlite-vec index of the embeddings. Triggers keep it in
+# sync with the documents table, including bulk and raw SQL updates that skip
+# the ORM. It also stores the columns listed here (as vec0 metadata columns,
+# with their vec0 type), so find_similar can filter by them within the KNN
+# query. They must be NOT NULL, vec0 can't store NULL metadata
+VECTOR_INDEX_COLUMNS = {"hubspot_ticket_id": "text"}
+
+_INDEXED = ", ".join(["embedding", *VECTOR_INDEX_COLUMNS])
+_NEW_VALUES = ", ".join(f"NEW.{name}" for name in ["embedding", *VECTOR_INDEX_COLUMNS])
+_DEFINITIONS = "".join(
+    f",\n        {name} {type_}" for name, type_ in VECTOR_INDEX_COLUMNS.items()
+)
+
+VECTOR_INDEX_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS documents_vec USING vec0(
+        embedding float[1536]{_DEFINITIONS}
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS documents_vec_insert
+    AFTER INSERT ON documents
+    WHEN NEW.embedding IS NOT NULL
+    BEGIN
+        INSERT INTO documents_vec(rowid, {_INDEXED})
+        VALUES (NEW.id, {_NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS documents_vec_update
+    AFTER UPDATE OF {_INDEXED} ON documents
+    BEGIN
+        DELETE FROM documents_vec WHERE rowid = OLD.id;
+        INSERT INTO documents_vec(rowid, {_INDEXED})
+        SELECT NEW.id, {_NEW_VALUES}
+        WHERE NEW.embedding IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS documents_vec_delete
+    AFTER DELETE ON documents
+    BEGIN
+        DELETE FROM documents_vec WHERE rowid = OLD.id;
+    END
+    """,
+]
+
+# documents_vec as a table construct, to build KNN queries
+DOCUMENTS_VEC = sql_table(
+    "documents_vec",
+    column("rowid", Integer),
+    column("embedding"),
+    column("k", Integer),
+    column("distance", Float),
+    *(column(name, Document.__table__.c[name].type) for name in VECTOR_INDEX_COLUMNS),
+)
+
+# comparisons that vec0 applies to metadata columns
+METADATA_OPERATORS = {
+    operators.eq,
+    operators.ne,
+    operators.lt,
+    operators.le,
+    operators.gt,
+    operators.ge,
+    operators.in_op,
+}
+
+
+def _filter_on_index(condition):
+    """
+    Return condition on documents_vec's metadata columns, or None if the index
+    can't apply it (e.g., it uses other columns or operators)
+    """
+    if not (
+        isinstance(condition, BinaryExpression)
+        and condition.operator in METADATA_OPERATORS
+        and isinstance(condition.left, Column)
+        and condition.left.table is Document.__table__
+        and condition.left.name in VECTOR_INDEX_COLUMNS
+        and isinstance(condition.right, BindParameter)
+    ):
+        return None
+
+    return replacement_traverse(
+        condition,
+        {},
+        lambda element: (
+            DOCUMENTS_VEC.c[element.name] if element is condition.left else None
+        ),
+    )
+
+
+def _drop_outdated_vector_index(connection):
+    """
+    Drop documents_vec and its triggers if it lacks any of the columns in
+    VECTOR_INDEX_COLUMNS (e.g., it was created before they were added)
+    """
+    indexed = {
+        row[1] for row in connection.exec_driver_sql("PRAGMA table_info(documents_vec)")
+    }
+
+    if not indexed or set(VECTOR_INDEX_COLUMNS) <= indexed:
+        return
+
+    for trigger in ("insert", "update", "delete"):
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS documents_vec_{trigger}")
+
+    connection.exec_driver_sql("DROP TABLE documents_vec")
+
+
+def has_vector_index(connection):
+    return (
+        connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'documents_vec'"
+        ).first()
+        is not None
+    )
+
+
+def create_vector_index(connection):
+    """
+    Create the documents_vec index and its triggers (if missing, or rebuild
+    them if the index lacks columns) and add the documents that aren't indexed
+    yet, so it can run on an existing database
+    """
+    _drop_outdated_vector_index(connection)
+
+    for statement in VECTOR_INDEX_DDL:
+        connection.exec_driver_sql(statement)
+
+    connection.exec_driver_sql(
+        f"""
+        INSERT INTO documents_vec(rowid, {_INDEXED})
+        SELECT id, {_INDEXED}
+        FROM documents
+        WHERE embedding IS NOT NULL
+        AND id NOT IN (SELECT rowid FROM documents_vec)
+        """
+    )
+
+
+@event.listens_for(Document.__table__, "after_create")
+def _create_vector_index(target, connection, **kwargs):
+    create_vector_index(connection)
@@ -1,6 +1,6 @@
 from openai import OpenAI
 import mistune
-from pdf_loader.models import Document
+from pdf_loader.models import Chunk
 from sqlalchemy.orm import Session
 from pdf_loader.db import engine
 from pdf_loader.embedding import compute_embedding
@@ -21,7 +21,8 @@ Respond in markdown format.
 def answer_query(query: str) -> str:
     embedding = compute_embedding(query, return_single=True)
     with Session(engine) as db_session:
-        similar_docs = Document.find_similar(
+        # search the chunks, whole documents may not fit in the context
+        similar_chunks = Chunk.find_similar(
             db_session,
             embedding=embedding,
             limit=5,
@@ -34,7 +35,7 @@ def answer_query(query: str) -> str:
         },
         {
             "role": "user",
-            "content": "\n\n".join([doc.content for doc in similar_docs]),
+            "content": "\n\n".join([chunk.content for chunk, _ in similar_chunks]),
         },
         {
             "role": "user",
@@ -1,9 +1,11 @@
 from celery import Celery
+from celery.signals import worker_ready
 from pdf_loader import SETTINGS
-from pdf_loader.models import Document, DocumentStatus
+from pdf_loader.models import Document, DocumentStatus, Chunk
 from pdf_loader.db import engine
 from sqlalchemy.orm import Session
 from pdf_loader.embedding import compute_embedding
+from pdf_loader.chunking import chunk_text, embed_texts, mean_embedding
 from pathlib import Path
 import easyocr
 import fitz  # PyMuPDF
@@ -24,14 +26,55 @@ def process_pdf_document(filename: str):
 
         content = pdf_ocr(filename)
 
-        # to prevent going over the max length
-        embedding = compute_embedding(content[:5000])
         document.content = content
-        document.embedding = embedding
+        set_chunks(document, content)
         document.status = DocumentStatus.COMPLETED
         db_session.commit()
 
 
+def set_chunks(document, content):
+    """
+    Embed the whole document, in chunks that fit the model's input, its
+    embedding is the chunks' average
+    """
+    chunks = chunk_text(content)
+    embeddings = embed_texts(chunks, compute_embedding)
+    document.chunks = [
+        Chunk(position=position, content=chunk, embedding=embedding)
+        for position, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+    ]
+    document.embedding = mean_embedding(embeddings) if embeddings else None
+
+
+@app.task
+def chunk_documents():
+    """
+    Chunk and embed the processed documents without chunks (e.g., processed
+    before documents were split into chunks) from their stored content
+    """
+    with Session(engine) as db_session:
+        documents = (
+            db_session.query(Document)
+            .filter(
+                Document.status == DocumentStatus.COMPLETED,
+                Document.content.is_not(None),
+                Document.content != "",
+                ~Document.chunks.any(),
+            )
+            .all()
+        )
+
+        for document in documents:
+            set_chunks(document, document.content)
+            db_session.commit()
+
+
+@worker_ready.connect
+def _chunk_documents_on_startup(sender, **kwargs):
+    # existing databases get their chunks once the worker is upgraded
+    chunk_documents.delay()
+
+
 def pdf_ocr(filename: str) -> str:
     content = Path(SETTINGS.PATH_TO_UPLOADS / filename).read_bytes()
 
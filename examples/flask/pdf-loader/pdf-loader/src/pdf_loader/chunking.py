@@ -0,0 +1,90 @@
+"""
+Split documents into overlapping chunks of at most CHUNK_TOKENS tokens, and
+embed them with concurrent requests that stay within the embeddings API
+limits
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import tiktoken
+
+# text-embedding-3-small's tokenizer
+ENCODING_NAME = "cl100k_base"
+
+CHUNK_TOKENS = 512
+OVERLAP_TOKENS = 64
+
+# per request limits of the embeddings API
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_TOKENS = 300_000
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    return tiktoken.get_encoding(ENCODING_NAME)
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap=OVERLAP_TOKENS):
+    """
+    Split text into chunks of max_tokens tokens, each one repeating the last
+    overlap tokens of the previous one so sentences at the edges keep some
+    context
+    """
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+
+    if not tokens:
+        return []
+
+    step = max_tokens - overlap
+    return [
+        encoding.decode(tokens[start : start + max_tokens])
+        for start in range(0, max(len(tokens) - overlap, 1), step)
+    ]
+
+
+def iter_batches(token_counts, max_items=MAX_BATCH_ITEMS, max_tokens=MAX_BATCH_TOKENS):
+    """
+    Split the indexes of token_counts into consecutive batches with at most
+    max_items items and max_tokens tokens
+    """
+    batch, n_tokens = [], 0
+
+    for i, count in enumerate(token_counts):
+        if batch and (len(batch) == max_items or n_tokens + count > max_tokens):
+            yield batch
+            batch, n_tokens = [], 0
+
+        batch.append(i)
+        n_tokens += count
+
+    if batch:
+        yield batch
+
+
+def embed_texts(texts, compute_embedding, max_workers=4):
+    """
+    Embed texts, sending the batches concurrently (max_workers at a time),
+    returns the embeddings in the same order as texts
+    """
+    encoding = get_encoding()
+    batches = list(iter_batches([len(encoding.encode(text)) for text in texts]))
+
+    def embed(batch):
+        return compute_embedding([texts[i] for i in batch], return_single=False)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [
+            embedding
+            for embeddings in executor.map(embed, batches)
+            for embedding in embeddings
+        ]
+
+
+def mean_embedding(embeddings):
+    """The average of the chunks' embeddings, used as the document's"""
+    return [sum(values) / len(embeddings) for values in zip(*embeddings)]
@@ -1,6 +1,6 @@
 from sqlalchemy import create_engine, event
 from pdf_loader import SETTINGS
-from pdf_loader.models import Base
+from pdf_loader.models import Base, create_vector_index
 import sqlite_vec  # Import your SQLite extension module
 
 engine = create_engine(SETTINGS.DB_URI)
@@ -21,3 +21,7 @@ def load_sqlite_extension(dbapi_connection, connection_record):
 if __name__ == "__main__":
     print("Creating tables...")
     Base.metadata.create_all(engine)
+
+    # create_all skips existing tables, so add the index to older databases
+    with engine.begin() as connection:
+        create_vector_index(connection)